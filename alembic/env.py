@@ -16,7 +16,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
 
 
 # add your model's MetaData object here
@@ -60,6 +61,12 @@ def run_migrations_online():
 
     """
 
+    # a connection given by the caller (e.g. tests)
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations_connection(connection)
+        return
+
     alembic_config = config.get_section(config.config_ini_section)
     app_config_file = config.get_section('app')['config_file']
     app_config = Config()
@@ -69,13 +76,17 @@ def run_migrations_online():
     engine = engine_from_config(alembic_config)
 
     with engine.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=target_metadata
-        )
+        run_migrations_connection(connection)
+
+
+def run_migrations_connection(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata
+    )
 
-        with context.begin_transaction():
-            context.run_migrations()
+    with context.begin_transaction():
+        context.run_migrations()
 
 
 if context.is_offline_mode():
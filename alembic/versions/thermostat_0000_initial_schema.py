@@ -0,0 +1,141 @@
+"""Initial schema: sensors, readings, devices, event log and schedules
+
+Revision ID: thermostat_0000
+Revises:
+Create Date: 2018-12-19 10:00:00.000000
+
+The tables as they were before the shipped migrations. On existing databases
+(created by locally generated revisions) the tables are already there and are
+left alone.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0000'
+down_revision = None
+branch_labels = ('thermostat',)
+depends_on = None
+
+
+def _create_sensors():
+    op.create_table(
+        'sensors',
+        sa.Column('id', sa.String(length=255), nullable=False),
+        sa.Column('protocol', sa.String(length=20), nullable=True),
+        sa.Column('address', sa.String(length=255), nullable=True),
+        sa.Column('sensor_type', sa.String(length=20), nullable=True),
+        sa.Column('icon', sa.String(length=50), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def _create_readings():
+    op.create_table(
+        'sensor_readings',
+        sa.Column('sensor_id', sa.String(length=255), nullable=False),
+        sa.Column('sensor_type', sa.String(length=20), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('unit', sa.String(length=20), nullable=True),
+        sa.Column('value', sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint('sensor_id', 'sensor_type', 'timestamp'),
+    )
+
+
+def _create_devices():
+    op.create_table(
+        'devices',
+        sa.Column('id', sa.String(length=100), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=True),
+        sa.Column('protocol', sa.String(length=20), nullable=True),
+        sa.Column('address', sa.String(length=255), nullable=True),
+        sa.Column('device_type', sa.String(length=20), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def _create_event_log():
+    op.create_table(
+        'event_log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('level', sa.String(length=30), nullable=True),
+        sa.Column('source', sa.String(length=100), nullable=True),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.String(length=300), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def _create_schedules():
+    op.create_table(
+        'schedules',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('description', sa.String(length=255), nullable=True),
+        sa.Column('enabled', sa.Boolean(), server_default='0', nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def _create_behaviors():
+    op.create_table(
+        'schedule_behaviors',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('schedule_id', sa.Integer(), nullable=True),
+        sa.Column('behavior_name', sa.String(length=100), nullable=True),
+        sa.Column('behavior_order', sa.SmallInteger(), server_default='1', nullable=True),
+        sa.Column('start_time', sa.SmallInteger(), nullable=True),
+        sa.Column('end_time', sa.SmallInteger(), nullable=True),
+        sa.Column('config', sa.String(length=500), server_default='{}', nullable=True),
+        sa.ForeignKeyConstraint(['schedule_id'], ['schedules.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def _create_behavior_sensors():
+    op.create_table(
+        'behavior_sensors',
+        sa.Column('behavior_id', sa.Integer(), nullable=False),
+        sa.Column('sensor_id', sa.String(length=255), nullable=False),
+        sa.ForeignKeyConstraint(['behavior_id'], ['schedule_behaviors.id']),
+        sa.PrimaryKeyConstraint('behavior_id', 'sensor_id'),
+    )
+
+
+def _create_behavior_devices():
+    op.create_table(
+        'behavior_devices',
+        sa.Column('behavior_id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.String(length=100), nullable=False),
+        sa.ForeignKeyConstraint(['behavior_id'], ['schedule_behaviors.id']),
+        sa.PrimaryKeyConstraint('behavior_id', 'device_id'),
+    )
+
+
+# in creation order (dependencies first)
+TABLES = (
+    ('sensors', _create_sensors),
+    ('sensor_readings', _create_readings),
+    ('devices', _create_devices),
+    ('event_log', _create_event_log),
+    ('schedules', _create_schedules),
+    ('schedule_behaviors', _create_behaviors),
+    ('behavior_sensors', _create_behavior_sensors),
+    ('behavior_devices', _create_behavior_devices),
+)
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    for name, create in TABLES:
+        if name not in tables:
+            create()
+
+
+def downgrade():
+    for name, create in reversed(TABLES):
+        op.drop_table(name)
@@ -0,0 +1,186 @@
+"""Compact sensor_readings: series lookup table, epoch timestamps and float values
+
+Revision ID: thermostat_0001
+Revises: thermostat_0000
+Create Date: 2018-12-20 10:00:00.000000
+
+Shipped migrations live on their own "thermostat" branch, independent from the
+locally generated revisions. Existing readings are converted in chunks.
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0001'
+down_revision = 'thermostat_0000'
+branch_labels = None
+depends_on = None
+
+# rows converted per query
+CHUNK_SIZE = 10000
+
+old_readings = sa.table(
+    'sensor_readings_old',
+    sa.column('sensor_id', sa.String),
+    sa.column('sensor_type', sa.String),
+    sa.column('timestamp', sa.DateTime),
+    sa.column('unit', sa.String),
+    sa.column('value', sa.String),
+)
+
+series = sa.table(
+    'sensor_series',
+    sa.column('id', sa.Integer),
+    sa.column('sensor_id', sa.String),
+    sa.column('sensor_type', sa.String),
+    sa.column('unit', sa.String),
+)
+
+readings = sa.table(
+    'sensor_readings',
+    sa.column('series_id', sa.Integer),
+    sa.column('timestamp', sa.Integer),
+    sa.column('value', sa.Float),
+)
+
+
+def _insert_ignore(table):
+    return table.insert().prefix_with('OR IGNORE', dialect='sqlite').prefix_with('IGNORE', dialect='mysql')
+
+
+def _create_series():
+    op.create_table(
+        'sensor_series',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sensor_id', sa.String(length=255), nullable=False),
+        sa.Column('sensor_type', sa.String(length=20), nullable=False),
+        sa.Column('unit', sa.String(length=20), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sensor_id', 'sensor_type', 'unit'),
+    )
+
+
+def _create_readings():
+    if op.get_bind().dialect.name == 'sqlite':
+        # rows clustered by (series, timestamp), no separate rowid b-tree
+        op.execute('CREATE TABLE sensor_readings ('
+                   'series_id INTEGER NOT NULL REFERENCES sensor_series (id), '
+                   'timestamp INTEGER NOT NULL, '
+                   'value FLOAT, '
+                   'PRIMARY KEY (series_id, timestamp)'
+                   ') WITHOUT ROWID')
+    else:
+        op.create_table(
+            'sensor_readings',
+            sa.Column('series_id', sa.Integer(), nullable=False),
+            sa.Column('timestamp', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('value', sa.Float(), nullable=True),
+            sa.ForeignKeyConstraint(['series_id'], ['sensor_series.id']),
+            sa.PrimaryKeyConstraint('series_id', 'timestamp'),
+        )
+    op.create_index('ix_sensor_readings_timestamp', 'sensor_readings', ['timestamp'])
+
+
+def _convert(bind):
+    """Copies the readings from the old table, chunk by chunk."""
+    for row in bind.execute(sa.select([old_readings.c.sensor_id, old_readings.c.sensor_type,
+                                       old_readings.c.unit]).distinct()).fetchall():
+        bind.execute(_insert_ignore(series).values(sensor_id=row.sensor_id, sensor_type=row.sensor_type,
+                                                   unit=row.unit or ''))
+    series_ids = {(row.sensor_id, row.sensor_type, row.unit): row.id for row in bind.execute(series.select())}
+
+    statement = _insert_ignore(readings)
+    last = None
+    while True:
+        query = old_readings.select()
+        if last is not None:
+            # keyset pagination over the old primary key
+            query = query.where(sa.or_(old_readings.c.sensor_id > last.sensor_id,
+                                       sa.and_(old_readings.c.sensor_id == last.sensor_id,
+                                               sa.or_(old_readings.c.sensor_type > last.sensor_type,
+                                                      sa.and_(old_readings.c.sensor_type == last.sensor_type,
+                                                              old_readings.c.timestamp > last.timestamp)))))
+        query = query.order_by(old_readings.c.sensor_id, old_readings.c.sensor_type,
+                               old_readings.c.timestamp).limit(CHUNK_SIZE)
+        rows = bind.execute(query).fetchall()
+        if not rows:
+            break
+
+        converted = []
+        for row in rows:
+            try:
+                value = float(row.value)
+            except (TypeError, ValueError):
+                # not a number, can't be stored anymore
+                continue
+            converted.append({
+                'series_id': series_ids[(row.sensor_id, row.sensor_type, row.unit or '')],
+                'timestamp': int(row.timestamp.timestamp()),
+                'value': value,
+            })
+        if converted:
+            bind.execute(statement, converted)
+        last = rows[-1]
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = sa.inspect(bind).get_table_names()
+
+    if 'sensor_series' not in tables:
+        _create_series()
+
+    if 'sensor_readings' not in tables:
+        _create_readings()
+    elif 'series_id' not in [c['name'] for c in sa.inspect(bind).get_columns('sensor_readings')]:
+        op.rename_table('sensor_readings', 'sensor_readings_old')
+        _create_readings()
+        _convert(bind)
+        op.drop_table('sensor_readings_old')
+
+
+def downgrade():
+    bind = op.get_bind()
+    op.drop_index('ix_sensor_readings_timestamp', 'sensor_readings')
+    op.rename_table('sensor_readings', 'sensor_readings_new')
+    op.create_table(
+        'sensor_readings',
+        sa.Column('sensor_id', sa.String(length=255), nullable=False),
+        sa.Column('sensor_type', sa.String(length=20), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('unit', sa.String(length=20), nullable=True),
+        sa.Column('value', sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint('sensor_id', 'sensor_type', 'timestamp'),
+    )
+
+    new_readings = sa.table('sensor_readings_new', *[sa.column(c.name, c.type) for c in readings.c])
+    old = sa.table('sensor_readings', *[sa.column(c.name, c.type) for c in old_readings.c])
+    last = None
+    while True:
+        query = sa.select([new_readings.c.series_id, new_readings.c.timestamp, new_readings.c.value,
+                           series.c.sensor_id, series.c.sensor_type, series.c.unit]) \
+            .select_from(new_readings.join(series, series.c.id == new_readings.c.series_id))
+        if last is not None:
+            query = query.where(sa.or_(new_readings.c.series_id > last.series_id,
+                                       sa.and_(new_readings.c.series_id == last.series_id,
+                                               new_readings.c.timestamp > last.timestamp)))
+        rows = bind.execute(query.order_by(new_readings.c.series_id, new_readings.c.timestamp)
+                            .limit(CHUNK_SIZE)).fetchall()
+        if not rows:
+            break
+
+        bind.execute(_insert_ignore(old), [{
+            'sensor_id': row.sensor_id,
+            'sensor_type': row.sensor_type,
+            'timestamp': datetime.datetime.fromtimestamp(row.timestamp),
+            'unit': row.unit or None,
+            'value': str(row.value),
+        } for row in rows])
+        last = rows[-1]
+
+    op.drop_table('sensor_readings_new')
+    op.drop_table('sensor_series')
@@ -0,0 +1,25 @@
+"""Count of collapsed repeated events in event_log
+
+Revision ID: thermostat_0002
+Revises: thermostat_0001
+Create Date: 2018-12-22 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0002'
+down_revision = 'thermostat_0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('event_log', sa.Column('count', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    with op.batch_alter_table('event_log') as batch_op:
+        batch_op.drop_column('count')
@@ -0,0 +1,67 @@
+"""Materialized last reading of every sensor
+
+Revision ID: thermostat_0003
+Revises: thermostat_0002
+Create Date: 2018-12-23 10:00:00.000000
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0003'
+down_revision = 'thermostat_0002'
+branch_labels = None
+depends_on = None
+
+series = sa.table(
+    'sensor_series',
+    sa.column('id', sa.Integer),
+    sa.column('sensor_id', sa.String),
+    sa.column('sensor_type', sa.String),
+    sa.column('unit', sa.String),
+)
+
+readings = sa.table(
+    'sensor_readings',
+    sa.column('series_id', sa.Integer),
+    sa.column('timestamp', sa.Integer),
+    sa.column('value', sa.Float),
+)
+
+
+def upgrade():
+    latest_readings = op.create_table(
+        'latest_readings',
+        sa.Column('sensor_id', sa.String(length=255), nullable=False),
+        sa.Column('sensor_type', sa.String(length=20), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('unit', sa.String(length=20), nullable=True),
+        sa.Column('value', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('sensor_id', 'sensor_type')
+    )
+
+    # one lookup per series using the primary key; a sensor might have several series (one per unit)
+    conn = op.get_bind()
+    latest = {}
+    for series_id, sensor_id, sensor_type, unit in conn.execute(
+            sa.select([series.c.id, series.c.sensor_id, series.c.sensor_type, series.c.unit])):
+        row = conn.execute(sa.select([readings.c.timestamp, readings.c.value])
+                           .where(readings.c.series_id == series_id)
+                           .order_by(readings.c.timestamp.desc()).limit(1)).first()
+        key = (sensor_id, sensor_type)
+        if row is not None and (key not in latest or row.timestamp > latest[key]['timestamp']):
+            latest[key] = {'sensor_id': sensor_id, 'sensor_type': sensor_type,
+                           'timestamp': row.timestamp, 'unit': unit or None, 'value': row.value}
+
+    for reading in latest.values():
+        reading['timestamp'] = datetime.datetime.fromtimestamp(reading['timestamp'])
+    if latest:
+        op.bulk_insert(latest_readings, list(latest.values()))
+
+
+def downgrade():
+    op.drop_table('latest_readings')
@@ -0,0 +1,25 @@
+"""Validity of the last reading of every sensor
+
+Revision ID: thermostat_0004
+Revises: thermostat_0003
+Create Date: 2018-12-24 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0004'
+down_revision = 'thermostat_0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('latest_readings', sa.Column('validity', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('latest_readings') as batch_op:
+        batch_op.drop_column('validity')
@@ -0,0 +1,29 @@
+"""Indexes for filtering event_log
+
+Revision ID: thermostat_0005
+Revises: thermostat_0004
+Create Date: 2018-12-26 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0005'
+down_revision = 'thermostat_0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_event_log_level_id', 'event_log', ['level', 'id'], unique=False)
+    op.create_index('ix_event_log_source_id', 'event_log', ['source', 'id'], unique=False)
+    op.create_index('ix_event_log_name_id', 'event_log', ['name', 'id'], unique=False)
+    op.create_index('ix_event_log_timestamp', 'event_log', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_event_log_timestamp', table_name='event_log')
+    op.drop_index('ix_event_log_name_id', table_name='event_log')
+    op.drop_index('ix_event_log_source_id', table_name='event_log')
+    op.drop_index('ix_event_log_level_id', table_name='event_log')
@@ -0,0 +1,52 @@
+"""Per-minute, hour and day rollups of sensor readings
+
+Revision ID: thermostat_0006
+Revises: thermostat_0005
+Create Date: 2018-12-27 10:00:00.000000
+
+The tables might already exist if they were created by a locally generated
+revision: only the missing tables and indexes are created. Run
+tools/backfill_rollups.py afterwards to compute the rollups of the stored readings.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'thermostat_0006'
+down_revision = 'thermostat_0005'
+branch_labels = None
+depends_on = None
+
+TABLES = ('sensor_readings_minute', 'sensor_readings_hour', 'sensor_readings_day')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    for table in TABLES:
+        if table not in tables:
+            op.create_table(
+                table,
+                sa.Column('sensor_id', sa.String(length=255), nullable=False),
+                sa.Column('sensor_type', sa.String(length=20), nullable=False),
+                sa.Column('timestamp', sa.DateTime(), nullable=False),
+                sa.Column('unit', sa.String(length=20), nullable=True),
+                sa.Column('min_value', sa.Float(), nullable=True),
+                sa.Column('max_value', sa.Float(), nullable=True),
+                sa.Column('sum_value', sa.Float(), nullable=True),
+                sa.Column('count', sa.Integer(), nullable=True),
+                sa.PrimaryKeyConstraint('sensor_id', 'sensor_type', 'timestamp'),
+            )
+            indexes = []
+        else:
+            indexes = [i['name'] for i in inspector.get_indexes(table)]
+        index = 'ix_{}_timestamp'.format(table)
+        if index not in indexes:
+            op.create_index(index, table, ['timestamp', 'sensor_id', 'sensor_type'], unique=False)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_table(table)
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import asyncio
+import tempfile
 import logging.config
 
 from sanic.log import logger, LOGGING_CONFIG_DEFAULTS
@@ -9,7 +11,9 @@ from sanic.log import logger, LOGGING_CONFIG_DEFAULTS
 from hbmqtt.client import MQTTClient
 from hbmqtt.broker import Broker
 
-from thermostat import app
+from thermostat import app, database
+from thermostat.models import Base
+from thermostat.mqttman import MQTTManager
 
 
 broker_config = {
@@ -53,10 +57,13 @@ class BaseTest(object):
         logging.config.dictConfig(LOGGING_CONFIG_DEFAULTS)
         logger.setLevel(logging.DEBUG)
 
+        app.config['BROKER_TOPIC'] = 'homeassistant'
+        app.config['DEVICE_ID'] = 'thermorasp'
         app.broker_url = 'mqtt://127.0.0.1:9883/'
         app.eventlog = DummyEventLogger()
         self.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.loop)
+        app.mqtt = MQTTManager(app.broker_url, app.new_topic('#'))
 
     def tearDown(self):
         self.loop.stop()
@@ -82,3 +89,20 @@ class BaseTest(object):
             pass
         if future.exception():
             raise future.exception()
+
+
+class DatabaseTest(object):
+    """A temporary database with all the tables: self.database (session factory) and self.db (AsyncDatabase)."""
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.database = database.init('sqlite:///' + self.db_path)
+        Base.metadata.create_all(self.database.kw['bind'])
+        self.db = database.AsyncDatabase(self.database)
+
+    def tearDown(self):
+        # stop the worker threads before removing the file
+        self.db.shutdown()
+        self.database.kw['bind'].dispose()
+        os.remove(self.db_path)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from hbmqtt.client import MQTTClient, QOS_0
+
+from thermostat.broker import EmbeddedBroker, LocalMQTTManager, broker_config
+
+from . import BaseTest
+
+
+class EmbeddedBrokerTest(BaseTest, unittest.TestCase):
+
+    def testLocalManager(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = EmbeddedBroker(broker_config('127.0.0.1:9884'))
+                yield from broker.start()
+                manager = LocalMQTTManager(broker, 'home/thermorasp/#')
+                received = []
+
+                @asyncio.coroutine
+                def callback(topic, payload):
+                    received.append((topic, payload))
+
+                # a network client (e.g. a remote sensor)
+                client = MQTTClient(config={'auto_reconnect': False})
+                yield from client.connect('mqtt://127.0.0.1:9884/')
+                yield from client.subscribe([('home/thermorasp/device/+/state', QOS_0)])
+
+                yield from manager.subscribe('home/thermorasp/#', callback)
+                yield from manager.publish('home/thermorasp/device/boiler/state', b'{"enabled":true}', retain=True)
+                yield from client.publish('home/thermorasp/sensor/remote/temperature', b'20', retain=True)
+                message = yield from asyncio.wait_for(client.deliver_message(), 2)
+                yield from asyncio.sleep(0.2)
+
+                # retained messages from both sides are replayed to new local subscribers
+                replayed = []
+
+                @asyncio.coroutine
+                def late(topic, payload):
+                    replayed.append((topic, payload))
+
+                yield from manager.subscribe('home/thermorasp/+/+/+', late)
+                yield from asyncio.sleep(0.1)
+
+                yield from client.disconnect()
+                yield from manager.disconnect()
+                yield from broker.shutdown()
+
+                self.assertEqual((message.topic, bytes(message.data)),
+                                 ('home/thermorasp/device/boiler/state', b'{"enabled":true}'))
+                self.assertEqual(received, [
+                    ('home/thermorasp/device/boiler/state', b'{"enabled":true}'),
+                    ('home/thermorasp/sensor/remote/temperature', b'20'),
+                ])
+                self.assertEqual(sorted(replayed), sorted(received))
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from sanic.response import json
+
+from thermostat import app
+from thermostat.controllers.cache import cached, etag_matches, make_etag
+
+
+class FakeRequest(object):
+    def __init__(self, query_string='', if_none_match=None):
+        self.query_string = query_string
+        self.headers = {'If-None-Match': if_none_match} if if_none_match else {}
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.calls = 0
+
+        @cached('test')
+        async def handler(request, item_id):
+            self.calls += 1
+            return json({'id': item_id, 'calls': self.calls})
+
+        self.handler = handler
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _get(self, item_id, **kwargs):
+        return self.loop.run_until_complete(self.handler(FakeRequest(**kwargs), item_id))
+
+    def testCache(self):
+        response = self._get(1)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status, 200)
+        self.assertEqual(etag, make_etag('test', app.versions['test'], repr(((1, ), (), ''))))
+
+        # served from the cache with the same ETag
+        cached_response = self._get(1)
+        self.assertEqual(cached_response.body, response.body)
+        self.assertEqual(cached_response.headers['ETag'], etag)
+        self.assertEqual(self.calls, 1)
+        self._get(1, query_string='a=1')
+        self._get(2)
+        self.assertEqual(self.calls, 3)
+
+        response = self._get(1, if_none_match=etag)
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.body, b'')
+
+        # other representations have their own ETag
+        response = self._get(1, query_string='a=1', if_none_match=etag)
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        response = self._get(2, if_none_match=etag)
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.calls, 3)
+
+        app.changed('test')
+        response = self._get(1, if_none_match=etag)
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(self.calls, 4)
+
+    def testEtagMatches(self):
+        self.assertTrue(etag_matches('"a-1"', '"a-1"'))
+        self.assertTrue(etag_matches('"b-1", W/"a-1"', '"a-1"'))
+        self.assertTrue(etag_matches('*', '"a-1"'))
+        self.assertFalse(etag_matches('"a-2"', '"a-1"'))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import threading
+import unittest
+
+from thermostat.models import Sensor
+from thermostat.util import LoopLagMonitor
+
+from . import BaseTest, DatabaseTest
+
+
+class AsyncDatabaseTest(BaseTest, DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        DatabaseTest.setUp(self)
+
+    def tearDown(self):
+        DatabaseTest.tearDown(self)
+        BaseTest.tearDown(self)
+
+    @staticmethod
+    def _add_sensor(session, sensor_id):
+        session.add(Sensor(id=sensor_id, protocol='local', sensor_type='temperature'))
+        return threading.get_ident()
+
+    @staticmethod
+    def _slow_count(session):
+        # a heavy query
+        time.sleep(0.5)
+        return session.query(Sensor).count()
+
+    def testSingleWriter(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                threads = yield from asyncio.gather(*[self.db.write(self._add_sensor, 'sensor_{}'.format(i))
+                                                      for i in range(10)])
+                self.assertEqual(len(set(threads)), 1)
+                self.assertEqual((yield from self.db.read(lambda session: session.query(Sensor).count())), 10)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testLoopNotBlocked(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                monitor = LoopLagMonitor(0.05)
+                monitor.startup()
+                # concurrent heavy reads and a write while the loop keeps ticking
+                results = yield from asyncio.gather(self.db.read(self._slow_count),
+                                                    self.db.read(self._slow_count),
+                                                    self.db.write(self._add_sensor, 'sensor'))
+                monitor.shutdown()
+                self.assertEqual(len(results), 3)
+                self.assertGreater(monitor.stats()['samples'], 5)
+                self.assertLess(monitor.stats()['max'], 0.1)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
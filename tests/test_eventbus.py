@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from thermostat.eventbus import EventBus
+
+
+class EventBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def testEmit(self):
+        bus = EventBus()
+        received = []
+
+        async def first(*args):
+            received.append(('first',) + args)
+
+        async def failing(*args):
+            raise ValueError()
+
+        async def last(*args):
+            received.append(('last',) + args)
+
+        bus.subscribe('test', first)
+        bus.subscribe('test', failing)
+        bus.subscribe('test', last)
+        bus.subscribe('other', first)
+
+        bus.emit('test', 1)
+        # nothing runs until the loop does
+        self.assertEqual(received, [])
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(received, [('first', 1), ('last', 1)])
+
+        bus.unsubscribe('test', first)
+        bus.unsubscribe('test', first)
+        bus.emit('test', 2)
+        bus.emit('missing')
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(received[2:], [('last', 2)])
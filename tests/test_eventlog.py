@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import datetime
+import unittest
+
+from thermostat.database import scoped_session
+from thermostat.eventlog import EventLogger, serialize_event
+from thermostat.models import EventLog
+from thermostat.models.eventlog import get_events
+
+from . import BaseTest, DatabaseTest
+
+
+class EventLoggerTest(BaseTest, DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        DatabaseTest.setUp(self)
+
+    def tearDown(self):
+        DatabaseTest.tearDown(self)
+        BaseTest.tearDown(self)
+
+    def _events(self):
+        with scoped_session(self.database) as session:
+            return [(e.source, e.name, e.description, e.count) for e in session.query(EventLog).order_by(EventLog.id)]
+
+    def testCollapse(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                eventlog = EventLogger(self.db, batch_size=100, max_age=60, window=60)
+                eventlog.startup()
+                eventlog.event('info', 'boiler', 'device:control', 'enabled:1')
+                eventlog.event('info', 'boiler', 'device:control', 'enabled:0')
+                eventlog.event('info', 'behavior', 'behavior:action', 'target: 20')
+                # nothing is written until the batch is flushed
+                self.assertEqual(self._events(), [])
+                yield from eventlog.flush()
+                self.assertEqual(self._events(), [
+                    ('boiler', 'device:control', 'enabled:0', 2),
+                    ('behavior', 'behavior:action', 'target: 20', 1),
+                ])
+
+                # repeated after the row was written: the row is updated
+                eventlog.event('info', 'boiler', 'device:control', 'enabled:1')
+                yield from eventlog.shutdown()
+                self.assertEqual(self._events(), [
+                    ('boiler', 'device:control', 'enabled:1', 3),
+                    ('behavior', 'behavior:action', 'target: 20', 1),
+                ])
+                self.assertEqual(eventlog.stats()['collapsed'], 2)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testWindow(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                eventlog = EventLogger(self.db, batch_size=100, max_age=60, window=0.1)
+                eventlog.startup()
+                eventlog.event('info', 'boiler', 'device:control', 'enabled:1')
+                yield from asyncio.sleep(0.2)
+                eventlog.event('info', 'boiler', 'device:control', 'enabled:0')
+                eventlog.event('info', 'behavior', 'behavior:action', 'target: 20')
+                yield from eventlog.shutdown()
+                self.assertEqual(self._events(), [
+                    ('boiler', 'device:control', 'enabled:1', 1),
+                    ('boiler', 'device:control', 'enabled:0', 1),
+                    ('behavior', 'behavior:action', 'target: 20', 1),
+                ])
+                # expired keys are forgotten at every flush
+                self.assertEqual(list(eventlog.recent), [('info', 'boiler', 'device:control'),
+                                                         ('info', 'behavior', 'behavior:action')])
+                yield from asyncio.sleep(0.2)
+                eventlog.event('info', 'behavior', 'behavior:action', 'target: 21')
+                yield from eventlog.flush()
+                self.assertEqual(list(eventlog.recent), [('info', 'behavior', 'behavior:action')])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testRecent(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                eventlog = EventLogger(self.db, batch_size=100, max_age=60, window=60, recent_size=3)
+                eventlog.startup()
+                self.assertEqual(eventlog.recent_page(20), ('[]', None, False))
+                for index in range(3):
+                    eventlog.event('info', 'test', 'event:{}'.format(index))
+                # in memory before being written
+                self.assertEqual(self._events(), [])
+                self.assertEqual(self._recent(eventlog, 2), ([3, 2], 2, True))
+                self.assertEqual(self._recent(eventlog, 20), ([3, 2, 1], 1, False))
+                yield from eventlog.flush()
+                self.assertEqual(self._recent(eventlog, 20), ([3, 2, 1], 1, False))
+
+                # collapsed events are updated in place, the oldest events are dropped
+                eventlog.event('info', 'test', 'event:1')
+                eventlog.event('info', 'test', 'event:3')
+                self.assertEqual(self._recent(eventlog, 3), ([4, 3, 2], 2, True))
+                self.assertEqual(json.loads(eventlog.recent_page(3)[0])[2]['count'], 2)
+                yield from eventlog.shutdown()
+                self.assertEqual(self._events(), [
+                    ('test', 'event:0', None, 1),
+                    ('test', 'event:1', None, 2),
+                    ('test', 'event:2', None, 1),
+                    ('test', 'event:3', None, 1),
+                ])
+                # some events are not in memory anymore
+                self.assertIsNone(eventlog.recent_page(4))
+
+                # loaded from the database at startup
+                eventlog = EventLogger(self.db, recent_size=3)
+                eventlog.startup()
+                self.assertEqual(self._recent(eventlog, 3), ([4, 3, 2], 2, True))
+                yield from eventlog.shutdown()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    @staticmethod
+    def _recent(eventlog, limit):
+        events, last_id, more = eventlog.recent_page(limit)
+        return [e['id'] for e in json.loads(events)], last_id, more
+
+
+class EventLogQueryTest(DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        start = datetime.datetime(2018, 12, 1)
+        with scoped_session(self.database) as session:
+            session.execute(EventLog.__table__.insert(), [{
+                'timestamp': start + datetime.timedelta(minutes=index),
+                'level': 'error' if index % 10 == 0 else 'info',
+                'source': 'backend' if index % 2 == 0 else 'boiler',
+                'name': 'test',
+                'count': 1,
+            } for index in range(1, 101)])
+
+    def testPages(self):
+        with scoped_session(self.database) as session:
+            events, more = get_events(session, level='error', limit=4)
+            self.assertEqual([e.id for e in events], [100, 90, 80, 70])
+            self.assertTrue(more)
+            events, more = get_events(session, level='error', after_id=70, limit=4)
+            self.assertEqual([e.id for e in events], [60, 50, 40, 30])
+            events, more = get_events(session, level='error', after_id=30, limit=4)
+            self.assertEqual([e.id for e in events], [20, 10])
+            self.assertFalse(more)
+
+            events, more = get_events(session, level=['error', 'info'], source='boiler', after_id=5,
+                                      limit=2, ascending=True)
+            self.assertEqual([e.id for e in events], [7, 9])
+            events, more = get_events(session, date_from=datetime.datetime(2018, 12, 1, 0, 10),
+                                      date_to=datetime.datetime(2018, 12, 1, 0, 12))
+            self.assertEqual([e.id for e in events], [12, 11, 10])
+            self.assertFalse(more)
+
+            # models and table rows are serialized the same way
+            row = session.execute(EventLog.__table__.select().where(EventLog.id == 12)).first()
+            self.assertEqual(serialize_event(events[0]), serialize_event(row))
+            self.assertEqual(serialize_event(row)['timestamp'], '2018-12-01T00:12:00')
+
+    def testIndexes(self):
+        with self.database.kw['bind'].connect() as conn:
+            plan = ' '.join(str(row[-1]) for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM event_log WHERE level = 'error' ORDER BY id DESC LIMIT 20"))
+        self.assertIn('ix_event_log_level_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
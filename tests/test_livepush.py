@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import json
+import asyncio
+import unittest
+
+from thermostat import livepush
+from thermostat.livepush import LiveHub
+
+from . import BaseTest
+
+
+class LiveHubTest(BaseTest, unittest.TestCase):
+
+    @staticmethod
+    def _messages(client):
+        return [json.loads(frame.decode()[len('data: '):]) for frame in client.take()]
+
+    def testFilters(self):
+        hub = LiveHub(None)
+        hub.publish('behavior/active', b'')
+        everything = hub.connect(['#'])
+        temperature = hub.connect(['sensor/+/temperature'])
+        # the last value of every topic comes first
+        self.assertEqual(self._messages(everything), [{'topic': 'behavior/active', 'data': None}])
+        self.assertEqual(self._messages(temperature), [])
+
+        hub.publish('sensor/s1/temperature', b'{"value":20.5}')
+        hub.publish('sensor/s1/humidity', b'{"value":40}')
+        hub.publish('device/boiler/state', b'{"enabled":true}')
+        self.assertEqual([m['topic'] for m in self._messages(everything)],
+                         ['sensor/s1/temperature', 'sensor/s1/humidity', 'device/boiler/state'])
+        self.assertEqual(self._messages(temperature), [{'topic': 'sensor/s1/temperature', 'data': {'value': 20.5}}])
+
+        hub.disconnect(temperature)
+        self.assertEqual(hub.stats()['clients'], 1)
+
+    def testSlowClient(self):
+        hub = LiveHub(None)
+        client = hub.connect(['#'])
+        for value in range(10):
+            hub.publish('sensor/s1/temperature', '{{"value":{}}}'.format(value).encode())
+        hub.publish('device/boiler/state', b'{"enabled":true}')
+        hub.publish('sensor/s2/temperature', b'{"value":20}')
+        # only the last value of each topic is sent
+        self.assertEqual(self._messages(client), [
+            {'topic': 'sensor/s1/temperature', 'data': {'value': 9}},
+            {'topic': 'device/boiler/state', 'data': {'enabled': True}},
+            {'topic': 'sensor/s2/temperature', 'data': {'value': 20}},
+        ])
+        self.assertEqual(client.dropped, 9)
+        self.assertFalse(client.ready.is_set())
+
+    def testMaxTopics(self):
+        hub = LiveHub(None)
+        for index in range(livepush.MAX_TOPICS + 10):
+            hub.publish('device/d{}/state'.format(index), b'{"enabled":true}')
+        hub.publish('device/d10/state', b'{"enabled":false}')
+        hub.publish('device/new/state', b'{"enabled":true}')
+        # the least recently updated topics are forgotten first
+        self.assertEqual(len(hub.last), livepush.MAX_TOPICS)
+        self.assertNotIn('device/d11/state', hub.last)
+        self.assertEqual(list(hub.last)[-2:], ['device/d10/state', 'device/new/state'])
+
+    def testDisconnected(self):
+        class Response(object):
+            def __init__(self):
+                self.data = []
+
+            async def write(self, data):
+                if self.data:
+                    raise RuntimeError('transport closed')
+                self.data.append(data)
+
+        hub = LiveHub(None)
+        hub.MIN_INTERVAL = 0
+        hub.is_running = True
+        client = hub.connect(['#'])
+        response = Response()
+
+        async def publish():
+            hub.publish('sensor/s1/temperature', b'{"value":20}')
+            await asyncio.sleep(0.05)
+            hub.publish('sensor/s1/temperature', b'{"value":21}')
+
+        # the failed write ends the stream
+        self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(hub.stream(client, response), publish()), 2))
+        self.assertEqual([json.loads(d.decode()[len('data: '):]) for d in response.data],
+                         [{'topic': 'sensor/s1/temperature', 'data': {'value': 20}}])
+        self.assertEqual(hub.stats()['clients'], 0)
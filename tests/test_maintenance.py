@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from datetime import datetime, timedelta
+
+from thermostat import app
+from thermostat.database import scoped_session
+from thermostat.maintenance import Maintenance, enable_incremental_vacuum
+from thermostat.models import Reading, ReadingMinute, ReadingHour, EventLog
+from thermostat.writebehind import ReadingWriter
+
+from . import BaseTest, DatabaseTest
+
+
+class MaintenanceTest(BaseTest, DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        DatabaseTest.setUp(self)
+        app.config['RETENTION_READINGS'] = 30
+        app.config['RETENTION_READINGS_MINUTE'] = 60
+        app.config['RETENTION_EVENTS'] = 90
+        app.config['MAINTENANCE_BATCH_SIZE'] = 7
+        app.config['MAINTENANCE_BATCH_PAUSE'] = 0
+
+    def tearDown(self):
+        DatabaseTest.tearDown(self)
+        BaseTest.tearDown(self)
+
+    def _populate(self):
+        now = datetime.now().replace(microsecond=0)
+        readings = []
+        for days in range(100):
+            for sensor_id in ('temp_core', 'temp_room'):
+                readings.append({
+                    'sensor_id': sensor_id,
+                    'sensor_type': 'temperature',
+                    'timestamp': now - timedelta(days=days, minutes=1),
+                    'unit': 'celsius',
+                    'value': 20,
+                })
+        with scoped_session(self.database) as session:
+            ReadingWriter(self.db).write(session, readings)
+            for days in range(100):
+                session.add(EventLog(timestamp=now - timedelta(days=days, minutes=1),
+                                     level='info', source='test', name='test'))
+
+    def _count(self, model):
+        with scoped_session(self.database) as session:
+            return session.query(model).count()
+
+    def testRetention(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                self._populate()
+                maintenance = Maintenance(self.db)
+                deleted, reclaimed = yield from maintenance.run()
+                self.assertEqual(deleted, {
+                    'sensor_readings': 140,
+                    'sensor_readings_minute': 80,
+                    'event_log': 10,
+                })
+                self.assertEqual(self._count(Reading), 60)
+                self.assertEqual(self._count(ReadingMinute), 120)
+                # rollups are kept forever by default
+                self.assertEqual(self._count(ReadingHour), 200)
+                self.assertEqual(self._count(EventLog), 90)
+
+                # incremental vacuum is not enabled by maintenance
+                self.assertEqual(reclaimed, 0)
+                with self.database.kw['bind'].connect() as conn:
+                    self.assertEqual(conn.execute('PRAGMA auto_vacuum').scalar(), 0)
+                    self.assertGreater(conn.execute('PRAGMA freelist_count').scalar(), 0)
+
+                self.assertTrue(enable_incremental_vacuum(self.database.kw['bind']))
+                self.assertFalse(enable_incremental_vacuum(self.database.kw['bind']))
+                with self.database.kw['bind'].connect() as conn:
+                    self.assertEqual(conn.execute('PRAGMA auto_vacuum').scalar(), 2)
+                    self.assertEqual(conn.execute('PRAGMA freelist_count').scalar(), 0)
+
+                # nothing else to do
+                deleted, reclaimed = yield from maintenance.run()
+                self.assertEqual(deleted, {})
+                self.assertEqual(reclaimed, 0)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testCompact(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                app.config['MAINTENANCE_VACUUM_PAGES'] = 2
+                app.config['MAINTENANCE_VACUUM_STEPS'] = 3
+                engine = self.database.kw['bind']
+                enable_incremental_vacuum(engine)
+                with engine.connect() as conn:
+                    conn.execute('CREATE TABLE scratch (data TEXT)')
+                    conn.execute('INSERT INTO scratch VALUES (?)', [('x' * 1000,) for _ in range(100)])
+                    conn.execute('DROP TABLE scratch')
+                    page_size = conn.execute('PRAGMA page_size').scalar()
+                    free = conn.execute('PRAGMA freelist_count').scalar()
+                self.assertGreater(free, 12)
+
+                # a bounded number of steps per run
+                maintenance = Maintenance(self.db)
+                reclaimed = yield from maintenance.compact()
+                self.assertEqual(reclaimed, 6 * page_size)
+                with engine.connect() as conn:
+                    self.assertEqual(conn.execute('PRAGMA freelist_count').scalar(), free - 6)
+
+                reclaimed = yield from maintenance.compact()
+                self.assertEqual(reclaimed, 6 * page_size)
+                maintenance.vacuum_steps = 100
+                reclaimed = yield from maintenance.compact()
+                self.assertEqual(reclaimed, (free - 12) * page_size)
+                with engine.connect() as conn:
+                    self.assertEqual(conn.execute('PRAGMA freelist_count').scalar(), 0)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import os
+import datetime
+import tempfile
+import unittest
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+
+from thermostat.models import Base
+
+SCRIPT_LOCATION = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alembic')
+
+
+class MigrationsTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = create_engine('sqlite:///' + self.db_path)
+
+    def tearDown(self):
+        self.engine.dispose()
+        os.remove(self.db_path)
+
+    def _alembic(self, cmd, revision):
+        config = Config()
+        config.set_main_option('script_location', SCRIPT_LOCATION)
+        with self.engine.connect() as connection:
+            config.attributes['connection'] = connection
+            cmd(config, revision)
+
+    def _tables(self):
+        return set(inspect(self.engine).get_table_names()) - {'alembic_version'}
+
+    def testFreshDatabase(self):
+        self._alembic(command.upgrade, 'heads')
+        tables = self._tables()
+        self.assertEqual(tables, set(Base.metadata.tables))
+        # same columns as the models
+        inspector = inspect(self.engine)
+        for table in tables:
+            self.assertEqual(sorted(c['name'] for c in inspector.get_columns(table)),
+                             sorted(Base.metadata.tables[table].columns.keys()), table)
+
+        self._alembic(command.downgrade, 'base')
+        self.assertEqual(self._tables(), set())
+
+    def testEventLogCount(self):
+        # events logged before counting collapsed events
+        self._alembic(command.upgrade, 'thermostat_0000')
+        self.engine.execute("INSERT INTO event_log (timestamp, level, source, name) VALUES (?, 'info', 'test', 'old')",
+                            datetime.datetime(2018, 12, 1))
+        self._alembic(command.upgrade, 'heads')
+        self.engine.execute("INSERT INTO event_log (timestamp, level, source, name) VALUES (?, 'info', 'test', 'new')",
+                            datetime.datetime(2018, 12, 2))
+        self.assertEqual([tuple(row) for row in self.engine.execute('SELECT name, count FROM event_log ORDER BY id')],
+                         [('old', 1), ('new', 1)])
+
+    def testIndexes(self):
+        self._alembic(command.upgrade, 'heads')
+        inspector = inspect(self.engine)
+        for table in self._tables():
+            self.assertEqual(sorted((i['name'], tuple(i['column_names'])) for i in inspector.get_indexes(table)),
+                             sorted((i.name, tuple(c.name for c in i.columns))
+                                    for i in Base.metadata.tables[table].indexes), table)
+
+    def testExistingRollups(self):
+        # rollup tables created by a locally generated revision, without the index
+        self._alembic(command.upgrade, 'thermostat_0005')
+        self.engine.execute('CREATE TABLE sensor_readings_minute (sensor_id VARCHAR(255) NOT NULL, '
+                            'sensor_type VARCHAR(20) NOT NULL, timestamp DATETIME NOT NULL, unit VARCHAR(20), '
+                            'min_value FLOAT, max_value FLOAT, sum_value FLOAT, count INTEGER, '
+                            'PRIMARY KEY (sensor_id, sensor_type, timestamp))')
+        self._alembic(command.upgrade, 'heads')
+        self.assertEqual([i['name'] for i in inspect(self.engine).get_indexes('sensor_readings_minute')],
+                         ['ix_sensor_readings_minute_timestamp'])
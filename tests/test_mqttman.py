@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from thermostat import app
+from thermostat.mqttman import MQTTManager, TopicTrie, topic_matches, filter_covers
+
+from . import BaseTest
+
+
+class TopicTrieTest(unittest.TestCase):
+
+    def testMatch(self):
+        trie = TopicTrie()
+        trie.add('home/sensor/+/temperature', 'plus')
+        trie.add('home/sensor/#', 'hash')
+        trie.add('home/sensor/core/temperature', 'exact')
+        trie.add('#', 'all')
+
+        self.assertEqual(sorted(trie.match('home/sensor/core/temperature')), ['all', 'exact', 'hash', 'plus'])
+        self.assertEqual(sorted(trie.match('home/sensor/other/temperature')), ['all', 'hash', 'plus'])
+        self.assertEqual(sorted(trie.match('home/sensor')), ['all', 'hash'])
+        self.assertEqual(trie.match('home/device/boiler/state'), ['all'])
+        self.assertEqual(trie.match('$SYS/broker/uptime'), [])
+
+    def testReferenceCount(self):
+        trie = TopicTrie()
+        self.assertEqual(trie.add('home/sensor/+/+', 'cb'), 1)
+        self.assertEqual(trie.add('home/sensor/+/+', 'cb'), 2)
+        self.assertEqual(trie.add('home/sensor/core/+', 'cb'), 1)
+        # delivered once even if registered more than once
+        self.assertEqual(trie.match('home/sensor/core/temperature'), ['cb'])
+
+        self.assertEqual(trie.remove('home/sensor/+/+', 'cb'), 1)
+        self.assertEqual(trie.remove('home/sensor/+/+', 'cb'), 0)
+        self.assertEqual(trie.remove('home/sensor/+/+', 'cb'), -1)
+        self.assertEqual(trie.remove('home/sensor/core/+', 'cb'), 0)
+        self.assertEqual(trie.match('home/sensor/core/temperature'), [])
+        self.assertEqual(trie.root.children, {})
+
+    def testTopicMatches(self):
+        self.assertTrue(topic_matches('a/+/c', 'a/b/c'))
+        self.assertTrue(topic_matches('a/#', 'a'))
+        self.assertTrue(topic_matches('a/#', 'a/b/c'))
+        self.assertFalse(topic_matches('a/+', 'a/b/c'))
+        self.assertFalse(topic_matches('a/b/c/d', 'a/b/c'))
+
+    def testFilterCovers(self):
+        self.assertTrue(filter_covers('a/#', 'a/b/+'))
+        self.assertTrue(filter_covers('a/+/+', 'a/b/c'))
+        self.assertTrue(filter_covers('a/+/+', 'a/+/c'))
+        self.assertFalse(filter_covers('a/b/+', 'a/+/c'))
+        self.assertFalse(filter_covers('a/+', 'a/#'))
+        self.assertFalse(filter_covers('a/+', 'a/b/c'))
+
+
+class MQTTManagerTest(BaseTest, unittest.TestCase):
+
+    def testSharedSubscription(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = yield from self.startBroker()
+                manager = MQTTManager(app.broker_url, 'home/thermorasp/#')
+                received = {'first': [], 'second': []}
+
+                @asyncio.coroutine
+                def first(topic, payload):
+                    received['first'].append((topic, payload))
+
+                @asyncio.coroutine
+                def second(topic, payload):
+                    received['second'].append((topic, payload))
+
+                yield from manager.subscribe('home/thermorasp/sensor/+/+', first)
+                yield from manager.publish('home/thermorasp/sensor/core/temperature', b'20', retain=True)
+                yield from asyncio.sleep(0.2)
+
+                # covered by the root filter: no broker subscription, retained value replayed from cache
+                yield from manager.subscribe('home/thermorasp/sensor/core/+', second)
+                yield from asyncio.sleep(0.2)
+                self.assertEqual(list(manager.broker_filters), ['home/thermorasp/#'])
+                self.assertEqual(received['first'], [('home/thermorasp/sensor/core/temperature', b'20')])
+                self.assertEqual(received['second'], [('home/thermorasp/sensor/core/temperature', b'20')])
+
+                yield from manager.unsubscribe('home/thermorasp/sensor/+/+', first)
+                yield from manager.publish('home/thermorasp/sensor/core/temperature', b'21', retain=True)
+                yield from asyncio.sleep(0.2)
+                self.assertEqual(len(received['first']), 1)
+                self.assertEqual(received['second'][-1], ('home/thermorasp/sensor/core/temperature', b'21'))
+
+                yield from manager.disconnect()
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testForeignRetained(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = yield from self.startBroker()
+                client = yield from self.startClient()
+                yield from client.publish('home/thermorasp/device/boiler/state', b'on', retain=True)
+                manager = MQTTManager(app.broker_url, 'home/thermorasp/#')
+                received = []
+
+                @asyncio.coroutine
+                def callback(topic, payload):
+                    received.append((topic, payload))
+
+                yield from manager.connect()
+                # retained by another client while subscribed: forwarded as a plain message
+                yield from client.publish('home/thermorasp/device/pump/state', b'off', retain=True)
+                yield from asyncio.sleep(0.2)
+                yield from manager.subscribe('home/thermorasp/device/+/state', callback)
+                yield from asyncio.sleep(0.2)
+                yield from client.disconnect()
+                yield from manager.disconnect()
+                yield from broker.shutdown()
+
+                # only the message retained before subscribing is replayed (known limitation)
+                self.assertEqual(received, [('home/thermorasp/device/boiler/state', b'on')])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testCoveredSubscription(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = yield from self.startBroker()
+                manager = MQTTManager(app.broker_url)
+                received = []
+
+                @asyncio.coroutine
+                def wide(topic, payload):
+                    pass
+
+                @asyncio.coroutine
+                def narrow(topic, payload):
+                    received.append((topic, payload))
+
+                yield from manager.subscribe('home/thermorasp/sensor/#', wide)
+                yield from manager.subscribe('home/thermorasp/sensor/core/+', narrow)
+                yield from manager.subscribe('home/thermorasp/sensor/core/temperature', narrow)
+                filters = [list(manager.broker_filters)]
+                # the narrower filters need a broker subscription now
+                yield from manager.unsubscribe('home/thermorasp/sensor/#', wide)
+                filters.append(list(manager.broker_filters))
+
+                client = yield from self.startClient()
+                yield from client.publish('home/thermorasp/sensor/core/temperature', b'20')
+                yield from asyncio.sleep(0.2)
+                yield from client.disconnect()
+                yield from manager.disconnect()
+                yield from broker.shutdown()
+
+                self.assertEqual(filters, [['home/thermorasp/sensor/#'], ['home/thermorasp/sensor/core/+']])
+                self.assertEqual(received, [('home/thermorasp/sensor/core/temperature', b'20')])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testReconnect(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = yield from self.startBroker()
+                manager = MQTTManager(app.broker_url, 'home/thermorasp/#')
+                manager.RECONNECT_DELAY = 0.1
+                manager.PING_INTERVAL = 0.1
+                received = []
+
+                @asyncio.coroutine
+                def callback(topic, payload):
+                    received.append((topic, payload))
+
+                yield from manager.subscribe('home/thermorasp/device/+/state', callback)
+                yield from manager.subscribe('home/other/+', callback)
+
+                # connection lost: the manager keeps trying until the broker is back
+                for session, handler in list(broker._sessions.values()):
+                    if handler.writer is not None:
+                        handler.writer._writer.transport.abort()
+                yield from broker.shutdown()
+                yield from asyncio.sleep(0.5)
+                connected = [manager.connected]
+                broker = yield from self.startBroker()
+                yield from manager.connect()
+                connected.append(manager.connected)
+
+                client = yield from self.startClient()
+                yield from client.publish('home/thermorasp/device/boiler/state', b'{}')
+                yield from client.publish('home/other/topic', b'other')
+                yield from asyncio.sleep(0.2)
+                yield from client.disconnect()
+                yield from manager.disconnect()
+                yield from broker.shutdown()
+
+                self.assertEqual(connected, [False, True])
+                self.assertEqual(received, [('home/thermorasp/device/boiler/state', b'{}'),
+                                            ('home/other/topic', b'other')])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import random
 import asyncio
 import unittest
 import json
@@ -9,7 +10,7 @@ from freezegun import freeze_time
 
 from hbmqtt.mqtt.constants import QOS_0
 
-from thermostat.opschedule import OperatingSchedule
+from thermostat.opschedule import OperatingSchedule, BehaviorTable, WEEK_MINUTES
 
 from . import BaseTest
 
@@ -20,9 +21,14 @@ class DummyItem(object):
 
 
 class DummyManager(object):
+    """Stands for both the sensor and the device manager."""
 
     def __init__(self, items):
         self.items = items
+        # sensor id: reading callbacks
+        self.listeners = {}
+        # sensor id: {topic: data}
+        self.data = {}
 
     def __getitem__(self, item):
         return self.items[item]
@@ -30,6 +36,21 @@ class DummyManager(object):
     def values(self):
         return self.items.values()
 
+    def get_sensor_data(self, sensor_id):
+        return dict(self.data.get(sensor_id, {}))
+
+    def add_listener(self, sensor_id, callback):
+        self.listeners.setdefault(sensor_id, []).append(callback)
+
+    def remove_listener(self, sensor_id, callback):
+        self.listeners.get(sensor_id, []).remove(callback)
+
+    async def reading(self, sensor_id, topic, data):
+        """Handles a reading like the sensor manager does: stored and dispatched to the listeners."""
+        self.data.setdefault(sensor_id, {})[topic] = data
+        for callback in list(self.listeners.get(sensor_id, [])):
+            await callback(topic, data)
+
 
 class OperatingScheduleTest(BaseTest, unittest.TestCase):
 
@@ -59,31 +80,30 @@ class OperatingScheduleTest(BaseTest, unittest.TestCase):
                 yield from schedule.startup()
 
                 client = yield from self.startClient()
-                yield from client.subscribe([(schedule.devices['home_boiler'].topic + '/+', QOS_0)])
+                yield from client.subscribe([(schedule.devices['home_boiler'].topic + '/control', QOS_0)])
+                yield from self._publishState(schedule, False)
 
-                with freeze_time('2018-12-17T00:00:00.0000'):
-                    yield from self._publishTemperature(schedule, 25)
-                    yield from asyncio.sleep(0.5)
+                # time must go on for the broker
+                with freeze_time('2018-12-17T00:00:00.0000', tick=True):
+                    # known before the behavior starts
+                    yield from self._publishTemperature(schedule, 23)
                     yield from schedule.timer()
                     yield from asyncio.sleep(0.5)
-                    # twice because one from the sensor data and one from the timer
-                    yield from self._testTargetTemperature(schedule, client, False)
-                    yield from self._testTargetTemperature(schedule, client, False)
-
-                with freeze_time('2018-12-17T16:12:03.5346'):
-                    yield from self._publishTemperature(schedule, 23)
+                    yield from self._testTargetTemperature(schedule, client, True)
+                    yield from self._publishState(schedule, True)
                     yield from asyncio.sleep(0.5)
+
+                with freeze_time('2018-12-17T16:12:03.5346', tick=True):
                     yield from schedule.timer()
+                    yield from self._publishTemperature(schedule, 26)
                     yield from asyncio.sleep(0.5)
-                    # twice because one from the sensor data and one from the timer
-                    yield from self._testTargetTemperature(schedule, client, True)
-                    yield from self._testTargetTemperature(schedule, client, True)
+                    yield from self._testTargetTemperature(schedule, client, False)
 
-                with freeze_time('2018-12-20T09:24:12'):
+                with freeze_time('2018-12-20T09:24:12', tick=True):
                     yield from schedule.timer()
                     self.assertIsNone(schedule.behavior)
 
-                with freeze_time('2018-12-21T18:12:43.1203'):
+                with freeze_time('2018-12-21T18:12:43.1203', tick=True):
                     yield from schedule.timer()
                     self.assertIsNone(schedule.behavior)
 
@@ -101,20 +121,85 @@ class OperatingScheduleTest(BaseTest, unittest.TestCase):
 
     @asyncio.coroutine
     def _publishTemperature(self, schedule, temperature):
-        # publish test sensor data
-        client_pub = yield from self.startClient()
-        for sensor in schedule.sensors.values():
-            yield from client_pub.publish(sensor.topic + '/temperature', json.dumps({
+        # readings reach the schedule through the sensor manager
+        for sensor_id, sensor in schedule.sensors.items.items():
+            yield from schedule.sensors.reading(sensor_id, sensor.topic + '/temperature', {
                 'value': temperature,
                 'unit': 'celsius',
                 'timestamp': datetime.datetime.now().isoformat()
-            }).encode(), retain=True)
+            })
+
+    @asyncio.coroutine
+    def _publishState(self, schedule, enabled):
+        # the device reports its state
+        client_pub = yield from self.startClient()
+        for device in schedule.devices.values():
+            yield from client_pub.publish(device.topic + '/state', json.dumps({'enabled': enabled}).encode(),
+                                          retain=True)
         yield from client_pub.disconnect()
 
     @asyncio.coroutine
     def _testTargetTemperature(self, schedule, client, enabled):
         # behavior should have sent control command
-        message = yield from client.deliver_message()
+        message = yield from asyncio.wait_for(client.deliver_message(), 5)
         self.assertEqual(message.topic, schedule.devices['home_boiler'].topic + '/control')
         payload = json.loads(message.data.decode())
         self.assertEqual(payload['enabled'], enabled)
+
+
+class NextTransitionTest(BaseTest, unittest.TestCase):
+
+    def testNextTransition(self):
+        schedule = OperatingSchedule(DummyManager({}), DummyManager({}), {
+            'id': 1,
+            'behaviors': [
+                {'id': 1, 'order': 1, 'start_time': 0, 'end_time': 360},
+            ],
+        })
+        # monday
+        now = datetime.datetime(2018, 12, 3, 5, 59, 30, 500000)
+        self.assertEqual(schedule.next_transition(now), 29.5)
+        self.assertEqual(schedule.next_transition(now.replace(hour=6, minute=0, second=0, microsecond=0)),
+                         WEEK_MINUTES * 60 - 360 * 60)
+
+
+class BehaviorTableTest(unittest.TestCase):
+
+    @staticmethod
+    def _scan(behaviors, minute):
+        candidate = None
+        for bev in behaviors:
+            if bev['start_time'] <= minute < bev['end_time'] and \
+                    (candidate is None or bev['order'] <= candidate['order']):
+                candidate = bev
+        return candidate
+
+    def testLookup(self):
+        rnd = random.Random(42)
+        behaviors = []
+        for index in range(300):
+            start = rnd.randrange(WEEK_MINUTES)
+            behaviors.append({'id': index, 'order': rnd.randrange(5), 'start_time': start,
+                              'end_time': start + rnd.randrange(1, 240)})
+        table = BehaviorTable(behaviors)
+        for minute in range(WEEK_MINUTES):
+            self.assertIs(table.behavior(minute), self._scan(behaviors, minute))
+
+    def testNextTransition(self):
+        table = BehaviorTable([
+            {'id': 1, 'order': 2, 'start_time': 0, 'end_time': WEEK_MINUTES},
+            {'id': 2, 'order': 1, 'start_time': 360, 'end_time': 480},
+            {'id': 3, 'order': 1, 'start_time': 1800, 'end_time': 1900},
+        ])
+        self.assertEqual(table.behavior(400)['id'], 2)
+        self.assertEqual(table.behavior(480)['id'], 1)
+        self.assertEqual(table.next_transition(0), 360)
+        self.assertEqual(table.next_transition(360), 480)
+        self.assertEqual(table.next_transition(1000), 1800)
+        # wraps to the next week
+        self.assertEqual(table.next_transition(1900), 360 + WEEK_MINUTES)
+
+        self.assertIsNone(BehaviorTable([]).next_transition(0))
+        self.assertIsNone(BehaviorTable([]).behavior(0))
+        self.assertIsNone(BehaviorTable([{'id': 1, 'order': 1, 'start_time': 0, 'end_time': WEEK_MINUTES}])
+                          .next_transition(100))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from thermostat import readingfilter
+from thermostat.readingfilter import ReadingFilter
+
+
+class ReadingFilterTest(unittest.TestCase):
+
+    def testDisabled(self):
+        f = ReadingFilter(heartbeat=600)
+        self.assertFalse(f.enabled)
+        self.assertEqual([f.accept('temperature', t, 20.0) for t in range(3)], [20.0, 20.0, 20.0])
+
+    def testDeadbandAndQuantum(self):
+        f = ReadingFilter(deadband=0.2, quantum=0.1, heartbeat=600)
+        values = [20.0, 20.04, 20.12, 20.19, 20.26, 20.31, 20.0]
+        self.assertEqual([f.accept('temperature', t, v) for t, v in enumerate(values)],
+                         [20.0, None, None, 20.2, None, None, 20.0])
+        # series are filtered independently
+        self.assertEqual(f.accept('humidity', 7, 20.0), 20.0)
+
+    def testHeartbeat(self):
+        f = ReadingFilter(deadband=0.5, heartbeat=60)
+        accepted = [t for t in range(0, 300, 10) if f.accept('temperature', t, 20.0) is not None]
+        self.assertEqual(accepted, [0, 60, 120, 180, 240])
+
+        # a reading with validity is renewed before it expires
+        f = ReadingFilter(deadband=0.5, heartbeat=600)
+        accepted = [t for t in range(0, 300, 10) if f.accept('temperature', t, 20.0, 100) is not None]
+        self.assertEqual(accepted, [0, 50, 100, 150, 200, 250])
+
+    def testLateReading(self):
+        f = ReadingFilter(deadband=0.5)
+        self.assertEqual(f.accept('temperature', 10, 20.0), 20.0)
+        self.assertEqual(f.accept('temperature', 5, 20.0), 20.0)
+        self.assertEqual(f.accept('temperature', 11, 20.0), None)
+
+    def testFromAddress(self):
+        f = readingfilter.from_address('deadband=0.3&heartbeat=120', quantum=0.5, heartbeat=600)
+        self.assertEqual((f.deadband, f.quantum, f.heartbeat), (0.3, 0.5, 120))
+        f = readingfilter.from_address('28-0000075a7b1c', deadband=0.1)
+        self.assertEqual((f.deadband, f.quantum, f.heartbeat), (0.1, 0, 0))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import unittest
+
+from thermostat import behaviors
+from thermostat.registry import SchemeRegistry
+from thermostat.behaviors.generic import TargetTemperatureBehavior
+
+
+class RegistryTest(unittest.TestCase):
+
+    def testBehaviors(self):
+        registry = behaviors.BehaviorRegistry().load()
+        self.assertIn('generic.TargetTemperatureBehavior', registry.schemas)
+        self.assertIs(registry.get('generic', 'TargetTemperatureBehavior'), TargetTemperatureBehavior)
+        self.assertEqual(registry.schemas['generic.TargetTemperatureBehavior'],
+                         TargetTemperatureBehavior.get_config_schema())
+        self.assertIsNone(registry.get('generic', 'MissingBehavior'))
+        self.assertIsNone(registry.get('missing', 'TargetTemperatureBehavior'))
+
+        self.assertIsNone(behaviors.get_behavior_handler_class('invalid'))
+        self.assertIsNone(behaviors.get_behavior_config_schema('generic.MissingBehavior'))
+
+    def testSchemes(self):
+        registry = SchemeRegistry('thermostat.devices', 'thermostat.devices')
+        handler_class = registry.get('local', 'MEMSW')
+        self.assertEqual(handler_class.__name__, 'MemoryOnOffDeviceHandler')
+        # only the requested module was imported
+        self.assertEqual(list(registry.modules), ['local'])
+        self.assertIsNone(registry.get('missing', 'MEMSW'))
+
+        # the module is imported again: new classes, same lookup
+        registry.reload()
+        self.assertIs(registry.get('local', 'MEMSW'), sys.modules['thermostat.devices.local'].schemes['MEMSW'])
+        self.assertIsNot(registry.get('local', 'MEMSW'), handler_class)
+        self.assertEqual(list(registry.modules), ['local'])
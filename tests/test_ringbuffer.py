@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from thermostat.ringbuffer import ReadingBuffer, ReadingBufferPool, READING_SIZE
+
+
+class ReadingBufferTest(unittest.TestCase):
+
+    def testWrapAround(self):
+        buf = ReadingBuffer(3)
+        for timestamp in range(5):
+            self.assertTrue(buf.append(timestamp, timestamp * 10))
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(buf.last(), (4, 40))
+        self.assertEqual(buf.window(), [(2, 20), (3, 30), (4, 40)])
+
+    def testWindow(self):
+        buf = ReadingBuffer(10)
+        for timestamp in range(14):
+            buf.append(timestamp, timestamp)
+        self.assertEqual(buf.window(6, 8), [(6, 6), (7, 7), (8, 8)])
+        self.assertEqual(buf.window(12), [(12, 12), (13, 13)])
+        self.assertEqual(buf.window(None, 4), [(4, 4)])
+        self.assertEqual(buf.window(20), [])
+
+    def testOutOfOrder(self):
+        buf = ReadingBuffer(3)
+        self.assertIsNone(buf.last())
+        buf.append(10, 1)
+        self.assertFalse(buf.append(5, 2))
+        # same timestamp replaces the value
+        self.assertTrue(buf.append(10, 3))
+        self.assertEqual(buf.window(), [(10, 3)])
+
+
+class ReadingBufferPoolTest(unittest.TestCase):
+
+    def testMemoryCeiling(self):
+        pool = ReadingBufferPool(10, 15 * READING_SIZE)
+        for timestamp in range(10):
+            self.assertTrue(pool.append('a', 'temperature', timestamp, 'celsius', timestamp))
+        self.assertEqual(pool.get('a', 'temperature').capacity, 10)
+        # budget exhausted: the largest buffer is shrunk to make room for a fair share (the oldest readings go)
+        self.assertTrue(pool.append('b', 'temperature', 1, 'celsius', 20))
+        self.assertEqual(pool.get('a', 'temperature').capacity, 8)
+        self.assertEqual(pool.get('a', 'temperature').window(), [(t, t) for t in range(2, 10)])
+        self.assertEqual(pool.get('b', 'temperature').capacity, 7)
+        self.assertEqual(pool.get('b', 'temperature').unit, 'celsius')
+        self.assertTrue(pool.append('a', 'temperature', 10, 'celsius', 10))
+        self.assertEqual(pool.get('a', 'temperature').window()[-2:], [(9, 9), (10, 10)])
+        self.assertTrue(pool.append('c', 'temperature', 1, 'celsius', 20))
+        self.assertEqual([pool.get(s, 'temperature').capacity for s in 'abc'], [5, 5, 5])
+        self.assertEqual(pool.memory, 15 * READING_SIZE)
+
+        pool.remove('a')
+        self.assertIsNone(pool.get('a', 'temperature'))
+        self.assertEqual(pool.memory, 10 * READING_SIZE)
+        self.assertEqual([k for k, b in pool.series(sensor_type='temperature')],
+                         [('b', 'temperature'), ('c', 'temperature')])
+
+    def testRefused(self):
+        pool = ReadingBufferPool(10, 2 * READING_SIZE)
+        self.assertTrue(pool.append('a', 'temperature', 1, 'celsius', 20))
+        self.assertTrue(pool.append('b', 'temperature', 1, 'celsius', 20))
+        # not even a single reading for each series
+        self.assertFalse(pool.append('c', 'temperature', 1, 'celsius', 20))
+        self.assertIsNone(pool.get('c', 'temperature'))
+        self.assertEqual(pool.memory, 2 * READING_SIZE)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import mock
+
+from datetime import datetime, timedelta, timezone
+
+from thermostat import rollups
+from thermostat.database import scoped_session
+from thermostat.models import ReadingMinute, ReadingHour, ReadingDay
+from thermostat.writebehind import ReadingWriter
+
+from . import DatabaseTest
+
+
+class RollupsTest(DatabaseTest, unittest.TestCase):
+
+    def _reading(self, value, hour, minute, second=0):
+        return {
+            'sensor_id': 'temp_core',
+            'sensor_type': 'temperature',
+            'timestamp': datetime(2018, 12, 17, hour, minute, second),
+            'unit': 'celsius',
+            'value': value,
+        }
+
+    def _rollups(self, model):
+        with scoped_session(self.database) as session:
+            return [(r.timestamp, r.min_value, r.max_value, r.sum_value / r.count, r.count)
+                    for r in session.query(model).order_by(model.timestamp)]
+
+    def testIncremental(self):
+        with scoped_session(self.database) as session:
+            rollups.update_rollups(session, [self._reading(20, 10, 0, 0), self._reading(22, 10, 0, 30)])
+        with scoped_session(self.database) as session:
+            rollups.update_rollups(session, [self._reading(18, 10, 0, 45), self._reading(21, 10, 1)])
+
+        self.assertEqual(self._rollups(ReadingMinute), [
+            (datetime(2018, 12, 17, 10, 0), 18, 22, 20, 3),
+            (datetime(2018, 12, 17, 10, 1), 21, 21, 21, 1),
+        ])
+        self.assertEqual(self._rollups(ReadingHour), [(datetime(2018, 12, 17, 10, 0), 18, 22, 20.25, 4)])
+        self.assertEqual(self._rollups(ReadingDay), [(datetime(2018, 12, 17), 18, 22, 20.25, 4)])
+
+    def testBackfill(self):
+        readings = [self._reading(15 + minute % 7, 9 + minute // 60, minute % 60) for minute in range(150)]
+        with scoped_session(self.database) as session:
+            # stores the readings and updates the rollups
+            ReadingWriter(self.db).write(session, readings)
+        expected = [self._rollups(model) for model in (ReadingMinute, ReadingHour, ReadingDay)]
+
+        self.assertEqual(rollups.backfill(self.database, chunk_size=40), 150)
+        self.assertEqual([self._rollups(model) for model in (ReadingMinute, ReadingHour, ReadingDay)], expected)
+        self.assertEqual(len(expected[0]), 150)
+        self.assertEqual(len(expected[1]), 3)
+
+    def testInterruptedBackfill(self):
+        core = [self._reading(20 + minute, 10, minute) for minute in range(3)]
+        room = [dict(r, sensor_id='temp_room') for r in core]
+        with scoped_session(self.database) as session:
+            ReadingWriter(self.db).write(session, core + room)
+            # double counted rollups
+            rollups.update_rollups(session, core + room)
+
+        def update_rollups(session, readings):
+            if readings[0]['sensor_id'] == 'temp_room':
+                raise RuntimeError('interrupted')
+            original(session, readings)
+
+        original = rollups.update_rollups
+        with mock.patch('thermostat.rollups.update_rollups', update_rollups):
+            self.assertRaises(RuntimeError, rollups.backfill, self.database)
+        with scoped_session(self.database) as session:
+            counts = dict(session.query(ReadingDay.sensor_id, ReadingDay.count))
+        # each sensor is either rebuilt or left alone
+        self.assertEqual(counts, {'temp_core': 3, 'temp_room': 6})
+
+        # just run it again
+        self.assertEqual(rollups.backfill(self.database), 6)
+        with scoped_session(self.database) as session:
+            counts = dict(session.query(ReadingDay.sensor_id, ReadingDay.count))
+        self.assertEqual(counts, {'temp_core': 3, 'temp_room': 3})
+
+    def testTimeZones(self):
+        # the same instant, with and without a time zone
+        local = datetime(2018, 12, 17, 10, 0, 30)
+        utc = local.astimezone(timezone.utc)
+        with scoped_session(self.database) as session:
+            rollups.update_rollups(session, [self._reading(20, 10, 0, 30)])
+            rollups.update_rollups(session, [dict(self._reading(22, 10, 0, 30), timestamp=utc)])
+            rollups.update_rollups(session, [dict(self._reading(24, 10, 0, 30),
+                                                  timestamp=utc.astimezone(timezone(timedelta(hours=-5))))])
+        self.assertEqual(self._rollups(ReadingMinute), [(datetime(2018, 12, 17, 10, 0), 20, 24, 22, 3)])
+
+        # backfill puts them in the same periods
+        with scoped_session(self.database) as session:
+            ReadingWriter(self.db).write(session, [dict(self._reading(22, 10, 0, 30), timestamp=utc)])
+        self.assertEqual(rollups.backfill(self.database), 1)
+        self.assertEqual(self._rollups(ReadingMinute), [(datetime(2018, 12, 17, 10, 0), 22, 22, 22, 1)])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from sqlalchemy import event
+
+from thermostat.database import scoped_session
+from thermostat.models import Schedule, Behavior, BehaviorSensor, BehaviorDevice
+from thermostat.models.schedules import get_schedule_models, get_schedules, query_schedules
+from thermostat.controllers.schedules import serialize_schedule
+
+from . import DatabaseTest
+
+
+class ScheduleModelTest(DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        with scoped_session(self.database) as session:
+            for schedule_id in (1, 2):
+                schedule = Schedule(id=schedule_id, name='schedule {}'.format(schedule_id),
+                                    enabled=schedule_id == 1)
+                for index in range(200):
+                    behavior = Behavior(behavior_name='generic.TargetTemperatureBehavior', behavior_order=200 - index,
+                                        start_time=index * 50, end_time=index * 50 + 49,
+                                        config=json.dumps({'target_temperature': index}))
+                    behavior.sensors = [BehaviorSensor(sensor_id='temp1'), BehaviorSensor(sensor_id='temp2')]
+                    behavior.devices = [BehaviorDevice(device_id='boiler')]
+                    schedule.behaviors.append(behavior)
+                session.add(schedule)
+        self.queries = 0
+        event.listen(self.database.kw['bind'], 'before_cursor_execute', self._count)
+
+    def tearDown(self):
+        event.remove(self.database.kw['bind'], 'before_cursor_execute', self._count)
+        DatabaseTest.tearDown(self)
+
+    # noinspection PyUnusedLocal
+    def _count(self, *args):
+        self.queries += 1
+
+    def testSingleQuery(self):
+        with scoped_session(self.database) as session:
+            models = get_schedule_models(session, Schedule.id == 1)
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(len(models), 1)
+        model = models[0]
+        self.assertEqual((model.id, model.name, model.enabled), (1, 'schedule 1', True))
+        self.assertEqual(len(model.behaviors), 200)
+        # by order
+        self.assertEqual([b.order for b in model.behaviors], list(range(1, 201)))
+        behavior = model.behaviors[0]
+        self.assertEqual(behavior.config, {'target_temperature': 199})
+        self.assertEqual(sorted(behavior.sensors), ['temp1', 'temp2'])
+        self.assertEqual(behavior.devices, ('boiler', ))
+
+        with scoped_session(self.database) as session:
+            self.assertEqual([m.id for m in get_schedule_models(session)], [1, 2])
+        self.assertEqual(self.queries, 2)
+
+    def testAsDict(self):
+        with scoped_session(self.database) as session:
+            model = get_schedule_models(session, Schedule.enabled == 1)[0]
+        schedule = model.as_dict()
+        self.assertEqual(schedule['id'], 1)
+        self.assertEqual(schedule['behaviors'][0]['config'], {'target_temperature': 199})
+        # every definition is a new copy
+        schedule['behaviors'][0]['config']['target_temperature'] = 30
+        schedule['behaviors'][0]['sensors'].append('temp3')
+        del schedule['behaviors'][1]
+        schedule = model.as_dict()
+        self.assertEqual(len(schedule['behaviors']), 200)
+        self.assertEqual(schedule['behaviors'][0]['config'], {'target_temperature': 199})
+        self.assertEqual(len(schedule['behaviors'][0]['sensors']), 2)
+
+
+class ScheduleListTest(DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        with scoped_session(self.database) as session:
+            for schedule_id in range(1, 501):
+                schedule = Schedule(id=schedule_id, name='schedule {}'.format(schedule_id), enabled=schedule_id == 1)
+                for index in range(3):
+                    behavior = Behavior(behavior_name='generic.TargetTemperatureBehavior', behavior_order=index + 1,
+                                        start_time=0, end_time=10080, config='{}')
+                    behavior.sensors = [BehaviorSensor(sensor_id='temp{}'.format(index))]
+                    behavior.devices = [BehaviorDevice(device_id='boiler')]
+                    schedule.behaviors.append(behavior)
+                session.add(schedule)
+        self.queries = 0
+        event.listen(self.database.kw['bind'], 'before_cursor_execute', self._count)
+
+    def tearDown(self):
+        event.remove(self.database.kw['bind'], 'before_cursor_execute', self._count)
+        DatabaseTest.tearDown(self)
+
+    # noinspection PyUnusedLocal
+    def _count(self, *args):
+        self.queries += 1
+
+    def _list(self, fields=('id', 'name', 'description', 'enabled', 'behaviors'), limit=None, offset=None):
+        self.queries = 0
+        with scoped_session(self.database) as session:
+            return [serialize_schedule(s, fields) for s in get_schedules(session, 'behaviors' in fields, limit, offset)]
+
+    def testQueries(self):
+        schedules = self._list()
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(len(schedules), 500)
+        self.assertEqual([b['sensors'] for b in schedules[-1]['behaviors']], [['temp0'], ['temp1'], ['temp2']])
+
+        schedules = self._list(limit=20, offset=490)
+        self.assertEqual(self.queries, 1)
+        self.assertEqual([s['id'] for s in schedules], list(range(491, 501)))
+        self.assertEqual(len(schedules[0]['behaviors']), 3)
+
+        schedules = self._list(('id', 'name', 'enabled'))
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(schedules[0], {'id': 1, 'name': 'schedule 1', 'enabled': True})
+        self.assertEqual(len(schedules), 500)
+
+        schedules = self._list(('id', ), limit=2, offset=2)
+        self.assertEqual(schedules, [{'id': 3}, {'id': 4}])
+
+        with scoped_session(self.database) as session:
+            self.queries = 0
+            schedule = serialize_schedule(query_schedules(session, Schedule.id == 10).one())
+        self.assertEqual(self.queries, 1)
+        self.assertEqual(len(schedule['behaviors']), 3)
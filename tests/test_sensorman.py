@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import time
+import json
+import asyncio
+import unittest
+
+from datetime import datetime, timedelta
+
+from thermostat import app
+from thermostat.database import scoped_session
+from thermostat.models import Sensor, Reading
+from thermostat.sensorman import SensorManager
+from thermostat.writebehind import ReadingWriter
+
+from . import BaseTest, DatabaseTest
+
+
+class SensorManagerTest(BaseTest, DatabaseTest, unittest.TestCase):
+
+    SENSORS = 400
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        DatabaseTest.setUp(self)
+        with scoped_session(self.database) as session:
+            for index in range(self.SENSORS):
+                sensor = Sensor()
+                sensor.id = 'sensor_{}'.format(index)
+                sensor.protocol = 'local'
+                sensor.address = 'MQTT-LOCAL:'
+                sensor.sensor_type = 'temperature'
+                session.add(sensor)
+
+    def tearDown(self):
+        DatabaseTest.tearDown(self)
+        BaseTest.tearDown(self)
+
+    def testManySensors(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                broker = yield from self.startBroker()
+                manager = SensorManager(self.db)
+                client = yield from self.startClient()
+                yield from asyncio.sleep(0.5)
+
+                start = time.monotonic()
+                for sensor in manager.values():
+                    yield from client.publish(sensor.topic + '/temperature', json.dumps({
+                        'value': 20.5,
+                        'unit': 'celsius',
+                        'timestamp': datetime.now().isoformat(),
+                    }).encode())
+                # not a registered sensor
+                yield from client.publish(manager.sensors['sensor_0'].topic + '_unknown/temperature', json.dumps({
+                    'value': 20.5,
+                    'unit': 'celsius',
+                    'timestamp': datetime.now().isoformat(),
+                }).encode())
+
+                while len(manager.readings) < self.SENSORS and time.monotonic() - start < 10:
+                    yield from asyncio.sleep(0.1)
+
+                # no reading must be lost
+                self.assertEqual(len(manager.readings), self.SENSORS)
+                self.assertTrue(all(r['value'] == 20.5 for r in manager.readings.values()))
+
+                yield from manager.shutdown()
+                with scoped_session(self.database) as session:
+                    self.assertEqual(session.query(Reading).count(), self.SENSORS)
+
+                yield from client.disconnect()
+                yield from app.mqtt.disconnect()
+                yield from broker.shutdown()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testWarmStart(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                now = datetime.now().replace(microsecond=0)
+                readings = [
+                    ('sensor_0', now - timedelta(seconds=60), None),
+                    # still valid
+                    ('sensor_1', now - timedelta(hours=2), 3 * 3600),
+                    # expired
+                    ('sensor_2', now - timedelta(seconds=60), 30),
+                    # too old
+                    ('sensor_3', now - timedelta(hours=2), None),
+                    # not registered
+                    ('unknown', now, None),
+                ]
+                with scoped_session(self.database) as session:
+                    ReadingWriter(self.db).write(session, [{
+                        'sensor_id': sensor_id,
+                        'sensor_type': 'temperature',
+                        'timestamp': timestamp,
+                        'unit': 'celsius',
+                        'value': 20.5,
+                        'validity': validity,
+                    } for sensor_id, timestamp, validity in readings])
+
+                broker = yield from self.startBroker()
+                manager = SensorManager(self.db)
+                loaded = manager.readings
+                sensor_data = manager.get_sensor_data('sensor_0')
+                yield from asyncio.sleep(0.5)
+                yield from manager.shutdown()
+                yield from app.mqtt.disconnect()
+                yield from broker.shutdown()
+
+                self.assertEqual(sorted(loaded), ['sensor_0', 'sensor_1'])
+                self.assertEqual(loaded['sensor_1']['validity'], 3 * 3600)
+                self.assertEqual(sensor_data, {
+                    manager['sensor_0'].topic + '/temperature': {
+                        'timestamp': readings[0][1].isoformat(),
+                        'unit': 'celsius',
+                        'value': 20.5,
+                    },
+                })
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testFilter(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                app.config['READINGS_FILTER_DEADBAND'] = 0.5
+                broker = yield from self.startBroker()
+                manager = SensorManager(self.db)
+                received = []
+
+                @asyncio.coroutine
+                def listener(topic, data):
+                    received.append(data['value'])
+
+                manager.add_listener('sensor_0', listener)
+                client = yield from self.startClient()
+                yield from asyncio.sleep(0.5)
+
+                start = datetime.now()
+                for index, value in enumerate((20.5, 20.6, 20.4, 20.7, 21.0, 21.1)):
+                    yield from client.publish(manager['sensor_0'].topic + '/temperature', json.dumps({
+                        'value': value,
+                        'unit': 'celsius',
+                        'timestamp': (start + timedelta(seconds=index)).isoformat(),
+                    }).encode())
+                while manager.stats()['received'] < 6 and datetime.now() - start < timedelta(seconds=10):
+                    yield from asyncio.sleep(0.1)
+                last_seen = manager['sensor_0'].last_seen
+                # built once, until the next reading
+                readings = manager.readings
+                reading = readings['sensor_0']
+                cached = manager.readings is readings and manager.readings['sensor_0'] is reading
+
+                yield from manager.shutdown()
+                yield from client.disconnect()
+                yield from app.mqtt.disconnect()
+                yield from broker.shutdown()
+
+                self.assertEqual(manager.stats(), {'received': 6, 'filtered': 4})
+                self.assertEqual(received, [20.5, 21.0])
+                self.assertGreaterEqual(last_seen, start)
+                self.assertTrue(cached)
+                self.assertEqual(reading['value'], 21.0)
+                with scoped_session(self.database) as session:
+                    self.assertEqual(session.query(Reading).count(), 2)
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                del app.config['READINGS_FILTER_DEADBAND']
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
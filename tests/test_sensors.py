@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+from sanic.exceptions import InvalidUsage
+from sqlalchemy import select
+
+from thermostat.database import scoped_session
+from thermostat.models.sensors import Reading, ReadingSeries
+from thermostat.controllers.sensors import parse_reading_date, parse_reading_cursor, after_reading_cursor
+
+from . import DatabaseTest
+
+
+class ReadingListTest(DatabaseTest, unittest.TestCase):
+
+    def testArguments(self):
+        self.assertEqual(parse_reading_date('2018-02-01T10:00:00'), datetime.datetime(2018, 2, 1, 10))
+        with self.assertRaises(InvalidUsage):
+            parse_reading_date('2018-02-01')
+
+        self.assertEqual(parse_reading_cursor('2018-02-01T10:00:00,temp1,humidity'),
+                         (datetime.datetime(2018, 2, 1, 10), 'temp1', 'humidity'))
+        for cursor in ('2018-02-01T10:00:00,temp1', 'nodate,temp1,humidity'):
+            with self.assertRaises(InvalidUsage):
+                parse_reading_cursor(cursor)
+
+    def testCursor(self):
+        with scoped_session(self.database) as session:
+            session.add_all([
+                ReadingSeries(id=1, sensor_id='temp1', sensor_type='humidity'),
+                ReadingSeries(id=2, sensor_id='temp1', sensor_type='temperature'),
+                ReadingSeries(id=3, sensor_id='temp2', sensor_type='temperature'),
+            ])
+            session.add_all([Reading(series_id=series_id, timestamp=100, value=series_id) for series_id in (1, 2, 3)])
+
+        table, series = Reading.__table__, ReadingSeries.__table__
+        query = select([series.c.sensor_id, series.c.sensor_type]) \
+            .select_from(table.join(series, series.c.id == table.c.series_id))
+        keys = (table.c.timestamp, series.c.sensor_id, series.c.sensor_type)
+
+        with scoped_session(self.database) as session:
+            # the other types of the same sensor and timestamp are not skipped
+            rows = session.execute(query.where(after_reading_cursor(keys, (100, 'temp1', 'humidity')))
+                                   .order_by(*keys)).fetchall()
+        self.assertEqual([tuple(r) for r in rows], [('temp1', 'temperature'), ('temp2', 'temperature')])
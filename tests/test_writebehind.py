@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from datetime import datetime
+
+from sqlalchemy import event
+
+from thermostat.database import scoped_session
+from thermostat.models import Reading, ReadingSeries, LatestReading, ReadingMinute
+from thermostat.writebehind import ReadingWriter
+
+from . import BaseTest, DatabaseTest
+
+
+class ReadingWriterTest(BaseTest, DatabaseTest, unittest.TestCase):
+
+    def setUp(self):
+        BaseTest.setUp(self)
+        DatabaseTest.setUp(self)
+
+    def tearDown(self):
+        DatabaseTest.tearDown(self)
+        BaseTest.tearDown(self)
+
+    def _reading(self, value, second=0):
+        return {
+            'sensor_id': 'temp_core',
+            'sensor_type': 'temperature',
+            'timestamp': datetime(2018, 12, 17, 0, 0, second),
+            'unit': 'celsius',
+            'value': value,
+        }
+
+    def _count(self):
+        with scoped_session(self.database) as session:
+            return session.query(Reading).count()
+
+    def testBatchSize(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                writer = ReadingWriter(self.db, batch_size=3, max_age=60)
+                writer.startup()
+                writer.put(self._reading(20, 0))
+                writer.put(self._reading(21, 1))
+                self.assertEqual(self._count(), 0)
+                writer.put(self._reading(22, 2))
+                yield from asyncio.sleep(0.2)
+                self.assertEqual(self._count(), 3)
+                self.assertEqual(writer.stats()['flushes'], 1)
+                self.assertEqual(writer.stats()['depth'], 0)
+                yield from writer.shutdown()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testMaxAge(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                writer = ReadingWriter(self.db, batch_size=100, max_age=0.1)
+                writer.startup()
+                writer.put(self._reading(20))
+                yield from asyncio.sleep(0.3)
+                self.assertEqual(self._count(), 1)
+                yield from writer.shutdown()
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testOverflowAndDuplicates(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                writer = ReadingWriter(self.db, batch_size=100, max_age=60, max_pending=2)
+                writer.startup()
+                writer.put(self._reading(20, 0))
+                writer.put(self._reading(21, 1))
+                writer.put(self._reading(22, 2))
+                self.assertEqual(writer.stats()['dropped'], 1)
+                yield from writer.flush()
+                # same key as a stored one (e.g. our own last will)
+                writer.put(self._reading(22, 2))
+                yield from writer.shutdown()
+                self.assertEqual(self._count(), 2)
+                with scoped_session(self.database) as session:
+                    values = [float(r.value) for r in session.query(Reading).order_by(Reading.timestamp)]
+                self.assertEqual(values, [21, 22])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testSeries(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                writer = ReadingWriter(self.db, batch_size=100, max_age=60)
+                writer.put(self._reading(20, 0))
+                writer.put(self._reading(21, 1))
+                humidity = self._reading(40, 1)
+                humidity.update(sensor_type='humidity', unit='percent')
+                writer.put(humidity)
+                yield from writer.flush()
+                with scoped_session(self.database) as session:
+                    series = {(s.sensor_type, s.unit): s.id for s in session.query(ReadingSeries)}
+                    rows = [(r.series_id, r.timestamp, r.value)
+                            for r in session.query(Reading).order_by(Reading.series_id, Reading.timestamp)]
+                base = int(datetime(2018, 12, 17).timestamp())
+                self.assertEqual(rows, [
+                    (series[('temperature', 'celsius')], base, 20.0),
+                    (series[('temperature', 'celsius')], base + 1, 21.0),
+                    (series[('humidity', 'percent')], base + 1, 40.0),
+                ])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testLatestReadings(self):
+        @asyncio.coroutine
+        def test_coro():
+            try:
+                writer = ReadingWriter(self.db, batch_size=100, max_age=60)
+                writer.put(self._reading(20, 1))
+                writer.put(self._reading(21, 2))
+                yield from writer.flush()
+                # a late reading doesn't replace a newer one
+                writer.put(self._reading(19, 0))
+                humidity = self._reading(40, 1)
+                humidity.update(sensor_type='humidity', unit='percent')
+                writer.put(humidity)
+                yield from writer.flush()
+                with scoped_session(self.database) as session:
+                    rows = [(r.sensor_type, r.timestamp.second, r.unit, r.value)
+                            for r in session.query(LatestReading).order_by(LatestReading.sensor_type)]
+                self.assertEqual(rows, [
+                    ('humidity', 1, 'percent', 40.0),
+                    ('temperature', 2, 'celsius', 21.0),
+                ])
+                future.set_result(True)
+            except Exception as e:
+                future.set_exception(e)
+
+        future = asyncio.Future(loop=self.loop)
+        self._testCoro(future, test_coro)
+
+    def testSingleInsert(self):
+        statements = []
+
+        # noinspection PyUnusedLocal
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split('(')[0].strip())
+
+        writer = ReadingWriter(self.db)
+        with scoped_session(self.database) as session:
+            writer.write(session, [self._reading(20, 0), self._reading(21, 1)])
+        event.listen(self.database.kw['bind'], 'before_cursor_execute', before_execute)
+        try:
+            with scoped_session(self.database) as session:
+                # two stored already, one duplicated in the batch
+                writer.write(session, [self._reading(value, second) for value, second in
+                                       ((20, 0), (21, 1), (22, 2), (23, 3), (24, 3), (25, 4))])
+        finally:
+            event.remove(self.database.kw['bind'], 'before_cursor_execute', before_execute)
+
+        self.assertEqual(statements.count('INSERT OR IGNORE INTO sensor_readings'), 1)
+        self.assertEqual(self._count(), 5)
+        with scoped_session(self.database) as session:
+            minute = session.query(ReadingMinute.count, ReadingMinute.sum_value).one()
+        # only the new readings are added to the rollups
+        self.assertEqual(tuple(minute), (5, 20 + 21 + 22 + 23 + 25))
@@ -1,12 +1,33 @@
 # -*- coding: utf-8 -*-
 """Application creator."""
 
+import time
+import contextlib
+import collections
+
 from sanic import Sanic
+from sanic.log import logger
+
+from .eventbus import EventBus
 
 
 class Application(Sanic):
     def __init__(self, name):
         Sanic.__init__(self, name)
+        # monotonic clock at startup (the daemon sets it to the process start)
+        self.start_time = time.monotonic()
+        # phase: seconds it took at startup
+        self.startup_phases = collections.OrderedDict()
+        # seconds from startup to notifying systemd
+        self.ready_time = None
+        # called when ready, set by the daemon with --profile-startup
+        self.startup_report = None
+        # seconds from startup to the first control decision
+        self.first_decision_time = None
+        # internal signals between components
+        self.bus = EventBus()
+        # resource: version, incremented on every change (used for response caching)
+        self.versions = collections.Counter()
 
     def new_topic(self, node_id):
         return '/'.join([
@@ -14,6 +35,33 @@ class Application(Sanic):
             self.config['DEVICE_ID'],
             node_id])
 
+    def changed(self, resource: str):
+        """Invalidates the cached responses of a resource (e.g. sensors, devices, schedules)."""
+        self.versions[resource] += 1
+
+    @contextlib.contextmanager
+    def startup_phase(self, name: str):
+        """Measures a startup phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.startup_phases[name] = time.monotonic() - start
+
+    def ready(self):
+        """Called after notifying systemd that startup is complete."""
+        self.ready_time = time.monotonic() - self.start_time
+        logger.info("Ready {:.3f} seconds after startup".format(self.ready_time))
+        if self.startup_report:
+            self.startup_report()
+
+    def control_decision(self, source: str):
+        """Called by behaviors on every decision taken on valid readings. The first one is logged."""
+        if self.first_decision_time is None:
+            self.first_decision_time = time.monotonic() - self.start_time
+            logger.info("First control decision by {} {:.3f} seconds after startup"
+                        .format(source, self.first_decision_time))
+
 
 app = Application(__name__)
 
@@ -4,42 +4,56 @@
 import sys
 import asyncio
 import sdnotify
-import json
+import collections
 
 import hbmqtt.client as mqtt_client
 
 from sanic.log import logger
-from sqlalchemy.orm.exc import NoResultFound
 
-from .database import scoped_session
-from . import app, sensorman, deviceman, opschedule
+from . import app, behaviors, sensorman, deviceman, opschedule, mqttman, maintenance, livepush, util
+from .eventbus import SIGNAL_TIMER, SIGNAL_SCHEDULE
 from .models import Sensor, Schedule
 from .models import eventlog
+from .models.schedules import get_schedule_models
 
 
 class TimerNode(object):
-    """A simple timer node. Sends timing pings for the system to use."""
+    """
+    A simple timer node. Sends timer signals for the system to use: at the time requested with wake_in
+    and anyway every given seconds.
+    """
 
-    def __init__(self, node_id, seconds):
+    def __init__(self, seconds):
         self.seconds = seconds
-        self.topic = app.new_topic(node_id + '/_internal')
-
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
-        asyncio.ensure_future(self._connect())
-
-    async def _connect(self):
-        while app.is_running:
-            await self.broker.connect(app.broker_url)
-            logger.debug("Timer connected to broker")
-            await self._loop()
+        # loop time of the next requested signal
+        self.deadline = None
+        # set when the deadline changes
+        self.rearm = asyncio.Event()
+        asyncio.ensure_future(self._loop())
 
     async def _loop(self):
+        loop = asyncio.get_event_loop()
         while app.is_running:
-            await asyncio.sleep(self.seconds)
-            await self.trigger()
+            timeout = self.seconds
+            if self.deadline is not None:
+                timeout = max(min(timeout, self.deadline - loop.time()), 0)
+            try:
+                await asyncio.wait_for(self.rearm.wait(), timeout)
+                self.rearm.clear()
+                continue
+            except asyncio.TimeoutError:
+                pass
+            if self.deadline is not None and self.deadline <= loop.time():
+                self.deadline = None
+            self.trigger()
 
-    async def trigger(self):
-        await self.broker.publish(self.topic, b'timer', retain=False)
+    def wake_in(self, seconds):
+        """Requests a signal in the given seconds (None for the regular interval only)."""
+        self.deadline = asyncio.get_event_loop().time() + seconds if seconds is not None else None
+        self.rearm.set()
+
+    def trigger(self):
+        app.bus.emit(SIGNAL_TIMER)
 
 
 class Backend(object):
@@ -47,36 +61,62 @@ class Backend(object):
 
     def __init__(self, myapp):
         self.app = myapp
-        self.sensors = sensorman.SensorManager(self.app.database)
-        self.devices = deviceman.DeviceManager(self.app.database)
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        # behaviors are looked up on every schedule change
+        with self.app.startup_phase('behaviors'):
+            behaviors.registry.load()
+        # protocol modules are imported here, for the registered sensors and devices only
+        with self.app.startup_phase('sensors'):
+            self.sensors = sensorman.SensorManager(self.app.db)
+        with self.app.startup_phase('devices'):
+            self.devices = deviceman.DeviceManager(self.app.db)
+        self.broker = self.app.mqtt
         # the operating (active) schedule
         self.schedule = None
         self.schedule_lock = asyncio.Lock()
+        # schedule id: ScheduleModel, to activate (or roll back) a schedule without reading it again
+        self.schedule_cache = {}
+        # schedule id: number of changes, for reads racing with writes
+        self.schedule_versions = collections.Counter()
         self.timer = None
 
         # start the timer node
-        self.timer = TimerNode('timer', int(self.app.config['BACKEND_INTERVAL']))
+        # the backend runs at every behavior change, the interval is a safety net
+        self.timer = TimerNode(int(self.app.config.get('BACKEND_INTERVAL', 300)))
+        self.app.bus.subscribe(SIGNAL_TIMER, self.backend)
+        self.app.bus.subscribe(SIGNAL_SCHEDULE, self.backend)
+
+        # retention and compaction of the database
+        self.maintenance = maintenance.Maintenance(self.app.db)
+        self.maintenance.startup()
+
+        # event loop responsiveness
+        self.loop_lag = util.LoopLagMonitor()
+        self.loop_lag.startup()
+
+        # live updates for connected clients
+        self.live = livepush.LiveHub(self.sensors)
+        asyncio.ensure_future(self.live.startup())
 
         # connect to broker
         asyncio.ensure_future(self._connect())
 
     async def _connect(self):
         try:
-            await self.broker.connect(self.app.broker_url)
+            await self.broker.connect()
             logger.info("Backend connected to broker")
-            await self.broker.subscribe([(self.timer.topic, mqtt_client.QOS_0)])
             await self.backend()
-            while self.app.is_running:
-                message = await self.broker.deliver_message()
-                logger.debug("BROKER topic={}, payload={}".format(message.topic, message.data))
-                if message.topic == self.timer.topic:
-                    if message.data == b'timer':
-                        await self.backend()
         except mqtt_client.ClientException:
             logger.critical("Unable to connect to broker! Shutting down.")
             app.stop()
 
+    async def shutdown(self):
+        """Flushes any pending data to the database. Called by the daemon on exit."""
+        self.loop_lag.shutdown()
+        self.maintenance.shutdown()
+        await self.live.shutdown()
+        await self.sensors.shutdown()
+        await self.broker.disconnect()
+
     async def backend(self):
         try:
             logger.debug("BACKEND RUNNING")
@@ -91,7 +131,7 @@ class Backend(object):
         with await self.schedule_lock:
             if self.schedule is None:
                 # read schedules config (first run)
-                schedules = self.get_enabled_schedules()
+                schedules = await self.get_enabled_schedules()
                 if len(schedules) > 0:
                     if len(schedules) > 1:
                         app.eventlog.event(eventlog.LEVEL_WARNING, 'backend', 'configuration',
@@ -105,30 +145,36 @@ class Backend(object):
 
             if self.schedule:
                 await self.schedule.timer()
+                # run again when the next behavior starts
+                self.timer.wake_in(self.schedule.next_transition())
+            else:
+                self.timer.wake_in(None)
 
     async def update_operating_schedule(self, schedule):
         """Updates the current operating schedule instance with new behaviors. Used for temporary alterations."""
         with await self.schedule_lock:
             if self.schedule:
                 if await self.schedule.update(schedule):
-                    await self.timer.trigger()
+                    self.app.bus.emit(SIGNAL_SCHEDULE)
 
     async def update_operating_behavior(self, behavior_id, config):
         """Updates the configuration of a behavior in the current operating schedule. Used for temporary alterations."""
         with await self.schedule_lock:
             if self.schedule:
                 if await self.schedule.update_behavior(behavior_id, config):
-                    await self.timer.trigger()
+                    self.app.bus.emit(SIGNAL_SCHEDULE)
 
     async def set_operating_schedule(self, schedule_id):
         with await self.schedule_lock:
             await self.cancel_current_schedule()
             if schedule_id is not None:
-                schedule = self.get_schedule(schedule_id)
+                schedule = await self.get_schedule(schedule_id)
                 if schedule:
                     logger.info("Activating schedule #{} - {}".format(schedule['id'], schedule['name']))
                     self.schedule = opschedule.OperatingSchedule(self.sensors, self.devices, schedule)
                     await self.schedule.startup()
+                    # start the current behavior right away
+                    self.app.bus.emit(SIGNAL_SCHEDULE)
 
     async def set_volatile_behavior(self, behavior_def):
         with await self.schedule_lock:
@@ -141,11 +187,12 @@ class Backend(object):
                 self.schedule = opschedule.OperatingSchedule(self.sensors, self.devices,
                                                              self.create_temp_schedule(behavior_def))
                 await self.schedule.startup()
+                self.app.bus.emit(SIGNAL_SCHEDULE)
             else:
                 # update current volatile behavior or add one
                 logger.debug("Updating current schedule")
                 await self.schedule.update_behavior(0, behavior_def)
-                await self.timer.trigger()
+                self.app.bus.emit(SIGNAL_SCHEDULE)
             logger.debug("Schedule: {}".format(self.schedule.schedule))
 
     async def cancel_current_schedule(self):
@@ -153,12 +200,13 @@ class Backend(object):
             await self.schedule.shutdown()
             self.schedule = None
 
-    def get_enabled_schedules(self):
-        with scoped_session(self.app.database) as session:
-            return [self._schedule_model(s) for s in session.query(Schedule)
-                    .filter(Schedule.enabled == 1)
-                    .order_by(Schedule.id)
-                    .all()]
+    async def get_enabled_schedules(self):
+        versions = dict(self.schedule_versions)
+        models = await self.app.db.read(get_schedule_models, Schedule.enabled == 1)
+        for model in models:
+            if versions.get(model.id, 0) == self.schedule_versions[model.id]:
+                self.schedule_cache[model.id] = model
+        return [model.as_dict() for model in models]
 
     def create_temp_schedule(self, behavior_def):
         # special id for temporary behaviors
@@ -171,46 +219,49 @@ class Backend(object):
             'enabled': True
         }
 
-    def get_schedule(self, schedule_id):
-        with scoped_session(self.app.database) as session:
-            try:
-                return self._schedule_model(session.query(Schedule)
-                                            .filter(Schedule.id == schedule_id)
-                                            .one())
-            except NoResultFound:
+    async def get_schedule(self, schedule_id):
+        """Returns a new definition of the schedule (None if it doesn't exist). Reads the database only once."""
+        model = self.schedule_cache.get(schedule_id)
+        if model is None:
+            version = self.schedule_versions[schedule_id]
+            models = await self.app.db.read(get_schedule_models, Schedule.id == schedule_id)
+            if not models:
                 return None
+            model = models[0]
+            # the schedule could have changed during the read
+            if version == self.schedule_versions[schedule_id]:
+                self.schedule_cache[schedule_id] = model
+        return model.as_dict()
 
-    @staticmethod
-    def _schedule_model(s: Schedule):
-        return {
-            'id': s.id,
-            'name': s.name,
-            'description': s.description,
-            'behaviors': [{
-                'id': b.id,
-                'name': b.behavior_name,
-                'order': b.behavior_order,
-                'start_time': b.start_time,
-                'end_time': b.end_time,
-                'config': json.loads(b.config),
-                'sensors': [sens.sensor_id for sens in b.sensors],
-                'devices': [dev.device_id for dev in b.devices],
-            } for b in s.behaviors]
-        }
+    def invalidate_schedule(self, schedule_id):
+        """Must be called after writing a schedule to the database."""
+        self.schedule_versions[schedule_id] += 1
+        self.schedule_cache.pop(schedule_id, None)
 
-    def get_enabled_sensors(self):
-        with scoped_session(self.app.database) as session:
-            stmt = Sensor.__table__.select()
-            return [dict(s) for s in session.execute(stmt)]
+    async def get_enabled_sensors(self):
+        return await self.app.db.read(lambda session: [dict(s) for s in session.execute(Sensor.__table__.select())])
 
 
 # noinspection PyUnusedLocal
 @app.listener('before_server_start')
 async def init_backend(sanic, loop):
     try:
-        app.backend = Backend(app)
+        # the broker connection shared by all components
+        if app.config.get('EMBEDDED_BROKER', False):
+            with app.startup_phase('broker'):
+                from . import broker
+                app.broker = broker.EmbeddedBroker(broker.broker_config(
+                    app.config.get('EMBEDDED_BROKER_LISTEN', '0.0.0.0:1883'),
+                    int(app.config.get('EMBEDDED_BROKER_MAX_CONNECTIONS', 50))))
+                await app.broker.start()
+            app.mqtt = broker.LocalMQTTManager(app.broker, app.new_topic('#'))
+        else:
+            app.mqtt = mqttman.MQTTManager(app.broker_url, app.new_topic('#'))
+        with app.startup_phase('backend'):
+            app.backend = Backend(app)
         n = sdnotify.SystemdNotifier()
         n.notify("READY=1")
+        app.ready()
     except:
         logger.critical('Unexpected error:', exc_info=1)
         sanic.stop()
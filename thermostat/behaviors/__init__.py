@@ -2,12 +2,12 @@
 """Smart automation behaviors."""
 
 import json
+import time
 import statistics
-import importlib
-import pkgutil
 import hbmqtt.client as mqtt_client
 
 from .. import util
+from ..registry import Registry
 
 
 class SelfDestructError(Exception):
@@ -29,6 +29,8 @@ class BaseBehavior(object):
         self.devices = devices
         self.broker = broker
         self.last_sensor_data = {}
+        # recent readings source (the sensor manager), set by the operating schedule
+        self.readings = None
 
     @classmethod
     def get_config_schema(cls):
@@ -73,6 +75,28 @@ class BaseBehavior(object):
         else:
             return None
 
+    def reading_history(self, sensor: str, sensor_type: str, seconds: float):
+        """
+        Returns the (timestamp, value) pairs received in the last seconds from memory, oldest first.
+        :param sensor: topic of the sensor
+        """
+        if self.readings is None:
+            return []
+        return self.readings.get_history(sensor.rsplit('/', 1)[-1], sensor_type, time.time() - seconds)
+
+    def reading_trend(self, sensor: str, sensor_type: str, seconds: float):
+        """Returns the slope of the readings received in the last seconds (units per hour) or None."""
+        history = self.reading_history(sensor, sensor_type, seconds)
+        if len(history) < 2:
+            return None
+        mean_t = statistics.mean(t for t, v in history)
+        mean_v = statistics.mean(v for t, v in history)
+        variance = sum((t - mean_t) ** 2 for t, v in history)
+        if variance == 0:
+            return None
+        covariance = sum((t - mean_t) * (v - mean_v) for t, v in history)
+        return covariance / variance * 3600
+
     def find_device_topic(self, topic: str):
         return next((device for device in self.devices if topic.startswith(device)), None)
 
@@ -80,33 +104,56 @@ class BaseBehavior(object):
         return next((sensor for sensor in self.sensors if topic.startswith(sensor)), None)
 
 
-def get_behaviors():
-    """Return a list of all behavior IDs (i.e. name of classes extending BaseBehavior)."""
-    behaviors = []
-    package = importlib.import_module('.', package=__name__)
-    prefix = package.__name__ + "."
-    for importer, modname, ispkg in pkgutil.iter_modules(package.__path__, prefix):
-        module = __import__(modname, fromlist=["*"])
+class BehaviorRegistry(Registry):
+    """Behavior classes (extending BaseBehavior) by module, with their configuration schemas."""
+
+    def __init__(self):
+        Registry.__init__(self, __name__, 'thermostat.behaviors')
+        # behavior id: configuration schema
+        self.schemas = {}
+
+    def scan(self, name: str, module) -> dict:
+        classes = {}
         for member in dir(module):
             cls = getattr(module, member)
-            try:
-                if cls != BaseBehavior and issubclass(cls, BaseBehavior):
-                    behaviors.append(modname[len(prefix):] + '.' + member)
-            except TypeError:
-                pass
-    return behaviors
+            if isinstance(cls, type) and cls is not BaseBehavior and issubclass(cls, BaseBehavior):
+                classes[member] = cls
+                self.schemas[name + '.' + member] = cls.get_config_schema()
+        return classes
+
+    def reload(self):
+        self.schemas.clear()
+        return Registry.reload(self)
+
+
+# loaded at startup by the backend
+registry = BehaviorRegistry()
+
+
+def get_behaviors():
+    """Return a list of all behavior IDs (i.e. <module>.<name of a class extending BaseBehavior>)."""
+    if not registry.loaded:
+        registry.load()
+    return list(registry.schemas)
 
 
 def get_behavior_handler_class(behavior_id: str):
     """Returns an appropriate behavior handler class object for the given behavior id."""
-    b_module, b_class = behavior_id.split('.', 1)
-    module = importlib.import_module('.'+b_module, __name__)
-    if module:
-        return getattr(module, b_class)
+    b_module, _, b_class = behavior_id.partition('.')
+    return registry.get(b_module, b_class)
+
+
+def get_behavior_config_schema(behavior_id: str):
+    """Returns the configuration schema of a behavior or None."""
+    if get_behavior_handler_class(behavior_id):
+        return registry.schemas[behavior_id]
 
 
-def get_behavior_handler(behavior_id: int, name: str, sensors, devices, broker: mqtt_client.MQTTClient) -> BaseBehavior:
+def get_behavior_handler(behavior_id: int, name: str, sensors, devices, broker: mqtt_client.MQTTClient,
+                         readings=None) -> BaseBehavior:
     """Returns an appropriate behavior handler instance for the given behavior id."""
     handler_class = get_behavior_handler_class(name)
     if handler_class:
-        return handler_class(behavior_id, name, sensors, devices, broker)
+        behavior = handler_class(behavior_id, name, sensors, devices, broker)
+        behavior.readings = readings
+        return behavior
@@ -86,6 +86,7 @@ class TargetTemperatureBehavior(BaseBehavior):
             return
 
         logger.debug("TARGET average temperature: {}".format(avg_temp))
+        app.control_decision(self.name)
 
         last_reading = round(avg_temp * 2) / 2
         target_temperature = self.target_temperature
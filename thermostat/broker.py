@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""The embedded MQTT broker (EMBEDDED_BROKER mode)."""
+
+import asyncio
+
+from hbmqtt.broker import Broker
+from hbmqtt.plugins.manager import Plugin
+
+from .mqttman import MQTTManager
+
+
+def broker_config(listen: str = None, max_connections: int = -1):
+    """Configuration for a broker accepting anonymous network clients on listen (<address>:<port>), if given."""
+    listener = {'type': 'tcp', 'max_connections': max_connections}
+    if listen:
+        listener['bind'] = listen
+    return {
+        'listeners': {
+            'default': listener,
+        },
+        'sys_interval': 0,
+        'auth': {
+            'allow-anonymous': True,
+        },
+        'topic-check': {
+            'enabled': False,
+        },
+    }
+
+
+class LocalDelivery(object):
+    """Broker plugin handing the messages published by network clients to the local manager."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def on_broker_message_received(self, client_id, message):
+        # only fired for network clients: the local manager delivers its own messages
+        if self.broker.local is not None:
+            self.broker.local.deliver(message.topic, bytes(message.data), message.retain)
+
+
+class EmbeddedBroker(Broker):
+    """
+    A broker running in the daemon's event loop. Messages published by network clients are also
+    handed to the local manager, which doesn't need a connection of its own.
+    """
+
+    def __init__(self, config: dict, loop=None):
+        # no plugins but ours: anonymous access, no $SYS topics
+        Broker.__init__(self, config, loop, plugin_namespace='thermostat.broker.plugins')
+        self.plugins_manager.plugins.append(Plugin('local', None, LocalDelivery(self)))
+        self.local = None
+
+
+class LocalMQTTManager(MQTTManager):
+    """
+    Same interface as MQTTManager, for components running in the same process as the broker.
+    Messages are exchanged with the broker directly, without going through TCP: local subscribers get
+    local messages right away and network clients get them through the broker.
+    """
+
+    def __init__(self, broker: EmbeddedBroker, root: str = None):
+        MQTTManager.__init__(self, None, root)
+        self.broker = broker
+        # messages to dispatch to local subscribers
+        self.queue = asyncio.Queue()
+
+    async def _connect(self):
+        self.broker.local = self
+        self.connected = True
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self._dispatcher.cancel()
+            self._connecting = None
+            self.broker.local = None
+
+    async def subscribe(self, topic_filter: str, callback, qos=None):
+        """
+        Registers a callback for the given topic filter. All retained messages are in the local cache.
+        The QoS is only accepted for compatibility with MQTTManager: local messages are never lost
+        nor duplicated, which is what QoS 2 guarantees.
+        """
+        await self.connect()
+        self.trie.add(topic_filter, callback)
+        self._replay(topic_filter, callback)
+
+    async def unsubscribe(self, topic_filter: str, callback):
+        self.trie.remove(topic_filter, callback)
+
+    async def publish(self, topic: str, message: bytes, qos=None, retain=None):
+        """
+        Publishes a message. Local subscribers always get it exactly once, network clients get it
+        with the QoS of their subscription (the broker doesn't downgrade internal messages) and a
+        retained message is stored with the given QoS.
+        """
+        await self.connect()
+        if retain:
+            self.broker.retain_message(None, topic, message, qos)
+        self.deliver(topic, message, retain)
+        await self.broker.internal_message_broadcast(topic, message, qos)
+
+    def deliver(self, topic: str, payload: bytes, retain=False):
+        """Queues a message for local subscribers, keeping retained messages in the local cache."""
+        if retain:
+            self._retain(topic, payload)
+        self.queue.put_nowait((topic, payload))
+
+    async def _dispatch(self):
+        while self.connected:
+            topic, payload = await self.queue.get()
+            for callback in self.trie.match(topic):
+                await self._call(callback, topic, payload)
@@ -15,6 +15,13 @@ async def index(request: Request):
                 '<body><h1>This is the thermostat speaking!</h1></body></html>')
 
 
+# noinspection PyUnusedLocal
+@app.get('/status/loop')
+async def loop_lag(request: Request):
+    """Event loop lag measurements (seconds)."""
+    return json(app.backend.loop_lag.stats())
+
+
 # noinspection PyUnusedLocal
 @app.exception(errors.NotFoundError)
 async def on_exception(request: Request, exception: errors.NotFoundError):
@@ -34,4 +41,4 @@ def no_content(status=204, headers=None):
 
 
 # import other controllers
-from . import sensors, devices, schedules, behaviors, eventlog
+from . import sensors, devices, schedules, behaviors, eventlog, live
@@ -4,44 +4,49 @@
 from sanic.request import Request
 from sanic.response import json
 
-from .. import app, errors
-from ..behaviors import get_behavior_handler_class, get_behaviors
+from .. import app, errors, sensors, devices
+from ..behaviors import get_behavior_config_schema, get_behaviors, registry
+from .cache import cached
 
-BEHAVIOR_ID_PREFIX = 'thermostat.behaviors.'
 
-
-def extract_behavior_id(bcls):
-    module_name = bcls.__module__
-    if module_name.startswith(BEHAVIOR_ID_PREFIX):
-        return module_name[len(BEHAVIOR_ID_PREFIX):] + '.' + bcls.__name__
-    raise Exception('Invalid behavior class: ' + str(bcls))
-
-
-def serialize_behavior(bcls):
+def serialize_behavior(behavior_id, schema):
     return {
-        'id': extract_behavior_id(bcls),
-        'config': bcls.get_config_schema(),
+        'id': behavior_id,
+        'config': schema,
     }
 
 
 # noinspection PyUnusedLocal
 @app.get('/behaviors')
+@cached('behaviors')
 async def index(request: Request):
     """List all available behaviors."""
-    behaviors = []
-    for behavior_id in get_behaviors():
-        handler_class = get_behavior_handler_class(behavior_id)
-        if not handler_class:
-            raise errors.NotFoundError('Behavior not found.')
-        behaviors.append(serialize_behavior(handler_class))
-    return json(behaviors)
+    return json([serialize_behavior(behavior_id, get_behavior_config_schema(behavior_id))
+                 for behavior_id in get_behaviors()])
 
 
 # noinspection PyUnusedLocal
 @app.get('/behaviors/<behavior_id>')
+@cached('behaviors')
 async def get(request: Request, behavior_id: str):
     """Get a single behavior."""
-    handler_class = get_behavior_handler_class(behavior_id)
-    if not handler_class:
+    schema = get_behavior_config_schema(behavior_id)
+    if schema is None:
         raise errors.NotFoundError('Behavior not found.')
-    return json(serialize_behavior(handler_class))
+    return json(serialize_behavior(behavior_id, schema))
+
+
+# noinspection PyUnusedLocal
+@app.post('/behaviors/reload')
+async def reload(request: Request):
+    """
+    Import behaviors and sensor/device protocols again (debug mode only, for development).
+    Running behaviors, sensors and devices keep the old code until they are restarted.
+    """
+    if not app.debug:
+        raise errors.NotFoundError('Not available.')
+    registry.reload()
+    sensors.registry.reload()
+    devices.registry.reload()
+    app.changed('behaviors')
+    return json(get_behaviors())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Versioned response cache."""
+
+import zlib
+import time
+import functools
+import collections
+
+from sanic.request import Request
+from sanic.response import HTTPResponse
+
+from .. import app
+
+# maximum number of cached responses
+CACHE_SIZE = 256
+
+# ETags from a previous run must not match
+BOOT_TOKEN = '{:x}'.format(int(time.time() * 1000))
+
+# (handler, arguments, query string): (version, response body)
+_responses = collections.OrderedDict()
+
+
+def make_etag(resource: str, version: int, variant: str = None):
+    """variant tells apart the representations of the same resource (e.g. different query strings)."""
+    if variant is None:
+        return '"{}-{}-{}"'.format(BOOT_TOKEN, resource, version)
+    return '"{}-{}-{}-{:x}"'.format(BOOT_TOKEN, resource, version, zlib.crc32(variant.encode()))
+
+
+def etag_matches(header: str, etag: str):
+    """True if the If-None-Match header matches the given ETag."""
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str):
+    return HTTPResponse(status=304, headers={'ETag': etag})
+
+
+def cached(resource: str):
+    """
+    Caches the encoded responses of a GET handler until the version of resource changes (see app.changed).
+    Responses carry an ETag, different for every arguments and query string, and requests
+    with a matching If-None-Match get a 304.
+    """
+
+    def decorator(handler):
+        name = handler.__module__ + '.' + handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(request: Request, *args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())), request.query_string)
+            # read before building the response: a change while building it makes it stale
+            version = app.versions[resource]
+            etag = make_etag(resource, version, repr(key[1:]))
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match and etag_matches(if_none_match, etag):
+                return not_modified(etag)
+
+            entry = _responses.get(key)
+            if entry is not None and entry[0] == version:
+                _responses.move_to_end(key)
+                return HTTPResponse(body_bytes=entry[1], content_type='application/json', headers={'ETag': etag})
+
+            response = await handler(request, *args, **kwargs)
+            if response.status == 200:
+                _responses[key] = (version, response.body)
+                _responses.move_to_end(key)
+                while len(_responses) > CACHE_SIZE:
+                    _responses.popitem(last=False)
+                response.headers['ETag'] = etag
+            return response
+
+        return wrapper
+
+    return decorator
+
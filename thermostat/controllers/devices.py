@@ -5,6 +5,7 @@ from sanic.request import Request
 from sanic.response import json
 
 from .. import app, errors
+from .cache import cached
 
 
 DEVICE_STATUS_MAP = (
@@ -27,6 +28,7 @@ def serialize_device(device):
 
 # noinspection PyUnusedLocal
 @app.get('/devices')
+@cached('devices')
 async def index(request: Request):
     """List all registered devices."""
 
@@ -39,7 +41,7 @@ async def register(request: Request):
     """Request registration for a device."""
 
     in_data = request.json
-    app.backend.devices.register(in_data['id'], in_data['protocol'], in_data['address'], in_data['type'], in_data['name'])
+    await app.backend.devices.register(in_data['id'], in_data['protocol'], in_data['address'], in_data['type'], in_data['name'])
     return json({'id': in_data['id']}, 201)
 
 
@@ -50,7 +52,7 @@ async def unregister(request: Request):
     """
 
     in_data = request.json
-    if app.backend.devices.unregister(in_data['id']):
+    if await app.backend.devices.unregister(in_data['id']):
         return json({'id': in_data['id']})
     else:
         raise errors.NotFoundError('Device not found.')
@@ -1,25 +1,79 @@
 # -*- coding: utf-8 -*-
 """Event Log API."""
 
+import base64
+import binascii
+
+from dateutil.parser import parse as parse_date
+
 from sanic.request import Request
-from sanic.response import json
+from sanic.response import json, json_dumps, HTTPResponse
+from sanic.exceptions import InvalidUsage
 
 from sqlalchemy.sql.expression import desc
 
 from .. import app
-from ..database import scoped_session
-from ..models.eventlog import EventLog
+from ..eventlog import serialize_event
+from ..models.eventlog import EventLog, get_events
+
+
+def encode_event_cursor(event_id: int, ascending: bool):
+    """An opaque cursor for the events after the given one, in the given order."""
+    return base64.urlsafe_b64encode('{}:{}'.format('a' if ascending else 'd', event_id).encode()).decode()
+
+
+def decode_event_cursor(cursor: str):
+    """Returns the event id and order (true if ascending) of a cursor."""
+    try:
+        order, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':', 1)
+        if order not in ('a', 'd'):
+            raise ValueError(order)
+        return int(event_id), order == 'a'
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidUsage('Invalid cursor.')
+
+
+# noinspection PyUnusedLocal
+@app.get('/eventlog')
+async def index(request: Request):
+    """
+    List events, newest first (order=asc for oldest first).
+    Filters: level, source and name (can be repeated), from and to.
+    Pass the returned cursor as after to get the next page: more is false on the last page.
+    """
+
+    level = request.args['level'] if 'level' in request.args else None
+    source = request.args['source'] if 'source' in request.args else None
+    name = request.args['name'] if 'name' in request.args else None
+    date_from = parse_date(request.args['from'][0]) if 'from' in request.args else None
+    date_to = parse_date(request.args['to'][0]) if 'to' in request.args else None
+    limit = int(request.args['limit'][0]) if 'limit' in request.args else 20
+
+    if 'after' in request.args:
+        # the cursor keeps the order of the first page
+        after_id, ascending = decode_event_cursor(request.args['after'][0])
+    else:
+        after_id, ascending = None, 'order' in request.args and request.args['order'][0] == 'asc'
 
+    if not (level or source or name or date_from or date_to or after_id or ascending):
+        # the default first page
+        page = app.eventlog.recent_page(limit)
+        if page is not None:
+            events, last_id, more = page
+            return HTTPResponse('{{"events":{},"cursor":{},"more":{}}}'.format(
+                events, json_dumps(encode_event_cursor(last_id, False) if last_id else None), json_dumps(more)),
+                content_type='application/json')
 
-def serialize_event(event: EventLog):
-    return {
-        'id': event.id,
-        'timestamp': event.timestamp.isoformat(),
-        'level': event.level,
-        'source': event.source,
-        'name': event.name,
-        'description': event.description,
-    }
+    def _events(session):
+        events, more = get_events(session, level, source, name, date_from, date_to, after_id, limit, ascending)
+        return [serialize_event(e) for e in events], more
+
+    events, more = await app.db.read(_events)
+    return json({
+        'events': events,
+        'cursor': encode_event_cursor(events[-1]['id'], ascending) if events else None,
+        'more': more,
+    })
 
 
 # noinspection PyUnusedLocal
@@ -38,7 +92,13 @@ async def index_next(request: Request):
     else:
         page_size = 20
 
-    with scoped_session(app.database) as session:
+    if start_id == 0:
+        # the first page comes from memory
+        page = app.eventlog.recent_page(page_size)
+        if page is not None:
+            return HTTPResponse(page[0], content_type='application/json')
+
+    def _events(session):
         query = session.query(EventLog)
         if start_id > 0:
             query = query.filter(EventLog.id < start_id)
@@ -47,7 +107,9 @@ async def index_next(request: Request):
             .limit(page_size) \
             .all()
 
-        return json([serialize_event(e) for e in events])
+        return [serialize_event(e) for e in events]
+
+    return json(await app.db.read(_events))
 
 
 # noinspection PyUnusedLocal
@@ -65,13 +127,26 @@ async def index_prev(request: Request):
     else:
         page_size = 20
 
-    with scoped_session(app.database) as session:
-        query = session.query(EventLog)
-        if start_id > 0:
-            query = query.filter(EventLog.id <= (start_id + page_size))
-
-        events = query.order_by(desc(EventLog.id)) \
-            .limit(page_size) \
-            .all()
+    if start_id == 0:
+        page = app.eventlog.recent_page(page_size)
+        if page is not None:
+            return HTTPResponse(page[0], content_type='application/json')
 
-        return json([serialize_event(e) for e in events])
+    def _events(session):
+        if start_id > 0:
+            # the page_size events right after start_id (ids might have gaps), newest first
+            events = session.query(EventLog) \
+                .filter(EventLog.id > start_id) \
+                .order_by(EventLog.id) \
+                .limit(page_size) \
+                .all()
+            events.reverse()
+        else:
+            events = session.query(EventLog) \
+                .order_by(desc(EventLog.id)) \
+                .limit(page_size) \
+                .all()
+
+        return [serialize_event(e) for e in events]
+
+    return json(await app.db.read(_events))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Live updates API."""
+
+from sanic.request import Request
+from sanic.response import json, stream
+
+from .. import app
+
+
+@app.get('/live')
+async def index(request: Request):
+    """
+    Server-Sent Events stream of sensor readings, device states and behavior changes.
+    Each event is a JSON object with topic (e.g. sensor/<id>/<type>, device/<id>/state or
+    behavior/active) and data. Topics can be filtered with topic=<filter> (can be repeated,
+    MQTT wildcards allowed). The last value of every topic is sent on connection.
+    """
+
+    filters = request.args['topic'] if 'topic' in request.args else ['#']
+    client = app.backend.live.connect(filters)
+
+    async def streaming_fn(response):
+        await app.backend.live.stream(client, response)
+
+    return stream(streaming_fn, content_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+# noinspection PyUnusedLocal
+@app.get('/live/stats')
+async def stats(request: Request):
+    """Counters of the live updates."""
+
+    return json(app.backend.live.stats())
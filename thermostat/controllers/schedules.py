@@ -8,11 +8,16 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from sanic.request import Request
 from sanic.response import json
+from sanic.exceptions import InvalidUsage
 
 from . import no_content
+from .cache import cached
 from .. import app, errors
-from ..database import scoped_session
 from ..models import Schedule, Behavior, BehaviorSensor, BehaviorDevice
+from ..models.schedules import query_schedules, get_schedules
+
+# fields of a schedule, in the order they can be selected with fields=
+SCHEDULE_FIELDS = ('id', 'name', 'description', 'enabled', 'behaviors')
 
 
 # noinspection PyTypeChecker
@@ -30,37 +35,66 @@ def serialize_schedule_behavior(b: Behavior):
 
 
 # noinspection PyTypeChecker
-def serialize_schedule(s: Schedule):
-    return {
+def serialize_schedule(s: Schedule, fields=SCHEDULE_FIELDS):
+    """s can be a row without behaviors if they are not in fields."""
+    schedule = {
         'id': s.id,
         'name': s.name,
         'description': s.description,
         'enabled': s.enabled > 0,
-        'behaviors': [serialize_schedule_behavior(b) for b in s.behaviors],
     }
+    if 'behaviors' in fields:
+        schedule['behaviors'] = [serialize_schedule_behavior(b) for b in s.behaviors]
+    return {field: schedule[field] for field in fields}
+
+
+def parse_fields(value: str):
+    fields = value.split(',')
+    if not all(field in SCHEDULE_FIELDS for field in fields):
+        raise InvalidUsage('Invalid fields.')
+    return fields
+
+
+def schedule_changed(schedule_id: int):
+    """Drops everything derived from the schedule after writing it."""
+    app.changed('schedules')
+    app.backend.invalidate_schedule(schedule_id)
 
 
 # noinspection PyUnusedLocal
 @app.get('/schedules')
+@cached('schedules')
 async def index(request: Request):
-    """List all registered schedules."""
+    """
+    List all registered schedules, by id. Use limit and offset to page results and fields
+    (comma separated, e.g. id,name,enabled) to get only some fields: behaviors are read only if requested.
+    """
+
+    fields = parse_fields(request.args['fields'][0]) if 'fields' in request.args else SCHEDULE_FIELDS
+    limit = int(request.args['limit'][0]) if 'limit' in request.args else None
+    offset = int(request.args['offset'][0]) if 'offset' in request.args else None
 
-    with scoped_session(app.database) as session:
-        schedules = [serialize_schedule(s) for s in session.query(Schedule).all()]
-    return json(schedules)
+    def list_schedules(session):
+        return [serialize_schedule(s, fields)
+                for s in get_schedules(session, 'behaviors' in fields, limit, offset)]
+
+    return json(await app.db.read(list_schedules))
 
 
 # noinspection PyUnusedLocal
 @app.get('/schedules/<schedule_id>')
+@cached('schedules')
 async def get(request: Request, schedule_id: int):
     """Get the requested schedule."""
 
-    with scoped_session(app.database) as session:
+    def get_schedule(session):
         try:
-            return json(serialize_schedule(session.query(Schedule).filter(Schedule.id == schedule_id).one()))
+            return serialize_schedule(query_schedules(session, Schedule.id == schedule_id).one())
         except NoResultFound:
             raise errors.NotFoundError('Schedule not found.')
 
+    return json(await app.db.read(get_schedule))
+
 
 # noinspection PyUnusedLocal
 @app.get('/schedules/active')
@@ -149,9 +183,8 @@ async def create(request: Request):
     """Creates a schedule."""
 
     data = request.json
-    new_id = None
-    new_enabled = False
-    with scoped_session(app.database) as session:
+
+    def create_schedule(session):
         sched = Schedule()
         sched.name = data['name']
         if 'description' in data:
@@ -182,12 +215,14 @@ async def create(request: Request):
                 sched.behaviors.append(beh)
         session.add(sched)
         session.flush()
-        new_enabled = sched.enabled
-        new_id = sched.id
 
-        if new_enabled:
+        if sched.enabled:
             # deactivate all other schedules
-            session.query(Schedule).filter(Schedule.id != new_id).update({'enabled': False})
+            session.query(Schedule).filter(Schedule.id != sched.id).update({'enabled': False})
+        return sched.id, sched.enabled
+
+    new_id, new_enabled = await app.db.write(create_schedule)
+    schedule_changed(new_id)
 
     # enable immediately if requested
     if new_enabled:
@@ -205,13 +240,16 @@ async def delete(request: Request, schedule_id: int):
         # deactivate if active
         await app.backend.set_operating_schedule(None)
 
-    with scoped_session(app.database) as session:
+    def delete_schedule(session):
         try:
             session.query(Schedule).filter(Schedule.id == schedule_id).delete()
-            return no_content()
         except NoResultFound:
             raise errors.NotFoundError('Schedule not found.')
 
+    await app.db.write(delete_schedule)
+    schedule_changed(schedule_id)
+    return no_content()
+
 
 # noinspection PyUnusedLocal
 @app.put('/schedules/<schedule_id:int>')
@@ -219,11 +257,13 @@ async def update(request: Request, schedule_id: int):
     """Updates a schedule."""
 
     data = request.json
-    new_enabled = False
-    with scoped_session(app.database) as session:
+    active = app.backend.schedule is not None and app.backend.schedule.schedule['id'] == schedule_id
+
+    def update_schedule(session):
+        new_enabled = False
         try:
             sched = session.query(Schedule).filter(Schedule.id == schedule_id).one()
-            if app.backend.schedule and app.backend.schedule.schedule['id'] == schedule_id:
+            if active:
                 new_enabled = sched.enabled
 
             if 'name' in data:
@@ -272,6 +312,10 @@ async def update(request: Request, schedule_id: int):
 
         except NoResultFound:
             raise errors.NotFoundError('Schedule not found.')
+        return new_enabled
+
+    new_enabled = await app.db.write(update_schedule)
+    schedule_changed(schedule_id)
 
     # enable immediately if requested
     if new_enabled:
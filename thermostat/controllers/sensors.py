@@ -1,15 +1,24 @@
 # -*- coding: utf-8 -*-
 """Sensors API."""
 
+import time
 import datetime
 
+from sqlalchemy import and_, or_, select
+from dateutil.parser import parse as parse_date
+
 from sanic.request import Request
-from sanic.response import json
+from sanic.response import json, json_dumps, stream
+from sanic.exceptions import InvalidUsage
 
 from .. import app, errors
-from ..database import scoped_session
-from ..models.sensors import Reading
+from .cache import cached
+from ..models.sensors import Reading, ReadingSeries
+from ..rollups import RESOLUTIONS
+
 
+# readings fetched by a single query while streaming
+STREAM_CHUNK_SIZE = 500
 
 SENSOR_STATUS_MAP = (
     'unknown',
@@ -40,24 +49,47 @@ def serialize_sensor_reading(sensor_id, mreading):
     }
 
 
-def serialize_sensor_reading_db(mreading: Reading):
+def serialize_sensor_reading_db(mreading):
+    return {
+        'sensor_id': mreading.sensor_id,
+        'type': mreading.sensor_type,
+        'timestamp': datetime.datetime.fromtimestamp(mreading.timestamp).isoformat(),
+        'unit': mreading.unit or None,
+        'value': mreading.value,
+    }
+
+
+def serialize_sensor_reading_rollup(mreading):
     return {
         'sensor_id': mreading.sensor_id,
         'type': mreading.sensor_type,
         'timestamp': mreading.timestamp.isoformat(),
         'unit': mreading.unit,
-        'value': float(mreading.value),
+        'value': mreading.sum_value / mreading.count,
+        'min': mreading.min_value,
+        'max': mreading.max_value,
+        'count': mreading.count,
     }
 
 
 # noinspection PyUnusedLocal
 @app.get('/sensors')
+@cached('sensors')
 async def index(request: Request):
     """List all registered sensors."""
 
     return json([serialize_sensor(d) for d in app.backend.sensors.values()])
 
 
+# noinspection PyUnusedLocal
+@app.get('/sensors/status')
+async def status(request: Request):
+    """When every sensor sent its last reading (not cached, unlike the sensor list)."""
+
+    return json({sensor_id: sensor.last_seen.isoformat() if sensor.last_seen else None
+                 for sensor_id, sensor in app.backend.sensors.sensors.items()})
+
+
 # noinspection PyUnusedLocal
 @app.get('/sensors/topic/<sensor_id>')
 async def topic(request: Request, sensor_id: str):
@@ -66,6 +98,14 @@ async def topic(request: Request, sensor_id: str):
     return json(app.backend.sensors[sensor_id].topic)
 
 
+# noinspection PyUnusedLocal
+@app.get('/sensors/ingestion')
+async def ingestion(request: Request):
+    """Counters of the ingestion filter and of the readings write-behind queue."""
+
+    return json(dict(app.backend.sensors.writer.stats(), **app.backend.sensors.stats()))
+
+
 @app.post('/sensors/register')
 async def register(request: Request):
     """
@@ -73,7 +113,7 @@ async def register(request: Request):
     """
 
     in_data = request.json
-    app.backend.sensors.register(in_data['id'], in_data['protocol'], in_data['address'], in_data['type'], in_data['icon'])
+    await app.backend.sensors.register(in_data['id'], in_data['protocol'], in_data['address'], in_data['type'], in_data['icon'])
     return json({'id': in_data['id']}, 201)
 
 
@@ -84,7 +124,7 @@ async def unregister(request: Request):
     """
 
     in_data = request.json
-    if app.backend.sensors.unregister(in_data['id']):
+    if await app.backend.sensors.unregister(in_data['id']):
         return json({'id': in_data['id']})
     else:
         raise errors.NotFoundError('Sensor not found.')
@@ -116,25 +156,149 @@ async def reading(request: Request, sensor_id: str):
         return json({})
 
 
+# noinspection PyUnusedLocal
+@app.get('/sensors/recent')
+async def recent(request: Request):
+    """Reads recent sensor readings from memory. Defaults to the last hour."""
+
+    sensor_id = request.args['sensor_id'][0] if 'sensor_id' in request.args else None
+    sensor_type = request.args['sensor_type'][0] if 'sensor_type' in request.args else None
+
+    if 'from' in request.args:
+        date_from = parse_reading_date(request.args['from'][0]).timestamp()
+    else:
+        date_from = time.time() - int(request.args['seconds'][0] if 'seconds' in request.args else 3600)
+    if 'to' in request.args:
+        date_to = parse_reading_date(request.args['to'][0]).timestamp()
+    else:
+        date_to = None
+
+    readings = []
+    for (r_sensor_id, r_sensor_type), buf in app.backend.sensors.buffers.series(sensor_id, sensor_type):
+        readings.extend({
+            'sensor_id': r_sensor_id,
+            'type': r_sensor_type,
+            'timestamp': datetime.datetime.fromtimestamp(timestamp).isoformat(),
+            'unit': buf.unit,
+            'value': value,
+        } for timestamp, value in buf.window(date_from, date_to))
+    return json(readings)
+
+
+def parse_reading_date(date: str):
+    """Parses a from/to argument in the form <YYYY-MM-DD>T<HH:MM:SS> (local time)."""
+    try:
+        return datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        raise InvalidUsage('Invalid date.')
+
+
+def parse_reading_cursor(cursor: str):
+    """Parses a keyset cursor in the form <timestamp>,<sensor_id>,<sensor_type>."""
+    parts = cursor.split(',', 2)
+    if len(parts) < 3:
+        raise InvalidUsage('Invalid cursor.')
+    try:
+        timestamp = parse_date(parts[0])
+    except ValueError:
+        raise InvalidUsage('Invalid cursor.')
+    return timestamp, parts[1], parts[2]
+
+
+def after_reading_cursor(keys, cursor):
+    """
+    Returns the condition selecting rows after the given cursor in (timestamp, sensor_id, sensor_type) order.
+    keys are the timestamp, sensor_id and sensor_type columns.
+    """
+    timestamp_column, sensor_id_column, sensor_type_column = keys
+    timestamp, sensor_id, sensor_type = cursor
+    same_sensor = or_(sensor_id_column > sensor_id,
+                      and_(sensor_id_column == sensor_id, sensor_type_column > sensor_type))
+    return or_(timestamp_column > timestamp, and_(timestamp_column == timestamp, same_sensor))
+
+
 @app.get('/sensors/readings')
 async def reading_list(request: Request):
-    """Reads sensor readings from the database."""
+    """
+    Reads sensor readings from the database.
+    With resolution=minute|hour|day, aggregated readings are read from the rollup tables.
+
+    Results are streamed as a JSON array or, with format=ndjson, as newline-delimited JSON.
+    Use limit to page results and after=<timestamp>,<sensor_id>,<type> (from the last
+    reading received) to get the next page.
+    """
 
     if 'sensor_type' in request.args:
         sensor_type = request.args['sensor_type'][0]
     else:
         sensor_type = None
 
-    date_from = datetime.datetime.strptime(request.args['from'][0], '%Y-%m-%dT%H:%M:%S')
-    date_to = datetime.datetime.strptime(request.args['to'][0], '%Y-%m-%dT%H:%M:%S')
-
-    with scoped_session(app.database) as session:
-        query = session.query(Reading)
-        if sensor_type:
-            query = query.filter(Reading.sensor_type == sensor_type)
-
-        readings = query.filter(Reading.timestamp.between(date_from, date_to)) \
-                        .order_by(Reading.timestamp) \
-                        .all()
-
-        return json([serialize_sensor_reading_db(r) for r in readings])
+    if 'resolution' in request.args:
+        resolution = request.args['resolution'][0]
+    else:
+        resolution = 'raw'
+
+    if 'from' not in request.args or 'to' not in request.args:
+        raise InvalidUsage('Missing from/to.')
+    date_from = parse_reading_date(request.args['from'][0])
+    date_to = parse_reading_date(request.args['to'][0])
+    cursor = parse_reading_cursor(request.args['after'][0]) if 'after' in request.args else None
+    try:
+        limit = int(request.args['limit'][0]) if 'limit' in request.args else None
+    except ValueError:
+        raise InvalidUsage('Invalid limit.')
+    ndjson = 'format' in request.args and request.args['format'][0] == 'ndjson'
+
+    if resolution == 'raw':
+        table, series = Reading.__table__, ReadingSeries.__table__
+        query = select([series.c.sensor_id, series.c.sensor_type, table.c.timestamp, series.c.unit, table.c.value]) \
+            .select_from(table.join(series, series.c.id == table.c.series_id))
+        keys = (table.c.timestamp, series.c.sensor_id, series.c.sensor_type)
+        serializer = serialize_sensor_reading_db
+        # raw timestamps are stored as epoch seconds
+        date_from, date_to = int(date_from.timestamp()), int(date_to.timestamp())
+        if cursor:
+            cursor = (int(cursor[0].timestamp()),) + cursor[1:]
+    elif resolution in RESOLUTIONS:
+        table = RESOLUTIONS[resolution][0].__table__
+        query = table.select()
+        keys = (table.c.timestamp, table.c.sensor_id, table.c.sensor_type)
+        serializer = serialize_sensor_reading_rollup
+    else:
+        raise InvalidUsage('Unsupported resolution.')
+
+    query = query.where(keys[0].between(date_from, date_to))
+    if sensor_type:
+        query = query.where(keys[2] == sensor_type)
+    query = query.order_by(*keys)
+
+    async def streaming_fn(response):
+        last = cursor
+        remaining = limit
+        first = True
+        if not ndjson:
+            await response.write(b'[')
+        while remaining is None or remaining > 0:
+            chunk_size = STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining)
+            # every chunk is a short query of its own: no lock is held while waiting for the client
+            chunk_query = query.where(after_reading_cursor(keys, last)) if last else query
+            rows = await app.db.read(lambda session: session.execute(chunk_query.limit(chunk_size)).fetchall())
+            if not rows:
+                break
+
+            data = [json_dumps(serializer(r)) for r in rows]
+            if ndjson:
+                await response.write(('\n'.join(data) + '\n').encode())
+            else:
+                await response.write(('' if first else ',') + ','.join(data))
+            first = False
+
+            last = (rows[-1].timestamp, rows[-1].sensor_id, rows[-1].sensor_type)
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < chunk_size:
+                break
+        if not ndjson:
+            await response.write(b']')
+
+    return stream(streaming_fn, content_type='application/x-ndjson' if ndjson else 'application/json')
@@ -6,20 +6,36 @@ Notes:
      best practice to ensure the session gets closed
      and reduces noise in code by not having to manually
      commit or rollback the db if a exception occurs.
+
+     Coroutines must not use sessions directly: the
+     AsyncDatabase facade runs them in worker threads
+     so that the event loop is never blocked.
 """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 
 def init(database_url):
     engine = create_engine(database_url)
+    if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        # readers don't block the writer (and vice versa)
+        event.listen(engine, 'connect', _sqlite_wal)
     # Session to be used throughout app.
     return sessionmaker(bind=engine)
 
 
+# noinspection PyUnusedLocal
+def _sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
 @contextmanager
 def scoped_session(session):
     session = session()
@@ -31,3 +47,48 @@ def scoped_session(session):
         raise
     finally:
         session.close()
+
+
+class AsyncDatabase(object):
+    """
+    Awaitable access to the database.
+
+    Sessions run in dedicated thread pools: all writes go through a single writer
+    thread (so they never compete for the database lock), reads run concurrently
+    on up to `readers` threads. Functions get a session and must return plain data,
+    not objects bound to the session.
+    """
+
+    def __init__(self, session, readers: int = 2):
+        self.session = session
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.readers = ThreadPoolExecutor(max_workers=max(1, readers))
+
+    @property
+    def engine(self):
+        return self.session.kw['bind']
+
+    def _session_call(self, fn, args):
+        with scoped_session(self.session) as session:
+            return fn(session, *args)
+
+    async def read(self, fn, *args):
+        """Runs fn(session, *args) on a reader thread and returns its result."""
+        return await asyncio.get_event_loop().run_in_executor(self.readers, self._session_call, fn, args)
+
+    async def write(self, fn, *args):
+        """Runs fn(session, *args) on the writer thread and returns its result. The session is committed."""
+        return await asyncio.get_event_loop().run_in_executor(self.writer, self._session_call, fn, args)
+
+    async def run_writer(self, fn, *args):
+        """Runs fn(*args) on the writer thread, for operations not using a session (e.g. VACUUM)."""
+        return await asyncio.get_event_loop().run_in_executor(self.writer, fn, *args)
+
+    def submit_write(self, fn, *args):
+        """Schedules fn(session, *args) on the writer thread without waiting. Returns a concurrent future."""
+        return self.writer.submit(self._session_call, fn, args)
+
+    def shutdown(self):
+        """Waits for pending operations to complete."""
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
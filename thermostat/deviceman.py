@@ -3,7 +3,7 @@
 
 from sqlalchemy.orm.exc import NoResultFound
 
-from . import devices
+from . import app, devices
 from .database import scoped_session
 from .models import Device
 
@@ -22,7 +22,8 @@ class DeviceManager(object):
         return self.devices.values()
 
     def _init(self):
-        with scoped_session(self.database) as session:
+        # runs once at startup, before serving requests
+        with scoped_session(self.database.session) as session:
             stmt = Device.__table__.select()
             for d in session.execute(stmt):
                 self._register(d['id'], d['device_type'], d['protocol'], d['address'], d['name'])
@@ -40,24 +41,31 @@ class DeviceManager(object):
         self.devices[device_id].shutdown()
         del self.devices[device_id]
 
-    def register(self, device_id, protocol, address, device_type, name):
-        with scoped_session(self.database) as session:
-            device = Device()
-            device.id = device_id
-            device.name = name
-            device.protocol = protocol
-            device.address = address
-            device.device_type = device_type
-            device = session.merge(device)
-            # will also unregister old device if any
-            self._register(device.id, device.device_type, device.protocol, device.address, device.name)
-
-    def unregister(self, device_id):
+    async def register(self, device_id, protocol, address, device_type, name):
+        await self.database.write(self._store_device, device_id, protocol, address, device_type, name)
+        # will also unregister old device if any
+        self._register(device_id, device_type, protocol, address, name)
+        app.changed('devices')
+
+    async def unregister(self, device_id):
         try:
             self._unregister(device_id)
-            with scoped_session(self.database) as session:
-                device = session.query(Device).filter(Device.id == device_id).one()
-                session.delete(device)
+            app.changed('devices')
+            await self.database.write(self._delete_device, device_id)
             return True
         except (NoResultFound, KeyError):
             return False
+
+    @staticmethod
+    def _store_device(session, device_id, protocol, address, device_type, name):
+        device = Device()
+        device.id = device_id
+        device.name = name
+        device.protocol = protocol
+        device.address = address
+        device.device_type = device_type
+        session.merge(device)
+
+    @staticmethod
+    def _delete_device(session, device_id):
+        session.delete(session.query(Device).filter(Device.id == device_id).one())
@@ -3,12 +3,12 @@
 
 import json
 import asyncio
-import importlib
 import hbmqtt.client as mqtt_client
 
 from sanic.log import logger
 
 from .. import app
+from ..registry import SchemeRegistry
 from ..errors import NotSupportedError
 
 
@@ -28,21 +28,21 @@ class BaseDeviceHandler(object):
         self.address = address.split(':', 1)
         self.name = name
         self.is_running = False
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        self.broker = app.mqtt
         self.topic = app.new_topic('device/' + device_id)
 
     async def _connect(self):
-        await self.broker.connect(app.broker_url)
+        await self.broker.connect()
         logger.info("Device " + self.id + " connected to broker")
         await self.connected()
-        await self.broker.subscribe([(self.topic + '/control', mqtt_client.QOS_2)])
-        while self.is_running:
-            message = await self.broker.deliver_message()
-            logger.debug(self.id + " DEVICE topic={}, payload={}".format(message.topic, message.data))
-            await self.control(json.loads(message.data.decode()))
+        await self.broker.subscribe(self.topic + '/control', self._control, mqtt_client.QOS_2)
+
+    async def _control(self, topic, payload):
+        logger.debug(self.id + " DEVICE topic={}, payload={}".format(topic, payload))
+        await self.control(json.loads(payload.decode()))
 
     async def _disconnect(self):
-        await self.broker.disconnect()
+        await self.broker.unsubscribe(self.topic + '/control', self._control)
         await self.disconnected()
 
     def startup(self):
@@ -78,13 +78,12 @@ class BaseDeviceHandler(object):
         return 'device:' + self.id
 
 
+# protocol modules are imported when a device using them is registered
+registry = SchemeRegistry(__name__, 'thermostat.devices')
+
+
 def get_device_handler(device_id: str, device_type: str, protocol: str, address: str, name: str) -> BaseDeviceHandler:
     """Returns an appropriate device handler for the given protocol and address."""
-    module = importlib.import_module('.'+protocol, __name__)
-    if module:
-        schemes = getattr(module, 'schemes')
-        if schemes:
-            scheme_part, address_part = address.split(':', 1)
-            if scheme_part in schemes:
-                handler_class = schemes[scheme_part]
-                return handler_class(device_id, device_type, protocol, address, name)
+    handler_class = registry.get(protocol, address.split(':', 1)[0])
+    if handler_class:
+        return handler_class(device_id, device_type, protocol, address, name)
@@ -4,11 +4,6 @@
 import asyncio
 
 import importlib.util
-try:
-    importlib.util.find_spec('RPi.GPIO')
-    import RPi.GPIO as GPIO
-except ImportError:
-    from fake_rpi.RPi import GPIO as GPIO
 
 from sanic.log import logger
 
@@ -16,6 +11,22 @@ from . import BaseDeviceHandler
 from .. import app
 from ..models import eventlog
 
+# the GPIO library is imported when the first GPIO device is created
+_gpio = None
+
+
+def get_gpio():
+    """Returns the GPIO module (a fake one when not running on a Raspberry)."""
+    global _gpio
+    if _gpio is None:
+        try:
+            importlib.util.find_spec('RPi.GPIO')
+            import RPi.GPIO as GPIO
+        except ImportError:
+            from fake_rpi.RPi import GPIO as GPIO
+        _gpio = GPIO
+    return _gpio
+
 
 class MemoryOnOffDeviceHandler(BaseDeviceHandler):
     """A device handler that manages an ON/OFF switch in memory."""
@@ -46,11 +57,12 @@ class GPIOSwitchDeviceHandler(BaseDeviceHandler):
         BaseDeviceHandler.__init__(self, device_id, device_type, protocol, address, name)
         self.pin = int(self.address[1])
         self.enabled = False
+        self.gpio = get_gpio()
 
     def set_switch(self, enabled):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.pin, GPIO.OUT)
-        GPIO.output(self.pin, enabled)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setup(self.pin, self.gpio.OUT)
+        self.gpio.output(self.pin, enabled)
         self.enabled = enabled
 
     def startup(self):
@@ -81,12 +93,12 @@ class GPIO2SwitchDeviceHandler(GPIOSwitchDeviceHandler):
 
     def set_switch(self, enabled):
         logger.info("Setting device {} to state: {}".format(self.get_name(), enabled))
-        GPIO.setmode(GPIO.BCM)
+        self.gpio.setmode(self.gpio.BCM)
         if enabled:
-            GPIO.setup(self.pin, GPIO.OUT)
-            GPIO.output(self.pin, False)
+            self.gpio.setup(self.pin, self.gpio.OUT)
+            self.gpio.output(self.pin, False)
         else:
-            GPIO.cleanup(self.pin)
+            self.gpio.cleanup(self.pin)
         self.enabled = enabled
 
 
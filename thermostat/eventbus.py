@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""In-process signals between components."""
+
+import asyncio
+
+from sanic.log import logger
+
+# the backend timer ticked
+SIGNAL_TIMER = 'timer'
+# the operating schedule was activated, altered or cancelled
+SIGNAL_SCHEDULE = 'schedule'
+# the running behavior changed (argument: the behavior definition or None)
+SIGNAL_BEHAVIOR = 'behavior'
+
+
+class EventBus(object):
+    """
+    Delivers internal signals to async callbacks of the form callback(*args) without going through
+    the MQTT broker, which is used only for externally visible topics.
+    """
+
+    def __init__(self):
+        # signal: callbacks
+        self.handlers = {}
+
+    def subscribe(self, signal: str, callback):
+        self.handlers.setdefault(signal, []).append(callback)
+
+    def unsubscribe(self, signal: str, callback):
+        callbacks = self.handlers.get(signal, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def emit(self, signal: str, *args):
+        """Sends a signal. Never blocks: each callback runs in its own task, in subscription order."""
+        for callback in self.handlers.get(signal, ()):
+            asyncio.ensure_future(self._call(signal, callback, args))
+
+    @staticmethod
+    async def _call(signal, callback, args):
+        try:
+            await callback(*args)
+        except Exception:
+            logger.error("Error dispatching signal " + signal, exc_info=1)
@@ -1,30 +1,197 @@
 # -*- coding: utf-8 -*-
-"""The Sensor Manager."""
+"""The Event Logger."""
 
 import sys
+import time
 import datetime
+import collections
+
+from sanic.response import json_dumps
 
 from .database import scoped_session
 from .models import EventLog
+from .writebehind import WriteBehindQueue
+
+
+def init(database, batch_size: int = 50, max_age: float = 2, max_pending: int = 1000, window: float = 60,
+         recent_size: int = 100):
+    eventlog = EventLogger(database, batch_size, max_age, max_pending, window, recent_size)
+    eventlog.startup()
+    return eventlog
+
+
+def serialize_event(row):
+    """An event as returned by the event log API. row is an EventLog or any mapping with the same columns."""
+    if isinstance(row, EventLog):
+        row = {column.name: getattr(row, column.name) for column in EventLog.__table__.columns}
+    return {
+        'id': row['id'],
+        'timestamp': row['timestamp'].isoformat(),
+        'level': row['level'],
+        'source': row['source'],
+        'name': row['name'],
+        'description': row['description'],
+        'count': row['count'],
+    }
+
+
+class EventLogger(WriteBehindQueue):
+    """
+    Events are queued in memory and written in batches, so logging never waits for the database.
+
+    Identical events (same level, source and name) repeated within window seconds of the first
+    one are collapsed into a single row: its count is incremented and its timestamp and
+    description are the ones of the last occurrence. Keys older than the window are forgotten
+    at every flush.
 
+    The newest recent_size events are also kept in memory, already serialized, as soon as they
+    are logged: the first page of the event log never needs the database and shows the events
+    still waiting to be written. To know their ids before writing, events are numbered here,
+    starting after the last event in the database (startup must be called first).
+    """
 
-def init(database):
-    return EventLogger(database)
+    def __init__(self, database, batch_size: int = 50, max_age: float = 2, max_pending: int = 1000,
+                 window: float = 60, recent_size: int = 100):
+        WriteBehindQueue.__init__(self, database, batch_size, max_age, max_pending)
+        self.window = window
+        # (level, source, name): (first occurrence, row), oldest first
+        self.recent = collections.OrderedDict()
+        self.counters['collapsed'] = 0
+        # id: JSON of the event, oldest first
+        self.recent_events = collections.OrderedDict()
+        self.recent_size = recent_size
+        # true if there are no other events in the database
+        self.recent_complete = True
+        # page size: (JSON array, id of the last event, more events)
+        self._recent_pages = {}
+        # id of the next event
+        self.next_id = None
 
+    def startup(self):
+        self._load_recent()
+        WriteBehindQueue.startup(self)
 
-class EventLogger(object):
-    def __init__(self, database):
-        self.database = database
+    def _load_recent(self):
+        # runs once at startup
+        with scoped_session(self.database.session) as session:
+            rows = session.execute(EventLog.__table__.select()
+                                   .order_by(EventLog.id.desc()).limit(self.recent_size + 1)).fetchall()
+        for row in reversed(rows[:self.recent_size]):
+            self._add_recent(row)
+        self.recent_complete = len(rows) <= self.recent_size
+        self.next_id = rows[0]['id'] + 1 if rows else 1
+
+    def _add_recent(self, row):
+        # a collapsed event is updated in place: its id doesn't change
+        self.recent_events[row['id']] = json_dumps(serialize_event(row))
+        while len(self.recent_events) > self.recent_size:
+            self.recent_events.popitem(last=False)
+            self.recent_complete = False
+        self._recent_pages.clear()
+
+    def recent_page(self, limit: int):
+        """
+        Returns the newest events as a JSON array, the id of the last one and true if there are older
+        events. Returns None if the page is not in memory.
+        """
+        page = self._recent_pages.get(limit)
+        if page is None:
+            if limit > len(self.recent_events) and not self.recent_complete:
+                return None
+            ids = list(reversed(self.recent_events))[:limit]
+            page = self._recent_pages[limit] = (
+                '[' + ','.join(self.recent_events[i] for i in ids) + ']',
+                ids[-1] if ids else None,
+                len(self.recent_events) > limit or not self.recent_complete,
+            )
+        return page
 
     def event(self, level: str, source: str, name: str, description: str = None):
-        with scoped_session(self.database) as session:
-            vevent = EventLog()
-            vevent.timestamp = datetime.datetime.now()
-            vevent.level = level
-            vevent.source = source
-            vevent.name = name
-            vevent.description = description
-            session.add(vevent)
+        """Queues an event for storage. Never blocks."""
+        now = time.monotonic()
+        key = (level, source, name)
+        recent = self.recent.get(key)
+        if recent is not None and now - recent[0] < self.window:
+            row = recent[1]
+            row['timestamp'] = datetime.datetime.now()
+            row['description'] = description
+            row['count'] += 1
+            self.counters['collapsed'] += 1
+            if row['id'] in self.recent_events:
+                self._add_recent(row)
+            if not row['queued']:
+                # already written: the next batch will update it
+                self._put_row(row)
+            return
+
+        row = {
+            'id': self.next_id,
+            'timestamp': datetime.datetime.now(),
+            'level': level,
+            'source': source,
+            'name': name,
+            'description': description,
+            'count': 1,
+            'queued': False,
+            'written': False,
+        }
+        self.next_id += 1
+        # keep the first occurrences in order
+        self.recent.pop(key, None)
+        self.recent[key] = (now, row)
+        self._add_recent(row)
+        self._put_row(row)
+
+    def _put_row(self, row):
+        if len(self.queue) >= self.max_pending:
+            # the oldest row is about to be dropped
+            dropped = self.queue[0]
+            dropped['queued'] = False
+            if not dropped['written'] and self.recent_events.pop(dropped['id'], None) is not None:
+                self._recent_pages.clear()
+        row['queued'] = True
+        self.put(row)
+
+    def _expire(self):
+        """Forgets the events that can't be collapsed anymore."""
+        now = time.monotonic()
+        while self.recent:
+            key, (first, row) = next(iter(self.recent.items()))
+            if now - first < self.window:
+                break
+            del self.recent[key]
+
+    def _take(self):
+        self._expire()
+        # rows can still change after being taken: the writer gets a snapshot
+        batch = []
+        for row in WriteBehindQueue._take(self):
+            row['queued'] = False
+            batch.append(dict(row, row=row))
+        return batch
+
+    def _requeue(self, batch):
+        rows = []
+        for snapshot in batch:
+            row = snapshot['row']
+            if not snapshot['written']:
+                # the insert was rolled back
+                row['written'] = False
+            if not row['queued']:
+                row['queued'] = True
+                rows.append(row)
+        WriteBehindQueue._requeue(self, rows)
+
+    def write(self, session, batch):
+        table = EventLog.__table__
+        for snapshot in batch:
+            values = {k: snapshot[k] for k in ('timestamp', 'level', 'source', 'name', 'description', 'count')}
+            if not snapshot['written']:
+                # the next batch is taken after this one is written, so it will update the row
+                session.execute(table.insert().values(id=snapshot['id'], **values))
+                snapshot['row']['written'] = True
+            else:
+                session.execute(table.update().where(table.c.id == snapshot['id']).values(**values))
 
     def event_exc(self, level: str, source: str, name: str):
         import traceback
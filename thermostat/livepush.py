@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Live push of sensor readings, device states and behavior changes to connected clients."""
+
+import asyncio
+import collections
+
+from sanic.log import logger
+from sanic.response import json_dumps
+
+from . import app
+from .mqttman import topic_matches
+from .eventbus import SIGNAL_BEHAVIOR
+
+
+# topics remembered for new clients (and matched per client): the oldest ones are forgotten first
+MAX_TOPICS = 1000
+
+
+def encode_frame(topic: str, data: bytes):
+    """A Server-Sent Events message. data is the JSON payload (empty for none)."""
+    return b'data: {"topic":' + json_dumps(topic).encode() + b',"data":' + (data or b'null') + b'}\n\n'
+
+
+class LiveClient(object):
+    """
+    A connected client. Only the last message of each topic is kept until it's sent:
+    a slow client skips the intermediate values.
+    """
+
+    def __init__(self, filters: list):
+        # topic filters (with +/# wildcards) relative to the base topic
+        self.filters = filters
+        # topic: true if the topic matches the filters
+        self.matched = {}
+        # topic: frame, in the order they were pushed
+        self.pending = collections.OrderedDict()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def matches(self, topic: str):
+        matched = self.matched.get(topic)
+        if matched is None:
+            if len(self.matched) >= MAX_TOPICS:
+                self.matched.clear()
+            matched = self.matched[topic] = any(topic_matches(f, topic) for f in self.filters)
+        return matched
+
+    def push(self, topic: str, frame: bytes):
+        if topic in self.pending:
+            # the client didn't get the previous value yet: it's already stale
+            del self.pending[topic]
+            self.dropped += 1
+        self.pending[topic] = frame
+        self.ready.set()
+
+    def take(self):
+        """Returns all pending frames."""
+        frames = list(self.pending.values())
+        self.pending.clear()
+        self.ready.clear()
+        return frames
+
+
+class LiveHub(object):
+    """
+    Fans out a single internal subscription to all connected clients.
+    Every message is encoded once and shared by all clients, and each client gets
+    at most one write every MIN_INTERVAL seconds.
+    """
+
+    # seconds between keep-alive comments (also detects disconnected clients)
+    KEEPALIVE = 30
+    # messages arriving within this many seconds are sent with a single write
+    MIN_INTERVAL = 0.25
+    # a client not reading for this many seconds is disconnected
+    WRITE_TIMEOUT = 30
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.broker = app.mqtt
+        self.base_topic = app.new_topic('')
+        self.clients = set()
+        # topic: last frame, sent to new clients (at most MAX_TOPICS, least recently updated first)
+        self.last = collections.OrderedDict()
+        self.counters = {'messages': 0, 'connections': 0}
+        self.is_running = False
+
+    async def startup(self):
+        self.is_running = True
+        # readings come from the sensor manager, after the ingestion filter
+        for sensor_id in list(self.sensors.sensors):
+            for topic, data in self.sensors.get_sensor_data(sensor_id).items():
+                self.publish(topic[len(self.base_topic):], json_dumps(data).encode())
+        self.sensors.add_listener(None, self._sensor_message)
+        app.bus.subscribe(SIGNAL_BEHAVIOR, self._behavior_signal)
+        await self.broker.subscribe(self.base_topic + 'device/+/state', self._message)
+
+    async def shutdown(self):
+        # let all streams end
+        self.is_running = False
+        for client in self.clients:
+            client.ready.set()
+        self.sensors.remove_listener(None, self._sensor_message)
+        app.bus.unsubscribe(SIGNAL_BEHAVIOR, self._behavior_signal)
+        await self.broker.unsubscribe(self.base_topic + 'device/+/state', self._message)
+
+    async def _sensor_message(self, topic, data):
+        self.publish(topic[len(self.base_topic):], json_dumps(data).encode())
+
+    async def _behavior_signal(self, behavior_def):
+        self.publish('behavior/active', json_dumps(behavior_def).encode() if behavior_def else b'')
+
+    async def _message(self, topic, payload):
+        self.publish(topic[len(self.base_topic):], payload)
+
+    def publish(self, topic: str, data: bytes):
+        """Sends a message to all interested clients. topic is relative to the base topic."""
+        frame = encode_frame(topic, data)
+        self.last.pop(topic, None)
+        self.last[topic] = frame
+        if len(self.last) > MAX_TOPICS:
+            self.last.popitem(last=False)
+        self.counters['messages'] += 1
+        for client in self.clients:
+            if client.matches(topic):
+                client.push(topic, frame)
+
+    def connect(self, filters: list):
+        """Registers a new client. It will first receive the last message of every topic."""
+        client = LiveClient(filters)
+        for topic, frame in self.last.items():
+            if client.matches(topic):
+                client.push(topic, frame)
+        self.clients.add(client)
+        self.counters['connections'] += 1
+        return client
+
+    def disconnect(self, client: LiveClient):
+        self.clients.discard(client)
+
+    async def stream(self, client: LiveClient, response):
+        """
+        Writes the messages for a client until it disconnects: a disconnected client is detected
+        by the next write failing (at the latest with the keep-alive) or by the stream being cancelled.
+        """
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(client.ready.wait(), self.KEEPALIVE)
+                    await asyncio.sleep(self.MIN_INTERVAL)
+                    data = b''.join(client.take())
+                except asyncio.TimeoutError:
+                    data = b':\n\n'
+                if not self.is_running:
+                    break
+                # a write blocks while the client is not reading: meanwhile new values replace the pending ones
+                await asyncio.wait_for(response.write(data), self.WRITE_TIMEOUT)
+                client.sent += 1
+        except asyncio.TimeoutError:
+            logger.debug("Live client not reading, disconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("Live client disconnected ({})".format(e))
+        finally:
+            self.disconnect(client)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['clients'] = len(self.clients)
+        stats['dropped'] = sum(c.dropped for c in self.clients)
+        return stats
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Database maintenance: retention of old data and compaction."""
+
+import sys
+import time
+import asyncio
+import datetime
+
+from sanic.log import logger
+from sqlalchemy import select, and_
+
+from . import app
+from .models import Reading, ReadingSeries, ReadingMinute, ReadingHour, ReadingDay, EventLog
+from .models import eventlog
+
+# config key, default retention in days (0 keeps everything), model
+RETENTION_POLICIES = (
+    ('RETENTION_READINGS', 30, Reading),
+    ('RETENTION_READINGS_MINUTE', 0, ReadingMinute),
+    ('RETENTION_READINGS_HOUR', 0, ReadingHour),
+    ('RETENTION_READINGS_DAY', 0, ReadingDay),
+    ('RETENTION_EVENTS', 90, EventLog),
+)
+
+# seconds to wait after startup before the first run
+STARTUP_DELAY = 60
+
+# SQLite auto_vacuum modes
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def delete_batch(session, table, key, cutoff, batch_size: int, where=None):
+    """
+    Deletes about batch_size rows with a timestamp older than cutoff, in key order.
+    Keys don't need to be unique: rows sharing the last key are deleted too.
+    Returns the number of rows deleted.
+    """
+    condition = table.c.timestamp < cutoff
+    if where is not None:
+        condition = and_(where, condition)
+    bound = session.execute(select([key]).where(condition)
+                            .order_by(key).offset(batch_size - 1).limit(1)).scalar()
+    if bound is not None:
+        condition = and_(condition, key <= bound)
+    return session.execute(table.delete().where(condition)).rowcount
+
+
+def enable_incremental_vacuum(engine):
+    """
+    Switches a SQLite database to incremental vacuum. Needs a full vacuum, which rewrites the whole file:
+    run it with the daemon stopped (see tools/enable_incremental_vacuum.py).
+    Returns False if incremental vacuum was already enabled.
+    """
+    with engine.connect() as conn:
+        if conn.execute('PRAGMA auto_vacuum').scalar() == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    return True
+
+
+def format_size(size: int):
+    if size < 1048576:
+        return '{:.1f} KB'.format(size / 1024)
+    return '{:.1f} MB'.format(size / 1048576)
+
+
+class Maintenance(object):
+    """
+    Periodically deletes data older than the configured retention and compacts the database.
+    Deletes run in small batches on the writer thread, each in its own short transaction,
+    so they never hold the write lock for long. Free pages are returned to the filesystem only
+    if incremental vacuum was enabled on the database (see enable_incremental_vacuum).
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.interval = float(app.config.get('MAINTENANCE_INTERVAL', 3600))
+        self.batch_size = int(app.config.get('MAINTENANCE_BATCH_SIZE', 500))
+        self.batch_pause = float(app.config.get('MAINTENANCE_BATCH_PAUSE', 0.2))
+        self.vacuum_pages = int(app.config.get('MAINTENANCE_VACUUM_PAGES', 256))
+        self.vacuum_steps = int(app.config.get('MAINTENANCE_VACUUM_STEPS', 16))
+        self.analyze_interval = float(app.config.get('MAINTENANCE_ANALYZE_INTERVAL', 86400))
+        # model: retention in days
+        self.retention = {model: int(app.config.get(key, default)) for key, default, model in RETENTION_POLICIES}
+        self.last_analyze = None
+        self.vacuum_warned = False
+        self._task = None
+
+    def startup(self):
+        self._task = asyncio.ensure_future(self._loop())
+
+    def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        await asyncio.sleep(STARTUP_DELAY)
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.error('Unexpected error:', exc_info=sys.exc_info())
+                app.eventlog.event_exc(eventlog.LEVEL_ERROR, 'maintenance', 'exception')
+            await asyncio.sleep(self.interval)
+
+    async def run(self):
+        """A full maintenance cycle. Returns the rows deleted for each table and the bytes reclaimed."""
+        deleted = {}
+        for model, days in self.retention.items():
+            if days > 0:
+                count = await self.purge(model, days)
+                if count > 0:
+                    deleted[model.__tablename__] = count
+
+        reclaimed = 0
+        if self.database.engine.dialect.name == 'sqlite':
+            reclaimed = await self.compact()
+            if self.last_analyze is None or time.monotonic() - self.last_analyze >= self.analyze_interval:
+                await self.database.run_writer(self.analyze)
+                self.last_analyze = time.monotonic()
+
+        if deleted or reclaimed > 0:
+            description = 'deleted: {}; reclaimed: {}'.format(
+                ', '.join('{} {}'.format(table, count) for table, count in sorted(deleted.items())) or 'none',
+                format_size(reclaimed))
+            logger.info('Database maintenance: ' + description)
+            app.eventlog.event(eventlog.LEVEL_INFO, 'maintenance', 'database:maintenance', description)
+        return deleted, reclaimed
+
+    async def purge(self, model, days: int):
+        """Deletes rows older than the given days, one batch at a time. Returns the number of rows deleted."""
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+        table = model.__table__
+
+        if model is Reading:
+            # raw readings are stored with epoch timestamps (indexed)
+            cutoff = int(cutoff.timestamp())
+            partitions = [(table.c.timestamp, None)]
+        elif model is EventLog:
+            # ids grow with timestamps: the oldest events come first in primary key order
+            partitions = [(table.c.id, None)]
+        else:
+            # rollups are keyed by series first: delete one series at a time to use the primary key
+            partitions = [(table.c.timestamp, and_(table.c.sensor_id == sensor_id, table.c.sensor_type == sensor_type))
+                          for sensor_id, sensor_type in await self.database.read(self._series)]
+
+        total = 0
+        for key, where in partitions:
+            while True:
+                count = await self.database.write(delete_batch, table, key, cutoff, self.batch_size, where)
+                total += count
+                if count < self.batch_size:
+                    break
+                # let other writers in
+                await asyncio.sleep(self.batch_pause)
+        return total
+
+    @staticmethod
+    def _series(session):
+        return session.query(ReadingSeries.sensor_id, ReadingSeries.sensor_type).distinct().all()
+
+    async def compact(self):
+        """
+        Returns free pages to the filesystem, vacuum_pages at a time and at most vacuum_steps times:
+        the next run goes on with the pages left. Returns the number of bytes reclaimed.
+        """
+        reclaimed = 0
+        for step in range(self.vacuum_steps):
+            freed, remaining = await self.database.run_writer(self.vacuum_step)
+            reclaimed += freed
+            if remaining == 0:
+                break
+            # let other writers in
+            await asyncio.sleep(self.batch_pause)
+        return reclaimed
+
+    def vacuum_step(self):
+        """
+        Frees up to vacuum_pages pages. Returns the number of bytes reclaimed and of free pages left.
+        Runs in the writer thread.
+        """
+        with self.database.engine.connect() as conn:
+            if conn.execute('PRAGMA auto_vacuum').scalar() != AUTO_VACUUM_INCREMENTAL:
+                # a full vacuum would block the writer for too long: it's up to tools/enable_incremental_vacuum.py
+                if not self.vacuum_warned:
+                    logger.warning('Incremental vacuum not enabled, free pages will not be reclaimed')
+                    self.vacuum_warned = True
+                return 0, 0
+            if conn.execute('PRAGMA freelist_count').scalar() == 0:
+                return 0, 0
+            page_size = conn.execute('PRAGMA page_size').scalar()
+            before = conn.execute('PRAGMA page_count').scalar()
+            # executescript runs the pragma to completion (execute would free only one page)
+            conn.connection.executescript('PRAGMA incremental_vacuum({})'.format(self.vacuum_pages))
+            after = conn.execute('PRAGMA page_count').scalar()
+            return (before - after) * page_size, conn.execute('PRAGMA freelist_count').scalar()
+
+    def analyze(self):
+        """Updates the query planner statistics."""
+        with self.database.engine.connect() as conn:
+            conn.execute('ANALYZE')
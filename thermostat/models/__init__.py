@@ -11,7 +11,7 @@ from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
-from .sensors import Sensor, Reading
+from .sensors import Sensor, ReadingSeries, Reading, LatestReading, ReadingMinute, ReadingHour, ReadingDay
 from .devices import Device
 from .eventlog import EventLog
 from .schedules import Schedule, Behavior, BehaviorSensor, BehaviorDevice
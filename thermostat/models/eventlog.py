@@ -2,7 +2,7 @@
 """Models for logged events."""
 
 from sqlalchemy import (
-    Column, String, Integer, DateTime
+    Column, String, Integer, DateTime, Index
 )
 
 from . import Base
@@ -29,8 +29,43 @@ class EventLog(Base):
     source = Column(String(100))
     name = Column(String(100))
     description = Column(String(300), nullable=True)
+    # identical events repeated in a short time are stored once
+    count = Column(Integer(), nullable=False, default=1, server_default='1')
+
+    # filters walk the index in id order: no sorting, no scanning of non-matching rows
+    __table_args__ = (
+        Index('ix_event_log_level_id', 'level', 'id'),
+        Index('ix_event_log_source_id', 'source', 'id'),
+        Index('ix_event_log_name_id', 'name', 'id'),
+        Index('ix_event_log_timestamp', 'timestamp'),
+    )
 
     # Methods
     def __repr__(self):
         """ Show event object info. """
         return '<EventLog: {}>'.format(self.id)
+
+
+def get_events(session, level=None, source=None, name=None, date_from=None, date_to=None,
+               after_id: int = None, limit: int = 20, ascending: bool = False):
+    """
+    Returns a page of events matching the given filters, newest first (oldest first if ascending),
+    starting after the event with the given id. level, source and name can be lists.
+    Returns the events and true if there are more.
+    """
+    query = session.query(EventLog)
+    for column, value in ((EventLog.level, level), (EventLog.source, source), (EventLog.name, name)):
+        if isinstance(value, (list, tuple)):
+            query = query.filter(column.in_(value))
+        elif value is not None:
+            query = query.filter(column == value)
+    if date_from is not None:
+        query = query.filter(EventLog.timestamp >= date_from)
+    if date_to is not None:
+        query = query.filter(EventLog.timestamp <= date_to)
+    if after_id is not None:
+        query = query.filter(EventLog.id > after_id if ascending else EventLog.id < after_id)
+
+    # one more row tells if there is another page, without counting
+    events = query.order_by(EventLog.id if ascending else EventLog.id.desc()).limit(limit + 1).all()
+    return events[:limit], len(events) > limit
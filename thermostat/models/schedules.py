@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 """Models for schedules."""
 
+import copy
+import json
+import collections
+
 from sqlalchemy import (
     Column, String, Integer, SmallInteger, Boolean, ForeignKey
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, joinedload
 
 from . import Base
 
@@ -65,3 +69,74 @@ class BehaviorDevice(Base):
     # primary key
     behavior_id = Column(Integer(), ForeignKey('schedule_behaviors.id'), primary_key=True)
     device_id = Column(String(100), primary_key=True)
+
+
+class ScheduleModel(collections.namedtuple('ScheduleModel', 'id name description enabled behaviors')):
+    """
+    A schedule compiled for the backend: read once with all its behaviors and never modified
+    (behaviors is a tuple of BehaviorModel).
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        """A new schedule definition, which the operating schedule is free to alter."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'behaviors': [b.as_dict() for b in self.behaviors],
+        }
+
+
+class BehaviorModel(collections.namedtuple('BehaviorModel',
+                                           'id name order start_time end_time config sensors devices')):
+    """A behavior of a ScheduleModel. config is already decoded, sensors and devices are tuples."""
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'order': self.order,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'config': copy.deepcopy(self.config),
+            'sensors': list(self.sensors),
+            'devices': list(self.devices),
+        }
+
+
+def compile_schedule(s: Schedule):
+    return ScheduleModel(s.id, s.name, s.description, bool(s.enabled), tuple(BehaviorModel(
+        b.id, b.behavior_name, b.behavior_order, b.start_time, b.end_time, json.loads(b.config),
+        tuple(sens.sensor_id for sens in b.sensors), tuple(dev.device_id for dev in b.devices),
+    ) for b in s.behaviors))
+
+
+def query_schedules(session, *criterion):
+    """Schedules with their behaviors, sensors and devices, all loaded with a single query."""
+    behaviors = joinedload(Schedule.behaviors)
+    return (session.query(Schedule)
+            .options(behaviors.joinedload(Behavior.sensors), behaviors.joinedload(Behavior.devices))
+            .filter(*criterion)
+            .order_by(Schedule.id))
+
+
+def get_schedules(session, behaviors: bool = True, limit: int = None, offset: int = None):
+    """
+    A page of schedules by id, always with a single query: with their behaviors (loaded eagerly)
+    or only the id, name, description and enabled columns.
+    """
+    if behaviors:
+        query = query_schedules(session)
+    else:
+        query = (session.query(Schedule.id, Schedule.name, Schedule.description, Schedule.enabled)
+                 .order_by(Schedule.id))
+    return query.limit(limit).offset(offset).all()
+
+
+def get_schedule_models(session, *criterion):
+    """Compiled schedules matching the given criteria, by id."""
+    return [compile_schedule(s) for s in query_schedules(session, *criterion)]
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 """Models for sensors and sensor readings."""
 
+import datetime
+
 from sqlalchemy import (
-    Column, String, Integer, DateTime, text, column
+    Column, String, Integer, Float, DateTime, ForeignKey, Index, UniqueConstraint, and_, select
 )
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm.exc import NoResultFound
 
 from . import Base
@@ -38,47 +43,162 @@ class Sensor(Base):
         return '<Sensor: {}>'.format(self.id)
 
 
+class ReadingSeries(Base):
+    """Lookup table for the (sensor, type, unit) series stored in sensor_readings."""
+    __tablename__ = 'sensor_series'
+
+    id = Column(Integer(), primary_key=True)
+
+    sensor_id = Column(String(255), nullable=False)
+    sensor_type = Column(String(20), nullable=False)
+    unit = Column(String(20), nullable=False, default='')
+
+    __table_args__ = (
+        UniqueConstraint('sensor_id', 'sensor_type', 'unit'),
+    )
+
+    # Methods
+    def __repr__(self):
+        """ Show series object info. """
+        return '<ReadingSeries: {}/{}>'.format(self.sensor_id, self.sensor_type)
+
+
 class Reading(Base):
     __tablename__ = 'sensor_readings'
 
-    # Sensor id, type and timestamp are the key
+    # Series and timestamp (epoch seconds) are the key
+    series_id = Column(Integer(), ForeignKey('sensor_series.id'), primary_key=True, autoincrement=False)
+    timestamp = Column(Integer(), primary_key=True, autoincrement=False)
+
+    # Reading contents
+    value = Column(Float())
+
+    __table_args__ = (
+        Index('ix_sensor_readings_timestamp', 'timestamp'),
+        # rows are stored in primary key order (SQLite only)
+        {'info': {'without_rowid': True}},
+    )
+
+    # Methods
+    def __repr__(self):
+        """ Show sensor object info. """
+        return '<Reading: {}@{}>'.format(self.series_id, self.timestamp)
+
+
+@compiles(CreateTable, 'sqlite')
+def _create_table_sqlite(element, compiler, **kw):
+    ddl = compiler.visit_create_table(element, **kw)
+    if element.element.info.get('without_rowid'):
+        ddl = ddl.rstrip() + ' WITHOUT ROWID\n\n'
+    return ddl
+
+
+class LatestReading(Base):
+    """The last reading of every sensor and type, updated together with sensor_readings."""
+    __tablename__ = 'latest_readings'
+
+    sensor_id = Column(String(255), primary_key=True)
+    sensor_type = Column(String(20), primary_key=True)
+
+    timestamp = Column(DateTime(), nullable=False)
+    unit = Column(String(20))
+    value = Column(Float())
+    # seconds the reading is valid for (if the sensor told us)
+    validity = Column(Integer(), nullable=True)
+
+    # Methods
+    def __repr__(self):
+        """ Show reading object info. """
+        return '<LatestReading: {}/{}@{}>'.format(self.sensor_id, self.sensor_type, self.timestamp)
+
+
+class ReadingRollupMixin(object):
+    """Aggregated readings over a fixed period (minute, hour or day)."""
+
+    # Sensor id, type and period start are the key
     sensor_id = Column(String(255), primary_key=True)
     sensor_type = Column(String(20), primary_key=True)
     timestamp = Column(DateTime(), primary_key=True)
 
-    # Reading contents
+    # Aggregates
     unit = Column(String(20))
-    value = Column(String(255))
+    min_value = Column(Float())
+    max_value = Column(Float())
+    sum_value = Column(Float())
+    count = Column(Integer())
+
+    @declared_attr
+    def __table_args__(cls):
+        # charts read all sensors in a time range: (timestamp, sensor, type) order, no sorting
+        return (
+            Index('ix_{}_timestamp'.format(cls.__tablename__), 'timestamp', 'sensor_id', 'sensor_type'),
+        )
 
     # Methods
     def __repr__(self):
-        """ Show sensor object info. """
-        return '<Reading: {}@{}>'.format(self.sensor_id, self.timestamp)
+        """ Show rollup object info. """
+        return '<{}: {}@{}>'.format(self.__class__.__name__, self.sensor_id, self.timestamp)
+
+
+class ReadingMinute(ReadingRollupMixin, Base):
+    __tablename__ = 'sensor_readings_minute'
+
+
+class ReadingHour(ReadingRollupMixin, Base):
+    __tablename__ = 'sensor_readings_hour'
+
+
+class ReadingDay(ReadingRollupMixin, Base):
+    __tablename__ = 'sensor_readings_day'
+
+
+def reading_epoch(timestamp: datetime.datetime):
+    """The stored timestamp of a reading (epoch seconds). Naive datetimes are local time."""
+    return int(timestamp.timestamp())
+
+
+def get_series_id(session, sensor_id, sensor_type, unit):
+    """Returns the id of the given series, creating it if needed."""
+    unit = unit or ''
+    table = ReadingSeries.__table__
+    query = table.select().where(and_(table.c.sensor_id == sensor_id,
+                                      table.c.sensor_type == sensor_type,
+                                      table.c.unit == unit))
+    row = session.execute(query).first()
+    if row:
+        return row.id
+    return session.execute(table.insert().values(sensor_id=sensor_id, sensor_type=sensor_type, unit=unit)) \
+        .inserted_primary_key[0]
+
+
+def update_latest_readings(session, readings):
+    """Stores the newest of the given readings for each sensor and type. Older readings are ignored."""
+    latest = {}
+    for reading in readings:
+        key = (reading['sensor_id'], reading['sensor_type'])
+        if key not in latest or reading['timestamp'] >= latest[key]['timestamp']:
+            latest[key] = reading
+
+    table = LatestReading.__table__
+    for (sensor_id, sensor_type), reading in latest.items():
+        key = and_(table.c.sensor_id == sensor_id, table.c.sensor_type == sensor_type)
+        values = {'timestamp': reading['timestamp'], 'unit': reading['unit'], 'value': float(reading['value']),
+                  'validity': reading.get('validity')}
+        if session.execute(table.update().where(and_(key, table.c.timestamp <= reading['timestamp']))
+                           .values(**values)).rowcount == 0:
+            # either a new series or a newer reading is already stored
+            if session.execute(select([table.c.sensor_id]).where(key)).first() is None:
+                session.execute(table.insert().values(sensor_id=sensor_id, sensor_type=sensor_type, **values))
 
 
-def get_last_readings(session, modifier='-10 minutes', sensor_type=None):
-    # FIXME use SQLAlchemy
-    params = {'modifier': modifier}
+def get_last_readings(session, seconds=600, sensor_type=None):
+    """Returns the last reading of every sensor and type updated in the last given seconds (None for all)."""
+    query = session.query(LatestReading)
+    if seconds is not None:
+        query = query.filter(LatestReading.timestamp > datetime.datetime.now() - datetime.timedelta(seconds=seconds))
     if sensor_type:
-        add_query = 'sensor_type = :sensor_type and'
-        params['sensor_type'] = sensor_type
-    else:
-        add_query = ''
-
-    return session.query(Reading).from_statement(text("select r.sensor_id sensor_id, r.sensor_type sensor_type, \
-        r.timestamp timestamp, r.unit unit, r.value value \
-        from sensor_readings r join \
-        (select sensor_id, sensor_type, max(timestamp) timestamp from sensor_readings \
-        where "+add_query+" timestamp > datetime('now', :modifier) \
-        group by sensor_id, sensor_type) as rmax \
-        on r.sensor_id = rmax.sensor_id and r.sensor_type = rmax.sensor_type and r.timestamp = rmax.timestamp \
-        order by timestamp desc").bindparams(**params).columns(
-        column('sensor_id', Integer),
-        column('sensor_type', String),
-        column('timestamp', DateTime),
-        column('unit', String),
-        column('value', String)
-        )).all()
+        query = query.filter(LatestReading.sensor_type == sensor_type)
+    return query.order_by(LatestReading.timestamp.desc()).all()
 
 
 def is_active_sensor(session, sensor_id):
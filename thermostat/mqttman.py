@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""The MQTT connection manager. A single broker connection shared by all components."""
+
+import asyncio
+
+import hbmqtt.client as mqtt_client
+
+from sanic.log import logger
+
+
+def topic_matches(topic_filter: str, topic: str):
+    """Return true if the given topic matches the given topic filter (with +/# wildcards)."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    if topic.startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def filter_covers(general: str, specific: str):
+    """Return true if every topic matched by the specific filter is also matched by the general one."""
+    general_levels = general.split('/')
+    specific_levels = specific.split('/')
+    for index, level in enumerate(general_levels):
+        if level == '#':
+            return True
+        if index >= len(specific_levels) or specific_levels[index] == '#':
+            return False
+        if level != '+' and (specific_levels[index] == '+' or level != specific_levels[index]):
+            return False
+    return len(general_levels) == len(specific_levels)
+
+
+class _TopicNode(object):
+    __slots__ = ('children', 'callbacks')
+
+    def __init__(self):
+        self.children = {}
+        self.callbacks = []
+
+
+class TopicTrie(object):
+    """
+    Topic filters indexed level by level. Each filter holds a list of callbacks:
+    the same callback can be added more than once (reference counting).
+    """
+
+    def __init__(self):
+        self.root = _TopicNode()
+
+    def add(self, topic_filter: str, callback):
+        """Adds a callback to a filter. Returns the number of callbacks for the filter."""
+        node = self.root
+        for level in topic_filter.split('/'):
+            if level not in node.children:
+                node.children[level] = _TopicNode()
+            node = node.children[level]
+        node.callbacks.append(callback)
+        return len(node.callbacks)
+
+    def remove(self, topic_filter: str, callback):
+        """
+        Removes a callback from a filter. Returns the number of callbacks left for the filter
+        or -1 if the callback was not registered for the filter.
+        """
+        path = [self.root]
+        levels = topic_filter.split('/')
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return -1
+            path.append(node)
+
+        callbacks = path[-1].callbacks
+        if callback not in callbacks:
+            return -1
+        callbacks.remove(callback)
+        count = len(callbacks)
+
+        # prune empty branches
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.callbacks or node.children:
+                break
+            del path[index - 1].children[levels[index - 1]]
+        return count
+
+    def match(self, topic: str):
+        """Returns the callbacks (without duplicates) of all filters matching the given topic."""
+        callbacks = []
+        levels = topic.split('/')
+        self._match(self.root, levels, 0, not topic.startswith('$'), callbacks)
+        # a callback registered to overlapping filters receives the message once
+        seen = set()
+        return [c for c in callbacks if not (c in seen or seen.add(c))]
+
+    def _match(self, node: _TopicNode, levels: list, index: int, wildcards: bool, callbacks: list):
+        if wildcards and '#' in node.children:
+            callbacks.extend(node.children['#'].callbacks)
+        if index == len(levels):
+            callbacks.extend(node.callbacks)
+            return
+        child = node.children.get(levels[index])
+        if child is not None:
+            self._match(child, levels, index + 1, True, callbacks)
+        if wildcards and '+' in node.children:
+            self._match(node.children['+'], levels, index + 1, True, callbacks)
+
+
+class MQTTManager(object):
+    """
+    Owns the broker connection and routes incoming messages to async callbacks
+    of the form callback(topic: str, payload: bytes).
+
+    Broker subscriptions are reference counted: components subscribing to the same filter share a
+    single broker subscription. If a root filter is given, it is subscribed for the whole lifetime
+    of the connection and filters covered by it never generate broker traffic: routing is done locally.
+    Components subscribing to a filter that is already active receive the last retained messages from
+    a local cache, since the broker won't send them again.
+
+    The cache only knows the retained messages published through this manager and the ones the broker
+    sent when a filter was subscribed. A message retained by another client while we were already
+    subscribed is forwarded as a plain message and is not cached: a component subscribing later to a
+    covered filter won't get it (subscribe before, or with no root filter). LocalMQTTManager sees every
+    retained message and has no such limit.
+
+    If the connection is lost, the manager reconnects (waiting longer after every failed attempt)
+    and subscribes again to all its filters. Meanwhile, publishers and subscribers wait.
+    """
+
+    # seconds before the first reconnection attempt, doubled after every failure
+    RECONNECT_DELAY = 1
+    RECONNECT_MAX_DELAY = 60
+    # seconds without messages after which the connection is checked
+    PING_INTERVAL = 30
+
+    def __init__(self, url: str, root: str = None):
+        self.url = url
+        self.root = root
+        self.client = None
+        self.trie = TopicTrie()
+        # topic_filter: reference count (only filters actually subscribed on the broker)
+        self.broker_filters = {}
+        # topic_filter: reference count (filters covered by a broker filter)
+        self.covered_filters = {}
+        # topic_filter: QoS of the first subscriber
+        self.qos = {}
+        # topic: last payload (retained topics only)
+        self.retained = {}
+        self.connected = False
+        self._connecting = None
+        self._dispatcher = None
+
+    async def connect(self):
+        """Connects to the broker. Can be called any number of times, the connection is made only once."""
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        await asyncio.shield(self._connecting)
+
+    async def _connect(self):
+        try:
+            await self._open()
+        except Exception:
+            # allow retrying
+            self._connecting = None
+            raise
+        logger.info("MQTT manager connected to broker")
+
+    async def _open(self):
+        """Opens a new connection and subscribes to the broker filters."""
+        self.client = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        await self.client.connect(self.url)
+        if self.root:
+            self.broker_filters.setdefault(self.root, 1)
+        if self.broker_filters:
+            await self.client.subscribe([(f, self.qos.get(f, mqtt_client.QOS_0)) for f in self.broker_filters])
+        self.connected = True
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def _reconnect(self):
+        delay = self.RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._open()
+                logger.info("MQTT manager reconnected to broker")
+                return
+            except Exception as e:
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                logger.warning("MQTT reconnection failed ({}), retrying in {} seconds".format(e, delay))
+
+    async def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self._dispatcher.cancel()
+            self._connecting = None
+            await self.client.disconnect()
+        elif self._connecting is not None:
+            # still reconnecting
+            self._connecting.cancel()
+            self._connecting = None
+
+    async def subscribe(self, topic_filter: str, callback, qos=mqtt_client.QOS_0):
+        """
+        Registers a callback for the given topic filter. The broker subscription is made
+        only for the first subscriber and only if the filter is not covered by another one.
+        The QoS of a shared or covered subscription is the one of the first subscriber.
+        """
+        await self.connect()
+        self.trie.add(topic_filter, callback)
+        self.qos.setdefault(topic_filter, qos)
+        if topic_filter in self.broker_filters:
+            self.broker_filters[topic_filter] += 1
+            self._replay(topic_filter, callback)
+        elif topic_filter in self.covered_filters or any(filter_covers(f, topic_filter) for f in self.broker_filters):
+            self.covered_filters[topic_filter] = self.covered_filters.get(topic_filter, 0) + 1
+            self._replay(topic_filter, callback)
+        else:
+            self.broker_filters[topic_filter] = 1
+            # broker will send retained messages by itself
+            await self.client.subscribe([(topic_filter, qos)])
+            logger.debug("MQTT subscribed to " + topic_filter)
+
+    async def unsubscribe(self, topic_filter: str, callback):
+        """Removes a callback. The broker subscription is removed with the last subscriber."""
+        if self.trie.remove(topic_filter, callback) < 0:
+            return
+        if topic_filter in self.covered_filters:
+            self.covered_filters[topic_filter] -= 1
+            if self.covered_filters[topic_filter] <= 0:
+                del self.covered_filters[topic_filter]
+                del self.qos[topic_filter]
+        elif topic_filter in self.broker_filters and topic_filter != self.root:
+            self.broker_filters[topic_filter] -= 1
+            if self.broker_filters[topic_filter] <= 0:
+                del self.broker_filters[topic_filter]
+                del self.qos[topic_filter]
+                # filters that were covered by this one need a broker subscription of their own
+                uncovered = self._uncovered_filters()
+                for f in uncovered:
+                    self.broker_filters[f] = self.covered_filters.pop(f)
+                if self.connected:
+                    if uncovered:
+                        await self.client.subscribe([(f, self.qos[f]) for f in uncovered])
+                        logger.debug("MQTT subscribed to " + ', '.join(uncovered))
+                    await self.client.unsubscribe([topic_filter])
+                    logger.debug("MQTT unsubscribed from " + topic_filter)
+
+    def _uncovered_filters(self):
+        """Covered filters not covered anymore by a broker filter (nor by one another)."""
+        uncovered = [f for f in self.covered_filters if not any(filter_covers(b, f) for b in self.broker_filters)]
+        return [f for f in uncovered if not any(filter_covers(o, f) for o in uncovered if o != f)]
+
+    async def publish(self, topic: str, message: bytes, qos=None, retain=None):
+        """Publishes a message. Same signature as MQTTClient.publish."""
+        await self.connect()
+        if retain:
+            self._retain(topic, message)
+        await self.client.publish(topic, message, qos=qos, retain=retain)
+
+    def _retain(self, topic, payload):
+        if payload:
+            self.retained[topic] = payload
+        else:
+            self.retained.pop(topic, None)
+
+    def _replay(self, topic_filter, callback):
+        """Sends the cached retained messages matching the filter to a new subscriber."""
+        messages = [(topic, payload) for topic, payload in self.retained.items() if topic_matches(topic_filter, topic)]
+        if messages:
+            asyncio.ensure_future(self._send(callback, messages))
+
+    async def _send(self, callback, messages):
+        for topic, payload in messages:
+            await self._call(callback, topic, payload)
+
+    async def _receive(self):
+        """Waits for the next message. Raises an exception if the connection is lost."""
+        delivery = asyncio.ensure_future(self.client.deliver_message())
+        try:
+            while True:
+                done, pending = await asyncio.wait([delivery], timeout=self.PING_INTERVAL)
+                if done:
+                    return delivery.result()
+                # hbmqtt doesn't always wake up a pending delivery on connection loss: ping the broker
+                await asyncio.wait_for(self.client.ping(), self.PING_INTERVAL)
+        finally:
+            if not delivery.done():
+                delivery.cancel()
+
+    async def _dispatch(self):
+        while self.connected:
+            try:
+                message = await self._receive()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error("MQTT connection lost, reconnecting", exc_info=1)
+                self.connected = False
+                self._connecting = asyncio.ensure_future(self._reconnect())
+                break
+
+            topic = message.topic
+            payload = bytes(message.data)
+            logger.debug("MQTT topic={}, payload={}".format(topic, payload))
+            if message.retain or topic in self.retained:
+                self._retain(topic, payload)
+
+            for callback in self.trie.match(topic):
+                await self._call(callback, topic, payload)
+
+    @staticmethod
+    async def _call(callback, topic, payload):
+        """Callbacks are awaited in order: long operations should be detached by the callback itself."""
+        try:
+            await callback(topic, payload)
+        except Exception:
+            logger.error("Error dispatching message on topic " + topic, exc_info=1)
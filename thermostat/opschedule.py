@@ -2,18 +2,61 @@
 """The operating schedule."""
 
 import json
+import array
+import bisect
 import asyncio
 import datetime
 import functools
-import hbmqtt.client as mqtt_client
 
 from sanic.log import logger
 
 from . import app
+from .eventbus import SIGNAL_BEHAVIOR
 from .sensorman import SensorManager
 from .deviceman import DeviceManager
 from .behaviors import SelfDestructError, BaseBehavior, get_behavior_handler
 
+# behavior times are minutes from the start of the week (monday 00:00)
+WEEK_MINUTES = 7 * 24 * 60
+
+
+class BehaviorTable(object):
+    """
+    The behavior to run in every minute of the week, computed once for a list of behaviors.
+    Where behaviors overlap the one with the lowest order wins (the last one listed for the same order).
+    """
+
+    def __init__(self, behaviors: list):
+        self.behaviors = list(behaviors)
+        # minute: index of the behavior or -1
+        self.minutes = array.array('i', [-1]) * WEEK_MINUTES
+        # the winner is written last
+        ranked = sorted(range(len(self.behaviors)), key=lambda i: (-self.behaviors[i]['order'], i))
+        for index in ranked:
+            start = max(self.behaviors[index]['start_time'], 0)
+            end = min(self.behaviors[index]['end_time'], WEEK_MINUTES)
+            if start < end:
+                self.minutes[start:end] = array.array('i', [index]) * (end - start)
+        # minutes when the behavior changes (the week wraps around)
+        self.transitions = [m for m in range(WEEK_MINUTES) if self.minutes[m] != self.minutes[m - 1]]
+
+    def behavior(self, minute: int):
+        """Returns the behavior for a minute of the week or None."""
+        index = self.minutes[minute] if 0 <= minute < WEEK_MINUTES else -1
+        return self.behaviors[index] if index >= 0 else None
+
+    def next_transition(self, minute: int):
+        """
+        Returns the first minute after the given one when the behavior changes (WEEK_MINUTES or more if
+        it's in the next week) or None if it never changes.
+        """
+        if not self.transitions:
+            return None
+        index = bisect.bisect_right(self.transitions, minute)
+        if index < len(self.transitions):
+            return self.transitions[index]
+        return self.transitions[0] + WEEK_MINUTES
+
 
 class OperatingSchedule(object):
 
@@ -30,20 +73,21 @@ class OperatingSchedule(object):
         # the currently operating behavior subscription task
         self.behavior_sub = None
         self.behavior_topic = app.new_topic('behavior/active')
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        self.broker = app.mqtt
         self.is_running = False
+        # rebuilt on every change to the behaviors
+        self.table = BehaviorTable(self.schedule['behaviors'])
 
     async def startup(self):
         """Starts scheduling operations."""
         self.is_running = True
-        await self.broker.connect(app.broker_url)
+        await self.broker.connect()
         logger.info("Operating schedule connected to broker")
 
     async def shutdown(self):
         self.is_running = False
         if self.behavior:
             await self.stop_behavior()
-        await self.broker.disconnect()
 
     async def update(self, schedule):
         """Return true if something has changed in a currently running behavior."""
@@ -59,6 +103,7 @@ class OperatingSchedule(object):
         self.schedule['name'] = schedule['name']
         self.schedule['description'] = schedule['description']
         self.schedule['behaviors'] = schedule['behaviors']
+        self.table = BehaviorTable(self.schedule['behaviors'])
         return True
 
     async def update_behavior(self, behavior_id: int, config: dict):
@@ -89,6 +134,7 @@ class OperatingSchedule(object):
             if 'devices' in config:
                 behavior_def['devices'] = config['devices']
 
+        self.table = BehaviorTable(self.schedule['behaviors'])
         return restart or not behavior_id
 
     async def timer(self):
@@ -122,8 +168,12 @@ class OperatingSchedule(object):
         with await self.behavior_lock:
             sensor_topics = self.get_sensor_topics(behavior_def)
             device_topics = self.get_device_topics(behavior_def)
-            behavior = get_behavior_handler(behavior_def['id'], behavior_def['name'], sensor_topics, device_topics, self.broker)
-            # the subscribe method will also listen for messages so we'll just fire it off
+            behavior = get_behavior_handler(behavior_def['id'], behavior_def['name'], sensor_topics, device_topics,
+                                            self.broker, self.sensors)
+            # last readings known so far (possibly loaded at startup): no need to wait for sensors to publish
+            for sensor_id in behavior_def['sensors']:
+                behavior.last_sensor_data.update(self.sensors.get_sensor_data(sensor_id))
+            # messages will be dispatched to our callbacks, so we'll just fire off the subscriptions
             # noinspection PyAsyncCall
             try:
                 await behavior.startup(behavior_def['config'])
@@ -131,6 +181,7 @@ class OperatingSchedule(object):
                 self.behavior = behavior
                 self.behavior_sub = asyncio.ensure_future(self.subscribe_for_behavior(behavior))
                 # publish active behavior
+                app.bus.emit(SIGNAL_BEHAVIOR, self.behavior_def)
                 await self.broker.publish(self.behavior_topic, json.dumps(self.behavior_def).encode(), retain=True)
             except SelfDestructError:
                 logger.debug("Behavior self-destructed during startup")
@@ -139,20 +190,14 @@ class OperatingSchedule(object):
     async def stop_behavior(self):
         """Stop the currently running behavior."""
         with await self.behavior_lock:
-            # cancel immediately
-            self.behavior_sub.cancel()
-            try:
-                await self.behavior_sub
-            except asyncio.CancelledError:
-                pass
+            # wait for subscriptions to complete so we can undo them
+            await asyncio.wait([self.behavior_sub])
 
-            sensor_topics = self.get_sensor_topics()
-            if sensor_topics:
-                await self.broker.unsubscribe([topic + '/+' for topic in sensor_topics])
+            for sensor_id in self.behavior_def['sensors']:
+                self.sensors.remove_listener(sensor_id, self._sensor_message)
 
-            device_topics = self.get_device_topics()
-            if device_topics:
-                await self.broker.unsubscribe([topic + '/+' for topic in device_topics])
+            for topic in self.get_device_topics():
+                await self.broker.unsubscribe(topic + '/+', self._device_message)
 
             try:
                 await self.behavior.shutdown()
@@ -164,42 +209,39 @@ class OperatingSchedule(object):
                 self.delete_behavior(self.behavior_def)
 
             # publish null behavior
+            app.bus.emit(SIGNAL_BEHAVIOR, None)
             await self.broker.publish(self.behavior_topic, ''.encode(), retain=True)
             self.behavior = None
             self.behavior_def = None
             self.behavior_sub = None
 
     async def subscribe_for_behavior(self, behavior: BaseBehavior):
-        # subscribe to required sensors
+        # readings of the required sensors come from the sensor manager, after the ingestion filter
         for sensor_id in self.behavior_def['sensors']:
-            sensor = self.sensors[sensor_id]
-            logger.debug("SCHEDULE subscribing to sensor {}".format(sensor.topic))
-            await self.broker.subscribe([(sensor.topic + '/+', mqtt_client.QOS_0)])
-            # subscribe twice - hbmqtt bug or our own bug
-            await self.broker.subscribe([(sensor.topic + '/+', mqtt_client.QOS_0)])
+            logger.debug("SCHEDULE listening to sensor {}".format(sensor_id))
+            self.sensors.add_listener(sensor_id, self._sensor_message)
 
         # subscribe to required devices
         for device_id in self.behavior_def['devices']:
             device = self.devices[device_id]
             logger.debug("SCHEDULE subscribing to device {}".format(device.topic))
-            await self.broker.subscribe([(device.topic + '/+', mqtt_client.QOS_0)])
-
-        while self.is_running and self.behavior_def:
-            message = await self.broker.deliver_message()
-            logger.debug("SCHEDULE topic={}, payload={}".format(message.topic, message.data))
+            await self.broker.subscribe(device.topic + '/+', self._device_message)
 
+    async def _sensor_message(self, topic, data):
+        logger.debug("SCHEDULE topic={}, data={}".format(topic, data))
+        if self.is_running and self.behavior:
             # callback calls must be detached from our flow
+            # noinspection PyAsyncCall
+            asyncio.ensure_future(self.behavior.sensor_data(topic, data)) \
+                   .add_done_callback(self._future_result)
 
-            if any(message.topic.startswith(self.sensors[sensor_id].topic)
-                   for sensor_id in self.behavior_def['sensors']):
-                # noinspection PyAsyncCall
-                asyncio.ensure_future(behavior.sensor_data(message.topic, json.loads(message.data.decode()))) \
-                       .add_done_callback(self._future_result)
-            elif any(message.topic.startswith(self.devices[device_id].topic)
-                     for device_id in self.behavior_def['devices']):
-                # noinspection PyAsyncCall
-                asyncio.ensure_future(behavior.device_state(message.topic, json.loads(message.data.decode()))) \
-                       .add_done_callback(self._future_result)
+    async def _device_message(self, topic, payload):
+        logger.debug("SCHEDULE topic={}, payload={}".format(topic, payload))
+        if self.is_running and self.behavior:
+            # callback calls must be detached from our flow
+            # noinspection PyAsyncCall
+            asyncio.ensure_future(self.behavior.device_state(topic, json.loads(payload.decode()))) \
+                   .add_done_callback(self._future_result)
 
     def _future_result(self, task: asyncio.Future):
         try:
@@ -228,12 +270,21 @@ class OperatingSchedule(object):
         return [self.devices[device_id].topic for device_id in behavior_def['devices']]
 
     def find_current_behavior(self, offset):
-        candidate = None
-        for bev in self.schedule['behaviors']:
-            if bev['start_time'] <= offset < bev['end_time'] and \
-                    (candidate is None or bev['order'] <= candidate['order']):
-                candidate = bev
-        return candidate
+        return self.table.behavior(offset)
+
+    def find_next_transition(self, offset):
+        """Returns the minute of the week when the current behavior will change (see BehaviorTable)."""
+        return self.table.next_transition(offset)
+
+    def next_transition(self, now: datetime.datetime = None):
+        """Returns the seconds until the current behavior will change or None if it never changes."""
+        if now is None:
+            now = datetime.datetime.now()
+        now_min = self.get_time_minutes(now.weekday(), now.hour, now.minute)
+        next_min = self.find_next_transition(now_min)
+        if next_min is None:
+            return None
+        return (next_min - now_min) * 60 - now.second - now.microsecond / 1000000
 
     # noinspection PyUnusedLocal
     def _delete_behavior(self, task: asyncio.Future, behavior_def):
@@ -243,6 +294,7 @@ class OperatingSchedule(object):
     def delete_behavior(self, behavior_def):
         """Remove the given behavior from our schedule."""
         self.schedule['behaviors'].remove(behavior_def)
+        self.table = BehaviorTable(self.schedule['behaviors'])
 
     def get_behavior(self, behavior_id):
         return next((b for b in self.schedule['behaviors'] if b['id'] == behavior_id), None)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Ingestion filter for sensor readings."""
+
+import urllib.parse as urllib_parse
+
+# address parameters overriding the configured defaults
+FILTER_PARAMS = ('deadband', 'quantum', 'heartbeat')
+
+
+class ReadingFilter(object):
+    """
+    Drops readings that carry no new information. Values are rounded to a multiple of quantum
+    and a reading is accepted only if its value moved by at least deadband from the last accepted one,
+    or if nothing was accepted for heartbeat seconds (or half the validity of the last accepted reading).
+    With deadband and quantum both 0 every reading is accepted.
+    """
+
+    def __init__(self, deadband: float = 0, quantum: float = 0, heartbeat: float = 0):
+        self.deadband = deadband
+        self.quantum = quantum
+        self.heartbeat = heartbeat
+        # sensor_type: (timestamp, value, validity) of the last accepted reading
+        self.last = {}
+
+    @property
+    def enabled(self):
+        return self.deadband > 0 or self.quantum > 0
+
+    def quantize(self, value: float):
+        if self.quantum > 0:
+            # rounding again gets rid of floating point noise (e.g. 20.400000000000002)
+            return round(round(value / self.quantum) * self.quantum, 10)
+        return value
+
+    def accept(self, sensor_type: str, timestamp: float, value: float, validity: int = None):
+        """Returns the (quantized) value to store or None if the reading should be dropped."""
+        if not self.enabled:
+            return value
+
+        value = self.quantize(value)
+        last = self.last.get(sensor_type)
+        if last is not None:
+            if timestamp < last[0]:
+                # late reading: nothing to compare it with
+                return value
+            heartbeat = self.heartbeat
+            if last[2]:
+                # the last reading must not expire while the value is stable
+                heartbeat = min(heartbeat, last[2] / 2) if heartbeat > 0 else last[2] / 2
+            stale = heartbeat > 0 and timestamp - last[0] >= heartbeat
+            if not stale and (value == last[1] or round(abs(value - last[1]), 10) < self.deadband):
+                return None
+
+        self.last[sensor_type] = (timestamp, value, validity)
+        return value
+
+
+def from_address(address: str, deadband: float = 0, quantum: float = 0, heartbeat: float = 0):
+    """Creates a filter with the given defaults, overridden by deadband/quantum/heartbeat parameters in the address."""
+    params = urllib_parse.parse_qs(address or '')
+    values = {'deadband': deadband, 'quantum': quantum, 'heartbeat': heartbeat}
+    for name in FILTER_PARAMS:
+        if name in params:
+            values[name] = float(params[name][0])
+    return ReadingFilter(**values)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Registries of handler classes (behaviors, sensor and device protocols)."""
+
+import pkgutil
+import importlib
+
+
+class Registry(object):
+    """
+    Handler classes provided by the modules of a package and by the modules declared in a setuptools
+    entry point group, e.g. in the setup.py of a plugin:
+
+        entry_points={'thermostat.behaviors': ['myplugin = myplugin.behaviors']}
+
+    The entry point name is used in place of the module name. Modules are imported once, the first time
+    one of their classes is needed (or all at once by load), and classes are then looked up by module name
+    and key.
+    """
+
+    def __init__(self, package: str, entry_point_group: str):
+        self.package = package
+        self.entry_point_group = entry_point_group
+        # module name: {key: class}
+        self.modules = {}
+        # module name: module object
+        self._imported = {}
+        # module name: module path (from entry points)
+        self._entry_points = None
+        # true if all modules were imported
+        self.loaded = False
+
+    def scan(self, name: str, module) -> dict:
+        """Returns the handler classes of a module by key."""
+        raise NotImplementedError()
+
+    def entry_points(self):
+        if self._entry_points is None:
+            self._entry_points = {}
+            try:
+                import pkg_resources
+            except ImportError:
+                return self._entry_points
+            for entry_point in pkg_resources.iter_entry_points(self.entry_point_group):
+                self._entry_points[entry_point.name] = entry_point.module_name
+        return self._entry_points
+
+    def _import(self, name: str):
+        full_name = self.package + '.' + name
+        try:
+            return importlib.import_module(full_name)
+        except ImportError as e:
+            # a missing dependency of the module must not look like a missing module
+            if e.name != full_name:
+                raise
+        module_name = self.entry_points().get(name)
+        if module_name:
+            return importlib.import_module(module_name)
+
+    def module(self, name: str) -> dict:
+        """Returns the classes of a module by key (empty if the module doesn't exist)."""
+        classes = self.modules.get(name)
+        if classes is None:
+            module = self._import(name)
+            if module is None:
+                return {}
+            self._imported[name] = module
+            classes = self.modules[name] = self.scan(name, module)
+        return classes
+
+    def get(self, name: str, key: str):
+        """Returns the class for the given key in a module or None."""
+        return self.module(name).get(key)
+
+    def load(self):
+        """Imports all modules of the package and of the entry point group."""
+        package = importlib.import_module(self.package)
+        names = [name for importer, name, ispkg in pkgutil.iter_modules(package.__path__)]
+        names.extend(name for name in self.entry_points() if name not in names)
+        for name in names:
+            self.module(name)
+        self.loaded = True
+        return self
+
+    def reload(self):
+        """
+        Imports the modules again, e.g. after editing them during development (new modules are found
+        only if all modules were loaded). Instances already created keep using the old classes.
+        """
+        imported = dict(self._imported)
+        self.modules.clear()
+        self._imported.clear()
+        self._entry_points = None
+        for name, module in imported.items():
+            self._imported[name] = importlib.reload(module)
+            self.modules[name] = self.scan(name, self._imported[name])
+        if self.loaded:
+            self.load()
+        return self
+
+
+class SchemeRegistry(Registry):
+    """Protocol modules declaring their handler classes by address scheme in a schemes dict."""
+
+    def scan(self, name: str, module) -> dict:
+        return dict(getattr(module, 'schemes', None) or {})
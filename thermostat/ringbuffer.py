@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""In-memory ring buffers of recent sensor readings."""
+
+from array import array
+
+from sanic.log import logger
+
+# bytes used by a single reading (timestamp and value as doubles)
+READING_SIZE = 16
+
+
+class ReadingBuffer(object):
+    """
+    A fixed-capacity ring buffer of (timestamp, value) pairs for a single (sensor, type) series.
+    Timestamps are epoch seconds and must be non-decreasing: older readings are ignored.
+    """
+
+    __slots__ = ('capacity', 'unit', 'timestamps', 'values', 'start', 'count')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.unit = None
+        self.timestamps = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        # index of the oldest reading
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, position):
+        """Physical index of the logical position (0 is the oldest reading)."""
+        return (self.start + position) % self.capacity
+
+    def append(self, timestamp: float, value: float):
+        """Adds a reading. Returns false if the reading was older than the last one."""
+        if self.count > 0:
+            last = self._index(self.count - 1)
+            if timestamp < self.timestamps[last]:
+                return False
+            if timestamp == self.timestamps[last]:
+                # same reading received twice (e.g. retained message)
+                self.values[last] = value
+                return True
+
+        if self.count < self.capacity:
+            index = self._index(self.count)
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.timestamps[index] = timestamp
+        self.values[index] = value
+        return True
+
+    def resize(self, capacity: int):
+        """Changes the capacity. The oldest readings are dropped if they don't fit."""
+        readings = self.window()[-capacity:]
+        self.capacity = capacity
+        self.timestamps = array('d', [t for t, v in readings]) + array('d', [0.0]) * (capacity - len(readings))
+        self.values = array('d', [v for t, v in readings]) + array('d', [0.0]) * (capacity - len(readings))
+        self.start = 0
+        self.count = len(readings)
+
+    def last(self):
+        """Returns the last (timestamp, value) pair or None."""
+        if self.count == 0:
+            return None
+        index = self._index(self.count - 1)
+        return self.timestamps[index], self.values[index]
+
+    def _bisect(self, timestamp):
+        """Logical position of the first reading not older than timestamp."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._index(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def window(self, start: float = None, end: float = None):
+        """Returns the (timestamp, value) pairs with start <= timestamp <= end, oldest first."""
+        first = 0 if start is None else self._bisect(start)
+        result = []
+        for position in range(first, self.count):
+            index = self._index(position)
+            timestamp = self.timestamps[index]
+            if end is not None and timestamp > end:
+                break
+            result.append((timestamp, self.values[index]))
+        return result
+
+
+class ReadingBufferPool(object):
+    """
+    Ring buffers for all (sensor, type) series, within a memory ceiling.
+    Each series gets up to capacity readings. When the memory budget is exhausted, a new series
+    gets its fair share by shrinking the largest buffers (their oldest readings are dropped).
+    Series are refused only if the budget can't hold a single reading for each of them.
+    """
+
+    def __init__(self, capacity: int, max_memory: int):
+        self.capacity = max(1, capacity)
+        self.max_memory = max_memory
+        self.memory = 0
+        # (sensor_id, sensor_type): ReadingBuffer
+        self.buffers = {}
+        # true once buffers had to be shrunk (it's logged only once)
+        self.exhausted = False
+        # series refused for lack of memory (already logged)
+        self.refused = set()
+
+    def get(self, sensor_id: str, sensor_type: str):
+        """Returns the buffer for the given series, or None."""
+        return self.buffers.get((sensor_id, sensor_type))
+
+    def append(self, sensor_id: str, sensor_type: str, timestamp: float, unit: str, value: float):
+        """Adds a reading. Returns false if it was ignored (older than the last one or no memory left)."""
+        key = (sensor_id, sensor_type)
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self._allocate(sensor_id, sensor_type)
+            if buf is None:
+                return False
+            self.buffers[key] = buf
+        buf.unit = unit
+        return buf.append(timestamp, value)
+
+    def _allocate(self, sensor_id: str, sensor_type: str):
+        """A new buffer within the memory budget, or None if there's no room for it."""
+        share = min(self.capacity, self.max_memory // READING_SIZE // (len(self.buffers) + 1))
+        if share < 1:
+            if (sensor_id, sensor_type) not in self.refused:
+                self.refused.add((sensor_id, sensor_type))
+                logger.warning("Readings buffer memory exhausted ({} bytes), not keeping readings of {}/{}"
+                               .format(self.max_memory, sensor_id, sensor_type))
+            return None
+
+        available = (self.max_memory - self.memory) // READING_SIZE
+        if available < share:
+            if not self.exhausted:
+                logger.warning("Readings buffer memory exhausted ({} bytes), keeping fewer readings per sensor"
+                               .format(self.max_memory))
+                self.exhausted = True
+            for buf in sorted(self.buffers.values(), key=lambda b: b.capacity, reverse=True):
+                if available >= share or buf.capacity <= share:
+                    break
+                capacity = max(share, buf.capacity - (share - available))
+                available += buf.capacity - capacity
+                self.memory -= (buf.capacity - capacity) * READING_SIZE
+                buf.resize(capacity)
+
+        buf = ReadingBuffer(min(share, available))
+        self.memory += buf.capacity * READING_SIZE
+        return buf
+
+    def remove(self, sensor_id: str):
+        """Drops all buffers of a sensor. Their memory goes to the next new series."""
+        for key in [k for k in self.buffers if k[0] == sensor_id]:
+            self.memory -= self.buffers[key].capacity * READING_SIZE
+            del self.buffers[key]
+        self.refused.clear()
+
+    def series(self, sensor_id: str = None, sensor_type: str = None):
+        """Iterates over ((sensor_id, sensor_type), buffer) matching the given filters."""
+        for key, buf in self.buffers.items():
+            if (sensor_id is None or key[0] == sensor_id) and (sensor_type is None or key[1] == sensor_type):
+                yield key, buf
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Per-minute, per-hour and per-day rollups of sensor readings, maintained incrementally."""
+
+import datetime
+
+from sqlalchemy import and_, or_, case, select
+
+from .database import scoped_session
+from .models import Reading, ReadingSeries, ReadingMinute, ReadingHour, ReadingDay
+from .models.sensors import reading_epoch
+
+
+def _minute(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def _hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# resolution: (model, period start function)
+RESOLUTIONS = {
+    'minute': (ReadingMinute, _minute),
+    'hour': (ReadingHour, _hour),
+    'day': (ReadingDay, _day),
+}
+
+
+def local_time(timestamp):
+    """
+    Periods are in naive local time, computed from the stored epoch timestamp (like raw readings in the API):
+    the same reading lands in the same period whatever the time zone of its timestamp.
+    """
+    if isinstance(timestamp, datetime.datetime):
+        timestamp = reading_epoch(timestamp)
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def aggregate(readings):
+    """
+    Aggregates readings (dicts with sensor_id, sensor_type, timestamp, unit and value) by period.
+    Timestamps are datetimes or epoch seconds.
+    Returns a dict {(resolution, sensor_id, sensor_type, period): [unit, min, max, sum, count]}.
+    """
+    buckets = {}
+    for reading in readings:
+        value = float(reading['value'])
+        timestamp = local_time(reading['timestamp'])
+        for resolution, (model, period) in RESOLUTIONS.items():
+            key = (resolution, reading['sensor_id'], reading['sensor_type'], period(timestamp))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [reading['unit'], value, value, value, 1]
+            else:
+                bucket[0] = reading['unit']
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+    return buckets
+
+
+def update_rollups(session, readings):
+    """Adds the given readings to the rollup tables. Must be called in the same transaction storing them."""
+    for (resolution, sensor_id, sensor_type, timestamp), bucket in aggregate(readings).items():
+        unit, min_value, max_value, sum_value, count = bucket
+        table = RESOLUTIONS[resolution][0].__table__
+        result = session.execute(table.update()
+                                 .where(and_(table.c.sensor_id == sensor_id,
+                                             table.c.sensor_type == sensor_type,
+                                             table.c.timestamp == timestamp))
+                                 .values(unit=unit,
+                                         min_value=case([(table.c.min_value > min_value, min_value)],
+                                                        else_=table.c.min_value),
+                                         max_value=case([(table.c.max_value < max_value, max_value)],
+                                                        else_=table.c.max_value),
+                                         sum_value=table.c.sum_value + sum_value,
+                                         count=table.c.count + count))
+        if result.rowcount == 0:
+            session.execute(table.insert().values(sensor_id=sensor_id,
+                                                  sensor_type=sensor_type,
+                                                  timestamp=timestamp,
+                                                  unit=unit,
+                                                  min_value=min_value,
+                                                  max_value=max_value,
+                                                  sum_value=sum_value,
+                                                  count=count))
+
+
+def backfill(database, chunk_size=10000):
+    """
+    Rebuilds all rollups from the stored readings. Ingestion must be stopped (stop the daemon first).
+    Every sensor and type is rebuilt in a transaction of its own, together with the removal of its old
+    rollups: an interrupted run leaves each of them either untouched or rebuilt and can simply be run again.
+    Readings are read chunk_size at a time. Returns the number of readings.
+    """
+    series = ReadingSeries.__table__
+    with scoped_session(database) as session:
+        keys = session.execute(select([series.c.sensor_id, series.c.sensor_type]).distinct()
+                               .order_by(series.c.sensor_id, series.c.sensor_type)).fetchall()
+
+    total = 0
+    for sensor_id, sensor_type in keys:
+        with scoped_session(database) as session:
+            total += _rebuild(session, sensor_id, sensor_type, chunk_size)
+    return total
+
+
+def _rebuild(session, sensor_id, sensor_type, chunk_size):
+    for model, period in RESOLUTIONS.values():
+        session.query(model).filter(model.sensor_id == sensor_id, model.sensor_type == sensor_type).delete()
+
+    table = Reading.__table__
+    series = ReadingSeries.__table__
+    query = select([table.c.series_id, table.c.timestamp, table.c.value, series.c.unit]) \
+        .select_from(table.join(series, series.c.id == table.c.series_id)) \
+        .where(and_(series.c.sensor_id == sensor_id, series.c.sensor_type == sensor_type)) \
+        .order_by(table.c.series_id, table.c.timestamp)
+    total = 0
+    last = None
+    while True:
+        chunk_query = query
+        if last is not None:
+            # keyset pagination over the primary key
+            chunk_query = query.where(or_(table.c.series_id > last.series_id,
+                                          and_(table.c.series_id == last.series_id,
+                                               table.c.timestamp > last.timestamp)))
+        rows = session.execute(chunk_query.limit(chunk_size)).fetchall()
+        if not rows:
+            return total
+
+        update_rollups(session, [{
+            'sensor_id': sensor_id,
+            'sensor_type': sensor_type,
+            'timestamp': r.timestamp,
+            'unit': r.unit,
+            'value': r.value,
+        } for r in rows])
+        total += len(rows)
+        last = rows[-1]
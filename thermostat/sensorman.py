@@ -1,33 +1,57 @@
 # -*- coding: utf-8 -*-
 """The Sensor Manager."""
 
+import time
 import asyncio
+import datetime
 import json
-import sqlalchemy.exc
 
 from sanic.log import logger
 from sqlalchemy.orm.exc import NoResultFound
 
-import hbmqtt.client as mqtt_client
 from dateutil.parser import parse as parse_date
 
 from .database import scoped_session
-from . import app
-from .models import Sensor, Reading
+from . import app, util, readingfilter
+from .models import Sensor
+from .models.sensors import get_last_readings
 from .sensors import get_sensor_handler
+from .writebehind import ReadingWriter
+from .ringbuffer import ReadingBufferPool
 
 
 class SensorManager(object):
 
     def __init__(self, database):
         self.database = database
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        self.broker = app.mqtt
         self.connected = False
-        # sensor_id: {...}
-        self.readings = {}
+        # recent readings for each (sensor_id, sensor_type)
+        self.buffers = ReadingBufferPool(int(app.config.get('READINGS_BUFFER_CAPACITY', 720)),
+                                         int(app.config.get('READINGS_BUFFER_MEMORY', 1048576)))
+        # sensor_id: type of the last reading
+        self.last_types = {}
+        # sensor_id: last reading, built from the buffers on demand (see readings)
+        self._readings = {}
+        # sensors with a new last reading since the last time readings was built
+        self._stale = set()
+        # (sensor_id, sensor_type): validity in seconds of the last reading, if given by the sensor
+        self.validity = {}
+        # readings older than this are not loaded at startup (unless they tell their own validity)
+        self.warm_start_age = int(app.config.get('READINGS_WARM_START_AGE', 600))
         self.sensors = {}
-        # subscription futures
-        self.sensors_subs = {}
+        # sensor_id: ingestion filter
+        self.filters = {}
+        # sensor_id: callbacks receiving the accepted readings (topic, data)
+        self.listeners = {}
+        self.counters = {'received': 0, 'filtered': 0}
+        self.topic = app.new_topic('sensor/+/+')
+        # write-behind queue for readings
+        self.writer = ReadingWriter(database,
+                                    int(app.config.get('READINGS_BATCH_SIZE', 50)),
+                                    float(app.config.get('READINGS_BATCH_AGE', 10)),
+                                    int(app.config.get('READINGS_QUEUE_MAX', 5000)))
+        self.writer.startup()
         self._init()
         # connect to broker
         asyncio.ensure_future(self._connect())
@@ -35,23 +59,47 @@ class SensorManager(object):
     def __getitem__(self, item):
         return self.sensors[item]
 
+    async def shutdown(self):
+        """Flushes any pending reading to the database."""
+        await self.writer.shutdown()
+
     def values(self):
         return self.sensors.values()
 
     async def _connect(self):
-        await self.broker.connect(app.broker_url)
+        await self.broker.connect()
         logger.info("Sensor Manager connected to broker")
+        # a single subscription for all sensors, messages are routed by sensor id
+        await self.broker.subscribe(self.topic, self._listen_sensor)
+        logger.debug("SENSORMANAGER subscribed to " + self.topic)
         self.connected = True
         for sensor_instance in self.sensors.values():
-            self.sensors_subs[sensor_instance.id] = \
-                asyncio.ensure_future(self._subscribe_and_startup_sensor(sensor_instance))
-        await asyncio.gather(*self.sensors_subs.values())
+            sensor_instance.startup()
 
     def _init(self):
-        with scoped_session(self.database) as session:
+        # runs once at startup, before serving requests
+        with scoped_session(self.database.session) as session:
             stmt = Sensor.__table__.select()
             for d in session.execute(stmt):
                 self._register(d['id'], d['protocol'], d['address'], d['sensor_type'], d['icon'])
+            self._warm_start(session)
+
+    def _warm_start(self, session):
+        """Loads the last valid reading of every sensor, so behaviors don't have to wait for sensors to publish."""
+        start = time.monotonic()
+        count = 0
+        # oldest first: the last type of each sensor is the one of its newest reading
+        for r in reversed(get_last_readings(session, None)):
+            if r.sensor_id not in self.sensors:
+                continue
+            if util.is_past_then(r.timestamp, r.validity if r.validity is not None else self.warm_start_age):
+                continue
+            if self.buffers.append(r.sensor_id, r.sensor_type, r.timestamp.timestamp(), r.unit, r.value):
+                self.last_types[r.sensor_id] = r.sensor_type
+                self._stale.add(r.sensor_id)
+                self.validity[(r.sensor_id, r.sensor_type)] = r.validity
+                count += 1
+        logger.info("Loaded {} readings at startup in {:.3f} seconds".format(count, time.monotonic() - start))
 
     def _register(self, sensor_id, protocol, address, sensor_type, icon):
         """Creates a new sensor and stores the instance in the internal collection."""
@@ -60,89 +108,174 @@ class SensorManager(object):
 
         sensor_instance = get_sensor_handler(sensor_id, protocol, address, sensor_type, icon)
         self.sensors[sensor_id] = sensor_instance
+        self.filters[sensor_id] = readingfilter.from_address(sensor_instance.address,
+                                                            float(app.config.get('READINGS_FILTER_DEADBAND', 0)),
+                                                            float(app.config.get('READINGS_FILTER_QUANTUM', 0)),
+                                                            float(app.config.get('READINGS_FILTER_HEARTBEAT', 600)))
         if self.connected:
-            self.sensors_subs[sensor_id] = asyncio.ensure_future(self._subscribe_and_startup_sensor(sensor_instance))
+            sensor_instance.startup()
 
     def _unregister(self, sensor_id):
         self.sensors[sensor_id].shutdown()
-        if sensor_id in self.sensors_subs:
-            self.sensors_subs[sensor_id].cancel()
-            del self.sensors_subs[sensor_id]
         del self.sensors[sensor_id]
+        del self.filters[sensor_id]
+        self.buffers.remove(sensor_id)
+        self.last_types.pop(sensor_id, None)
+        self._stale.add(sensor_id)
+        for key in [k for k in self.validity if k[0] == sensor_id]:
+            del self.validity[key]
+
+    async def _listen_sensor(self, topic, payload):
+        logger.debug("SENSORMANAGER topic={}, payload={}".format(topic, payload))
+        # topic is <base topic>/sensor/<sensor_id>/<sensor_type>
+        sensor_id, sensor_type = topic.rsplit('/', 2)[-2:]
+        if sensor_type == 'control':
+            # someone trying to control the sensor
+            return
+
+        sensor_instance = self.sensors.get(sensor_id)
+        if sensor_instance is None:
+            # unknown or unregistered sensor
+            return
+
+        data = json.loads(payload.decode())
+        reading_timestamp = parse_date(data['timestamp'])
+        validity = data.get('validity')
+        # even a filtered reading tells us the sensor is alive
+        sensor_instance.last_seen = datetime.datetime.now()
+        self.counters['received'] += 1
+
+        value = self.filters[sensor_id].accept(sensor_type, reading_timestamp.timestamp(), float(data['value']),
+                                               validity)
+        if value is None:
+            self.counters['filtered'] += 1
+            return
+        data['value'] = value
+
+        # queue reading for storage (duplicates e.g. our own last will are ignored)
+        self.store_reading(sensor_instance.id, sensor_type,
+                           reading_timestamp, data['unit'], value, validity)
+
+        # store reading in memory
+        if self.buffers.append(sensor_instance.id, sensor_type, reading_timestamp.timestamp(),
+                               data['unit'], value):
+            self.last_types[sensor_instance.id] = sensor_type
+            self._stale.add(sensor_instance.id)
+            self.validity[(sensor_instance.id, sensor_type)] = validity
+
+        for callback in self.listeners.get(sensor_id, []) + self.listeners.get(None, []):
+            await callback(topic, data)
 
-    async def _subscribe_and_startup_sensor(self, sensor_instance):
-        await self.broker.subscribe([(sensor_instance.topic + '/+', mqtt_client.QOS_0)])
-        logger.debug("SENSORMANAGER subscribed to " + sensor_instance.topic + '/+')
-        sensor_instance.startup()
-        await self._listen_sensor(sensor_instance)
-
-    async def _listen_sensor(self, sensor_instance):
-        while app.is_running and sensor_instance.is_running:
-            message = await self.broker.deliver_message()
-            logger.debug("SENSORMANAGER topic={}, payload={}".format(message.topic, message.data))
-            if message.topic.startswith(sensor_instance.topic):
-                topic = message.topic.split('/')
-                sensor_type = topic[-1]
-                if sensor_type == 'control':
-                    # someone trying to control the sensor
-                    continue
-
-                data = json.loads(message.data.decode())
-                reading_timestamp = parse_date(data['timestamp'])
-                # store reading in database
-                try:
-                    self.store_reading(sensor_instance.id, sensor_type,
-                                       reading_timestamp, data['unit'], data['value'])
-                except sqlalchemy.exc.IntegrityError:
-                    # we are trying to store our own last will
-                    pass
-
-                # store reading in cache
-                cache = self._reading_cache(sensor_instance.id)
-                cache['type'] = sensor_type
-                cache['timestamp'] = reading_timestamp
-                cache['unit'] = data['unit']
-                cache['value'] = float(data['value'])
-
-    def _reading_cache(self, sensor_id):
-        if sensor_id not in self.readings:
-            self.readings[sensor_id] = {}
-        return self.readings[sensor_id]
-
-    def store_reading(self, sensor_id, sensor_type, timestamp, unit, value):
-        with scoped_session(self.database) as session:
-            reading = Reading()
-            reading.sensor_id = sensor_id
-            reading.sensor_type = sensor_type
-            reading.timestamp = timestamp
-            reading.unit = unit
-            reading.value = value
-            session.add(reading)
-
-    def register(self, sensor_id, protocol, address, sensor_type, icon):
-        with scoped_session(self.database) as session:
-            sensor = Sensor()
-            sensor.id = sensor_id
-            sensor.protocol = protocol
-            sensor.address = address
-            sensor.sensor_type = sensor_type
-            sensor.icon = icon
-            sensor = session.merge(sensor)
-            # will also unregister old device if any
-            self._register(sensor.id, sensor.protocol, sensor.address, sensor.sensor_type, sensor.icon)
-
-    def unregister(self, sensor_id):
+    def add_listener(self, sensor_id, callback):
+        """
+        Registers a callback(topic, data) for the readings of a sensor that pass the ingestion filter.
+        With sensor_id None, the callback receives the readings of all sensors.
+        """
+        self.listeners.setdefault(sensor_id, []).append(callback)
+
+    def remove_listener(self, sensor_id, callback):
+        callbacks = self.listeners.get(sensor_id, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.listeners[sensor_id]
+
+    def stats(self):
+        """Counters of the ingestion filter."""
+        return dict(self.counters)
+
+    def _reading_cache(self, sensor_id, sensor_type):
+        """Builds the last reading of a series from its buffer."""
+        buf = self.buffers.get(sensor_id, sensor_type)
+        last = buf.last() if buf else None
+        if last is None:
+            return {}
+        reading = {
+            'type': sensor_type,
+            'timestamp': datetime.datetime.fromtimestamp(last[0]),
+            'unit': buf.unit,
+            'value': last[1],
+        }
+        validity = self.validity.get((sensor_id, sensor_type))
+        if validity is not None:
+            reading['validity'] = validity
+        return reading
+
+    @property
+    def readings(self):
+        """The last reading of each sensor (sensor_id: {...}). Shared, don't modify it."""
+        # only the readings changed since the last call are built again
+        for sensor_id in self._stale:
+            if sensor_id in self.last_types:
+                self._readings[sensor_id] = self._reading_cache(sensor_id, self.last_types[sensor_id])
+            else:
+                self._readings.pop(sensor_id, None)
+        self._stale.clear()
+        return self._readings
+
+    def get_history(self, sensor_id, sensor_type, start: float = None, end: float = None):
+        """Returns the buffered (timestamp, value) pairs of a series between start and end (epoch seconds)."""
+        buf = self.buffers.get(sensor_id, sensor_type)
+        if buf is None:
+            return []
+        return buf.window(start, end)
+
+    def store_reading(self, sensor_id, sensor_type, timestamp, unit, value, validity=None):
+        """Queues a reading for storage. It will be written by the next batch flush."""
+        self.writer.put({
+            'sensor_id': sensor_id,
+            'sensor_type': sensor_type,
+            'timestamp': timestamp,
+            'unit': unit,
+            'value': value,
+            'validity': validity,
+        })
+
+    async def register(self, sensor_id, protocol, address, sensor_type, icon):
+        await self.database.write(self._store_sensor, sensor_id, protocol, address, sensor_type, icon)
+        # will also unregister old device if any
+        self._register(sensor_id, protocol, address, sensor_type, icon)
+        app.changed('sensors')
+
+    async def unregister(self, sensor_id):
         try:
             self._unregister(sensor_id)
-            with scoped_session(self.database) as session:
-                device = session.query(Sensor).filter(Sensor.id == sensor_id).one()
-                session.delete(device)
+            app.changed('sensors')
+            await self.database.write(self._delete_sensor, sensor_id)
             return True
         except (NoResultFound, KeyError):
             return False
 
+    @staticmethod
+    def _store_sensor(session, sensor_id, protocol, address, sensor_type, icon):
+        sensor = Sensor()
+        sensor.id = sensor_id
+        sensor.protocol = protocol
+        sensor.address = address
+        sensor.sensor_type = sensor_type
+        sensor.icon = icon
+        session.merge(sensor)
+
+    @staticmethod
+    def _delete_sensor(session, sensor_id):
+        session.delete(session.query(Sensor).filter(Sensor.id == sensor_id).one())
+
     def get_last_reading(self, sensor_id):
-        return self._reading_cache(sensor_id)
+        return self.readings.get(sensor_id, {})
+
+    def get_sensor_data(self, sensor_id):
+        """The last reading of each type of a sensor, as published by the sensor (topic: data)."""
+        sensor = self.sensors.get(sensor_id)
+        if sensor is None:
+            return {}
+        data = {}
+        for (r_sensor_id, r_sensor_type), buf in self.buffers.series(sensor_id):
+            reading = self._reading_cache(r_sensor_id, r_sensor_type)
+            if reading:
+                del reading['type']
+                reading['timestamp'] = reading['timestamp'].isoformat()
+                data[sensor.topic + '/' + r_sensor_type] = reading
+        return data
 
     def get_last_readings(self, sensor_type=None):
         return {k: v for k, v in self.readings.items() if sensor_type is None or v['type'] == sensor_type}
@@ -3,12 +3,11 @@
 
 import asyncio
 import json
-import importlib
-import hbmqtt.client as mqtt_client
 
 from sanic.log import logger
 
 from .. import app
+from ..registry import SchemeRegistry
 
 
 class BaseSensorHandler(object):
@@ -19,24 +18,26 @@ class BaseSensorHandler(object):
         self.address = address
         self.type = sensor_type
         self.icon = icon
-        self.broker = mqtt_client.MQTTClient(config={'auto_reconnect': False})
+        self.broker = app.mqtt
         self.is_running = False
         self.timer = None
         self.topic = app.new_topic('sensor/' + sensor_id)
+        # when the last message was received from the sensor (filtered or not)
+        self.last_seen = None
 
     async def _connect(self):
-        await self.broker.connect(app.broker_url)
+        await self.broker.connect()
         logger.info("Sensor " + self.id + " connected to broker")
         await self.connected()
         # TODO what do we control here?
-        await self.broker.subscribe([(self.topic + '/control', mqtt_client.QOS_0)])
-        while self.is_running:
-            message = await self.broker.deliver_message()
-            logger.debug(self.id + " SENSOR topic={}, payload={}".format(message.topic, message.data))
-            await self.message(json.loads(message.data.decode()))
+        await self.broker.subscribe(self.topic + '/control', self._control)
+
+    async def _control(self, topic, payload):
+        logger.debug(self.id + " SENSOR topic={}, payload={}".format(topic, payload))
+        await self.message(json.loads(payload.decode()))
 
     async def _disconnect(self):
-        await self.broker.disconnect()
+        await self.broker.unsubscribe(self.topic + '/control', self._control)
         await self.disconnected()
 
     def start_timer(self, seconds):
@@ -78,13 +79,13 @@ class BaseSensorHandler(object):
         return 'sensor:' + self.id
 
 
+# protocol modules are imported when a sensor using them is registered
+registry = SchemeRegistry(__name__, 'thermostat.sensors')
+
+
 def get_sensor_handler(sensor_id: str, protocol: str, address: str, sensor_type: str, icon: str) -> BaseSensorHandler:
     """Returns an appropriate sensor handler for the given protocol and address."""
-    module = importlib.import_module('.'+protocol, __name__)
-    if module:
-        schemes = getattr(module, 'schemes')
-        if schemes:
-            scheme_part, address_part = address.split(':', 1)
-            if scheme_part in schemes:
-                handler_class = schemes[scheme_part]
-                return handler_class(sensor_id, address_part, sensor_type, icon)
+    scheme_part, address_part = address.split(':', 1)
+    handler_class = registry.get(protocol, scheme_part)
+    if handler_class:
+        return handler_class(sensor_id, address_part, sensor_type, icon)
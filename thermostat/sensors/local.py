@@ -8,20 +8,29 @@ from random import randint, random
 import urllib.parse as urllib_parse
 
 import importlib.util
-try:
-    importlib.util.find_spec('RPi.GPIO')
-    import RPi.GPIO as GPIO
-    fakeSensors = False
-except ImportError:
-    from fake_rpi.RPi import GPIO as GPIO
-    fakeSensors = True
-
-# will skip W1ThermSensor modprobe call
-os.environ['W1THERMSENSOR_NO_KERNEL_MODULE'] = '1'
-from w1thermsensor import W1ThermSensor
 
 from . import BaseSensorHandler
 
+# the 1-Wire library is imported when the first 1-Wire sensor is created
+_w1thermsensor = None
+
+
+def get_w1thermsensor():
+    """Returns the W1ThermSensor class, or None when not running on a Raspberry (temperatures will be random)."""
+    global _w1thermsensor
+    if _w1thermsensor is None:
+        try:
+            importlib.util.find_spec('RPi.GPIO')
+            import RPi.GPIO
+        except ImportError:
+            _w1thermsensor = False
+        else:
+            # will skip W1ThermSensor modprobe call
+            os.environ['W1THERMSENSOR_NO_KERNEL_MODULE'] = '1'
+            from w1thermsensor import W1ThermSensor
+            _w1thermsensor = W1ThermSensor
+    return _w1thermsensor or None
+
 
 class MQTTLocalSensorHandler(BaseSensorHandler):
     """A placeholder sensor handler for data received through the local MQTT broker."""
@@ -106,6 +115,7 @@ class GPIOW1SensorHandler(BaseSensorHandler):
             self.sensor_address = params['address'][0]
         else:
             self.sensor_address = None
+        self.w1thermsensor = get_w1thermsensor()
 
     def startup(self):
         BaseSensorHandler.startup(self)
@@ -126,12 +136,12 @@ class GPIOW1SensorHandler(BaseSensorHandler):
                 }, '/temperature', retain=True)
 
     def _read(self):
-        if fakeSensors:
+        if self.w1thermsensor is None:
             # random temperature :D
             temp = randint(-10, 40)
         else:
-            sensor = W1ThermSensor(sensor_id=self.sensor_address)
-            temp = sensor.get_temperature(unit=W1ThermSensor.DEGREES_C)
+            sensor = self.w1thermsensor(sensor_id=self.sensor_address)
+            temp = sensor.get_temperature(unit=self.w1thermsensor.DEGREES_C)
 
         # round it up to the nearest half since it's all we are interested in
         return round(temp * 2) / 2
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Utilities."""
 
+import asyncio
 import datetime
+import collections
 
 
 def is_past_then(dt, seconds: int):
@@ -12,3 +14,53 @@ def is_past_then(dt, seconds: int):
         except ValueError:
             dt = datetime.datetime.strptime(dt, '%Y-%m-%dT%H:%M:%S')
     return (datetime.datetime.now() - dt).total_seconds() > seconds
+
+
+class LoopLagMonitor(object):
+    """
+    Measures the event loop lag: how late a coroutine sleeping for a fixed interval wakes up.
+    Anything blocking the loop (e.g. synchronous I/O) shows up as lag.
+    """
+
+    # samples kept for the recent maximum
+    WINDOW = 120
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.recent = collections.deque(maxlen=self.WINDOW)
+        self.samples = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._task = None
+
+    def startup(self):
+        self._task = asyncio.ensure_future(self._loop())
+
+    def shutdown(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.sample(loop.time() - start - self.interval)
+
+    def sample(self, lag: float):
+        lag = max(0.0, lag)
+        self.recent.append(lag)
+        self.samples += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'last': self.recent[-1] if self.recent else 0.0,
+            'mean': self.total / self.samples if self.samples else 0.0,
+            'max': self.max,
+            'recent_max': max(self.recent) if self.recent else 0.0,
+        }
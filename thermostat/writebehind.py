@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Write-behind queues for batched database inserts."""
+
+import time
+import asyncio
+import collections
+
+from sanic.log import logger
+from sqlalchemy import and_, select
+
+from .database import scoped_session
+from .models import Reading
+from .models.sensors import get_series_id, reading_epoch, update_latest_readings
+from . import rollups
+
+
+class WriteBehindQueue(object):
+    """
+    Buffers rows in memory and writes them to the database in batches.
+
+    A flush is triggered when the queue reaches batch_size items or when the
+    oldest pending item is older than max_age seconds. The queue is bounded to
+    max_pending items: when full, the oldest pending item is dropped.
+    Batches are written by the writer thread of the given AsyncDatabase.
+    """
+
+    def __init__(self, database, batch_size: int = 50, max_age: float = 10, max_pending: int = 5000):
+        self.database = database
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.queue = collections.deque()
+        self.flush_lock = asyncio.Lock()
+        # set when the queue goes from empty to non-empty
+        self.pending = asyncio.Event()
+        self.counters = {
+            'queued': 0,
+            'written': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'errors': 0,
+            'last_flush_latency': 0.0,
+            'max_flush_latency': 0.0,
+        }
+        self.is_running = False
+        self._age_task = None
+
+    def startup(self):
+        self.is_running = True
+        self._age_task = asyncio.ensure_future(self._age_loop())
+
+    async def shutdown(self):
+        """Stops the age timer and writes everything still pending."""
+        self.is_running = False
+        if self._age_task:
+            self._age_task.cancel()
+            self._age_task = None
+        await self.flush()
+
+    def put(self, item: dict):
+        """Enqueues a row. Never blocks: the oldest row is dropped on overflow."""
+        if len(self.queue) >= self.max_pending:
+            self.queue.popleft()
+            self.counters['dropped'] += 1
+        self.queue.append(item)
+        self.counters['queued'] += 1
+        self.pending.set()
+        if len(self.queue) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['depth'] = len(self.queue)
+        return stats
+
+    async def _age_loop(self):
+        while self.is_running:
+            await self.pending.wait()
+            await asyncio.sleep(self.max_age)
+            await self.flush()
+
+    async def flush(self):
+        """Writes all pending rows in a single transaction. Returns the number of rows written."""
+        with await self.flush_lock:
+            if not self.queue:
+                return 0
+
+            batch = self._take()
+
+            start = time.monotonic()
+            try:
+                await self.database.run_writer(self._write, batch)
+            except Exception:
+                logger.error("Unable to write batch, requeuing", exc_info=1)
+                self.counters['errors'] += 1
+                self._requeue(batch)
+                return 0
+            self._written(batch)
+
+            latency = time.monotonic() - start
+            self.counters['flushes'] += 1
+            self.counters['written'] += len(batch)
+            self.counters['last_flush_latency'] = latency
+            self.counters['max_flush_latency'] = max(latency, self.counters['max_flush_latency'])
+            return len(batch)
+
+    def _take(self):
+        """Removes all pending items from the queue and returns them as a batch."""
+        batch = list(self.queue)
+        self.queue.clear()
+        self.pending.clear()
+        return batch
+
+    def _written(self, batch):
+        """Called after a batch has been written."""
+        pass
+
+    def _requeue(self, batch):
+        self.queue.extendleft(reversed(batch))
+        while len(self.queue) > self.max_pending:
+            self.queue.popleft()
+            self.counters['dropped'] += 1
+        if self.queue:
+            self.pending.set()
+
+    def _write(self, batch):
+        with scoped_session(self.database.session) as session:
+            self.write(session, batch)
+
+    def write(self, session, batch):
+        """Executes the actual inserts. Runs in a worker thread."""
+        raise NotImplementedError()
+
+
+class ReadingWriter(WriteBehindQueue):
+    """Write-behind queue for sensor readings. Rollups and latest readings are updated in the same transaction."""
+
+    def __init__(self, database, batch_size: int = 50, max_age: float = 10, max_pending: int = 5000):
+        WriteBehindQueue.__init__(self, database, batch_size, max_age, max_pending)
+        # duplicates (e.g. our own last will) are silently ignored
+        self.statement = Reading.__table__.insert() \
+            .prefix_with('OR IGNORE', dialect='sqlite') \
+            .prefix_with('IGNORE', dialect='mysql')
+        # (sensor_id, sensor_type, unit): series id
+        self.series = {}
+
+    def _write(self, batch):
+        try:
+            WriteBehindQueue._write(self, batch)
+        except Exception:
+            # series created by the failed transaction don't exist anymore
+            self.series.clear()
+            raise
+
+    def series_id(self, session, sensor_id, sensor_type, unit):
+        key = (sensor_id, sensor_type, unit or '')
+        series_id = self.series.get(key)
+        if series_id is None:
+            series_id = self.series[key] = get_series_id(session, sensor_id, sensor_type, unit)
+        return series_id
+
+    def write(self, session, batch):
+        rows = {}
+        for reading in batch:
+            key = (self.series_id(session, reading['sensor_id'], reading['sensor_type'], reading['unit']),
+                   reading_epoch(reading['timestamp']))
+            # like the insert, the first duplicate wins
+            if key not in rows:
+                rows[key] = reading
+        if not rows:
+            return
+
+        # readings already stored are ignored by the insert: find them with a single keyed query
+        # (no other writer can store them in between, this is the writer thread)
+        table = Reading.__table__
+        timestamps = [key[1] for key in rows]
+        existing = set(tuple(r) for r in session.execute(
+            select([table.c.series_id, table.c.timestamp])
+            .where(and_(table.c.series_id.in_(set(key[0] for key in rows)),
+                        table.c.timestamp.between(min(timestamps), max(timestamps))))))
+
+        session.execute(self.statement, [{'series_id': series_id, 'timestamp': timestamp, 'value': float(r['value'])}
+                                         for (series_id, timestamp), r in rows.items()])
+        stored = [reading for key, reading in rows.items() if key not in existing]
+        rollups.update_rollups(session, stored)
+        update_latest_readings(session, stored)
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Rebuilds the sensor readings rollup tables from the stored readings. Stop the daemon first."""
+
+from argparse import ArgumentParser
+
+from sanic.config import Config
+
+from thermostat import database, rollups
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument('-c', '--config', type=str, default='/etc/thermostat.conf', help='path to configuration file')
+parser.add_argument('--chunk-size', type=int, default=10000, help='readings read by a single query')
+args = parser.parse_args()
+
+config = Config()
+config.from_pyfile(args.config)
+
+count = rollups.backfill(database.init(config.DATABASE_URL), args.chunk_size)
+print("Rollups rebuilt from {} readings".format(count))
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Enables incremental vacuum on the SQLite database (full vacuum, might take a while). Stop the daemon first."""
+
+from argparse import ArgumentParser
+
+from sanic.config import Config
+
+from thermostat import database, maintenance
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument('-c', '--config', type=str, default='/etc/thermostat.conf', help='path to configuration file')
+args = parser.parse_args()
+
+config = Config()
+config.from_pyfile(args.config)
+
+if maintenance.enable_incremental_vacuum(database.init(config.DATABASE_URL).kw['bind']):
+    print("Incremental vacuum enabled")
+else:
+    print("Incremental vacuum already enabled")